@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""Run one device-interfaces.yaml operation across many devices in parallel.
+
+Devices are selected by ``--role``, ``--kind``, ``--tag`` (entries' optional
+``tags`` list) or explicit ``--device`` ids; each must define the named
+operation. Requests follow the Fleet API's operation semantics: the
+operation's ``body`` is merged with the payload given here, GET/DELETE send
+it as query parameters and everything else as JSON, and bearer tokens come
+from ``api.auth.token_env``.
+
+Requests share the keep-alive pool from ``fleet_health`` with a concurrency
+cap and a per-device timeout. Operations are not retried because most of
+them are not idempotent. One JSON line is printed per device as soon as it
+finishes, followed by a summary line with the total wall time. With
+``--canary N`` the first N devices run alone first, and the rest only follow
+if every canary succeeded.
+
+Exit status: 0 when every device succeeded, 2 when any failed or was
+skipped, 1 on usage or inventory errors.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlencode
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from fleet_health import DEFAULT_INTERFACES, HttpError, HttpPool  # noqa: E402
+from inventory_to_json import YamlError, load_compiled  # noqa: E402
+
+DEFAULT_TIMEOUT = float(os.environ.get("FLEET_BATCH_TIMEOUT", "5"))
+DEFAULT_CONCURRENCY = int(os.environ.get("FLEET_BATCH_CONCURRENCY", "8"))
+EXIT_FAILED = 2
+
+
+@dataclass
+class Target:
+    id: str
+    role: str
+    kind: str
+    method: str
+    url: str
+    payload: Any
+    token: Optional[str] = None
+
+
+@dataclass
+class TargetResult:
+    device: str
+    stage: str
+    ok: bool
+    status: Optional[int] = None
+    latency_ms: Optional[float] = None
+    error: Optional[str] = None
+    data: Any = None
+
+
+def merge_payload(base: Any, override: Any) -> Any:
+    """Shallow-merge mappings (override wins), else prefer the override."""
+    if isinstance(base, dict) and isinstance(override, dict):
+        return {**base, **override}
+    if override is not None:
+        return override
+    return base
+
+
+def select_targets(
+    doc: Any,
+    operation_id: str,
+    payload: Any = None,
+    roles: Optional[List[str]] = None,
+    kinds: Optional[List[str]] = None,
+    tags: Optional[List[str]] = None,
+    devices: Optional[List[str]] = None,
+    value: Any = None,
+    overrides: Optional[Dict[str, str]] = None,
+) -> List[Target]:
+    """Resolve the selection into one request per device, in inventory order.
+
+    ``value`` fills the operation's ``ui.body_key`` (slider operations).
+    Raises ``ValueError`` when a selected device lacks the operation.
+    """
+    entries = doc.get("devices") if isinstance(doc, dict) else None
+    if not isinstance(entries, list):
+        raise ValueError("top-level 'devices' list missing")
+    overrides = overrides or {}
+    targets: List[Target] = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("id"):
+            continue
+        device_id = str(entry["id"])
+        if devices and device_id not in devices:
+            continue
+        if roles and entry.get("role") not in roles:
+            continue
+        if kinds and entry.get("kind") not in kinds:
+            continue
+        if tags and not set(tags) & set(entry.get("tags") or []):
+            continue
+        operation = next(
+            (op for op in entry.get("operations") or [] if isinstance(op, dict) and op.get("id") == operation_id),
+            None,
+        )
+        if operation is None:
+            raise ValueError(f"operation '{operation_id}' is not defined for {device_id}")
+        api = entry.get("api") if isinstance(entry.get("api"), dict) else {}
+        base_url = overrides.get(device_id) or api.get("base_url")
+        if not base_url:
+            raise ValueError(f"device {device_id} has no api.base_url")
+        body = merge_payload(operation.get("body"), payload)
+        if value is not None:
+            body_key = (operation.get("ui") or {}).get("body_key")
+            if not body_key:
+                raise ValueError(f"operation '{operation_id}' on {device_id} has no ui.body_key for --value")
+            body = merge_payload(body, {body_key: value})
+        auth = api.get("auth") if isinstance(api.get("auth"), dict) else {}
+        token_env = auth.get("token_env")
+        targets.append(
+            Target(
+                id=device_id,
+                role=str(entry.get("role") or ""),
+                kind=str(entry.get("kind") or ""),
+                method=str(operation.get("method") or "POST").upper(),
+                url=str(base_url).rstrip("/") + str(operation.get("path") or "/"),
+                payload=body,
+                token=(os.environ.get(token_env) if token_env else None) or None,
+            )
+        )
+    return targets
+
+
+async def run_one(pool: HttpPool, target: Target, stage: str, timeout: float) -> TargetResult:
+    headers: Dict[str, str] = {"Accept": "application/json"}
+    if target.token:
+        headers["Authorization"] = f"Bearer {target.token}"
+    url = target.url
+    body: Optional[bytes] = None
+    if target.method in ("GET", "DELETE"):
+        if isinstance(target.payload, dict) and target.payload:
+            url += ("&" if "?" in url else "?") + urlencode(target.payload)
+    elif target.payload is not None:
+        headers["Content-Type"] = "application/json"
+        body = json.dumps(target.payload).encode("utf-8")
+    started = time.perf_counter()
+    try:
+        response = await pool.request(target.method, url, headers, timeout=timeout, body=body)
+    except asyncio.TimeoutError:
+        return TargetResult(target.id, stage, False, error="timeout")
+    except (HttpError, OSError, ValueError) as exc:
+        return TargetResult(target.id, stage, False, error=str(exc) or exc.__class__.__name__)
+    latency = round((time.perf_counter() - started) * 1000, 2)
+    text = response.body.decode("utf-8", "replace")
+    try:
+        data: Any = json.loads(text) if text else None
+    except ValueError:
+        data = text.strip()[:500]
+    ok = 200 <= response.status < 300
+    return TargetResult(
+        target.id,
+        stage,
+        ok,
+        status=response.status,
+        latency_ms=latency,
+        error=None if ok else f"HTTP {response.status}",
+        data=data,
+    )
+
+
+async def run_batch(
+    targets: List[Target],
+    timeout: float = DEFAULT_TIMEOUT,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    canary: int = 0,
+    on_result: Optional[Callable[[TargetResult], None]] = None,
+) -> Dict[str, Any]:
+    """Run ``targets`` and return the summary; ``on_result`` sees each result as it lands."""
+    # Each device is its own origin, so per-host limiting only guards duplicates.
+    pool = HttpPool(per_host=concurrency, concurrency=concurrency)
+    stages = [("canary", targets[:canary]), ("rollout", targets[canary:])] if canary > 0 else [("rollout", targets)]
+    results: List[TargetResult] = []
+    started = time.perf_counter()
+    aborted = False
+    try:
+        for stage, batch in stages:
+            if aborted:
+                for target in batch:
+                    result = TargetResult(target.id, stage, False, error="skipped: canary failed")
+                    results.append(result)
+                    if on_result:
+                        on_result(result)
+                continue
+            stage_results: List[TargetResult] = []
+            for finished in asyncio.as_completed([run_one(pool, t, stage, timeout) for t in batch]):
+                result = await finished
+                stage_results.append(result)
+                if on_result:
+                    on_result(result)
+            results += stage_results
+            if stage == "canary" and not all(r.ok for r in stage_results):
+                aborted = True
+    finally:
+        await pool.close()
+    return {
+        "devices": len(targets),
+        "succeeded": sum(1 for r in results if r.ok),
+        "failed": sum(1 for r in results if not r.ok and not (r.error or "").startswith("skipped")),
+        "skipped": sum(1 for r in results if (r.error or "").startswith("skipped")),
+        "aborted": aborted,
+        "wall_ms": round((time.perf_counter() - started) * 1000, 2),
+        "slowest_ms": max((r.latency_ms or 0 for r in results), default=0),
+    }
+
+
+def _json_arg(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _key_value(text: str):
+    key, sep, value = text.partition("=")
+    if not sep or not key:
+        raise argparse.ArgumentTypeError("expected KEY=VALUE")
+    return key, value
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("operation", help="operation id from device-interfaces.yaml (e.g. volume, play_stream)")
+    parser.add_argument("--interfaces", type=pathlib.Path, default=DEFAULT_INTERFACES)
+    parser.add_argument("--role", action="append", help="select devices with this role (repeatable)")
+    parser.add_argument("--kind", action="append", help="select devices of this kind (repeatable)")
+    parser.add_argument("--tag", action="append", help="select devices carrying this tag (repeatable)")
+    parser.add_argument("--device", action="append", help="select this device id (repeatable)")
+    parser.add_argument("--payload", type=json.loads, help="JSON merged over the operation's body")
+    parser.add_argument("--set", action="append", type=_key_value, default=[], metavar="KEY=VALUE",
+                        help="set one payload field; VALUE is parsed as JSON when possible")
+    parser.add_argument("--value", type=_json_arg, help="value for the operation's ui.body_key (sliders)")
+    parser.add_argument("--override", action="append", type=_key_value, default=[], metavar="ID=URL",
+                        help="use URL instead of the device's api.base_url")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="per-device timeout (s)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--canary", type=int, default=0, metavar="N",
+                        help="run the first N devices alone and stop if any of them fails")
+    parser.add_argument("--dry-run", action="store_true", help="print the resolved requests and exit")
+    args = parser.parse_args()
+
+    if not (args.role or args.kind or args.tag or args.device):
+        parser.error("select devices with --role, --kind, --tag or --device")
+    payload = args.payload
+    if args.set:
+        payload = merge_payload(payload if isinstance(payload, dict) else {},
+                                {k: _json_arg(v) for k, v in args.set})
+
+    try:
+        doc = load_compiled(args.interfaces)["document"]
+        targets = select_targets(
+            doc,
+            args.operation,
+            payload=payload,
+            roles=args.role,
+            kinds=args.kind,
+            tags=args.tag,
+            devices=args.device,
+            value=args.value,
+            overrides=dict(args.override),
+        )
+    except FileNotFoundError:
+        print(f"interfaces file not found: {args.interfaces}", file=sys.stderr)
+        return 1
+    except YamlError as exc:
+        print(f"{args.interfaces}:{exc.line}:{exc.column}: {exc.message}", file=sys.stderr)
+        return 1
+    except ValueError as exc:
+        print(str(exc), file=sys.stderr)
+        return 1
+    if not targets:
+        print("no devices matched the selection", file=sys.stderr)
+        return 1
+
+    if args.dry_run:
+        for target in targets:
+            plan = asdict(target)
+            plan["token"] = bool(target.token)
+            print(json.dumps(plan, sort_keys=True))
+        return 0
+
+    def emit(result: TargetResult) -> None:
+        print(json.dumps(asdict(result), sort_keys=True), flush=True)
+
+    summary = asyncio.run(
+        run_batch(targets, timeout=args.timeout, concurrency=args.concurrency, canary=args.canary, on_result=emit)
+    )
+    print(json.dumps({"summary": summary}, sort_keys=True), flush=True)
+    return 0 if summary["succeeded"] == summary["devices"] else EXIT_FAILED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""Fleet-wide health, status and metrics snapshot from device-interfaces.yaml.
+
+Every device's ``api.health_path``, ``status_path`` and ``metrics_path`` are
+fetched concurrently over pooled keep-alive HTTP/1.1 connections (standard
+library only, like the inventory loader). Concurrency is bounded both overall
+and per host, each request has its own timeout, failed requests are retried
+with backoff, and the whole run is cut off at a deadline so one hung device
+cannot stall the snapshot.
+
+The merged snapshot is printed as JSON or Prometheus text. ``--override
+ID=URL`` points a device at a local stand-in server. Exit status: 0 when every
+device is healthy, 2 when at least one is degraded or down, 1 on usage or
+inventory errors.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import ssl
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from inventory_to_json import YamlError, load_compiled  # noqa: E402
+
+DEFAULT_INTERFACES = pathlib.Path(__file__).resolve().parents[2] / "inventory" / "device-interfaces.yaml"
+DEFAULT_TIMEOUT = float(os.environ.get("FLEET_HEALTH_TIMEOUT", "3"))
+DEFAULT_DEADLINE = float(os.environ.get("FLEET_HEALTH_DEADLINE", "10"))
+DEFAULT_RETRIES = int(os.environ.get("FLEET_HEALTH_RETRIES", "1"))
+DEFAULT_PER_HOST = int(os.environ.get("FLEET_HEALTH_PER_HOST", "2"))
+DEFAULT_CONCURRENCY = int(os.environ.get("FLEET_HEALTH_CONCURRENCY", "16"))
+RETRY_BACKOFF = 0.2
+MAX_BODY_BYTES = 4 * 1024 * 1024
+USER_AGENT = "fleet-health/1"
+EXIT_UNHEALTHY = 2
+
+ENDPOINTS = (("health", "health_path"), ("status", "status_path"), ("metrics", "metrics_path"))
+
+
+class HttpError(Exception):
+    pass
+
+
+class _StaleConnection(HttpError):
+    """A pooled connection was closed by the peer before answering."""
+
+
+@dataclass
+class Response:
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+
+@dataclass
+class Device:
+    id: str
+    role: str
+    base_url: str
+    paths: Dict[str, str]
+    token: Optional[str] = None
+
+
+@dataclass
+class EndpointResult:
+    ok: bool
+    status: Optional[int] = None
+    latency_ms: Optional[float] = None
+    attempts: int = 0
+    error: Optional[str] = None
+    body: Any = None
+
+
+@dataclass
+class DeviceResult:
+    id: str
+    role: str
+    base_url: str
+    state: str = "down"
+    latency_ms: Optional[float] = None
+    endpoints: Dict[str, EndpointResult] = field(default_factory=dict)
+
+
+class HttpPool:
+    """Keep-alive HTTP/1.1 connections pooled per (scheme, host, port).
+
+    ``per_host`` bounds concurrent requests to one origin, ``concurrency``
+    bounds them overall; idle connections are reused by later requests.
+    """
+
+    def __init__(self, per_host: int = DEFAULT_PER_HOST, concurrency: int = DEFAULT_CONCURRENCY):
+        self.per_host = max(per_host, 1)
+        self._global = asyncio.Semaphore(max(concurrency, 1))
+        self._hosts: Dict[Tuple[str, str, int], asyncio.Semaphore] = {}
+        self._idle: Dict[Tuple[str, str, int], List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]] = {}
+        self._ssl: Optional[ssl.SSLContext] = None
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    async def close(self) -> None:
+        writers = [w for conns in self._idle.values() for _, w in conns]
+        self._idle.clear()
+        for writer in writers:
+            writer.close()
+        await asyncio.gather(*(w.wait_closed() for w in writers), return_exceptions=True)
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        body: Optional[bytes] = None,
+    ) -> Response:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise HttpError(f"unsupported URL {url!r}")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        origin = (parts.scheme, parts.hostname, port)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        lines = [
+            f"{method} {target} HTTP/1.1",
+            f"Host: {parts.netloc}",
+            f"User-Agent: {USER_AGENT}",
+            "Accept-Encoding: identity",
+            "Connection: keep-alive",
+        ]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        if body is not None or method in ("POST", "PUT", "PATCH"):
+            lines.append(f"Content-Length: {len(body or b'')}")
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b"")
+
+        host_sem = self._hosts.setdefault(origin, asyncio.Semaphore(self.per_host))
+        async with self._global, host_sem:
+            return await asyncio.wait_for(self._exchange(origin, payload, method), timeout)
+
+    async def _exchange(self, origin: Tuple[str, str, int], payload: bytes, method: str) -> Response:
+        idle = self._idle.setdefault(origin, [])
+        while idle:
+            reader, writer = idle.pop()
+            if writer.is_closing() or reader.at_eof():
+                writer.close()
+                continue
+            self.connections_reused += 1
+            try:
+                return await self._roundtrip(origin, reader, writer, payload, method)
+            except _StaleConnection:
+                continue
+        scheme, host, port = origin
+        if scheme == "https" and self._ssl is None:
+            self._ssl = ssl.create_default_context()
+        reader, writer = await asyncio.open_connection(host, port, ssl=self._ssl if scheme == "https" else None)
+        self.connections_opened += 1
+        try:
+            return await self._roundtrip(origin, reader, writer, payload, method)
+        except _StaleConnection as exc:
+            raise HttpError("connection closed without a response") from exc
+
+    async def _roundtrip(
+        self,
+        origin: Tuple[str, str, int],
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        payload: bytes,
+        method: str,
+    ) -> Response:
+        reusable = False
+        try:
+            try:
+                writer.write(payload)
+                await writer.drain()
+                status_line = await reader.readline()
+            except ConnectionError as exc:
+                raise _StaleConnection() from exc
+            if not status_line:
+                raise _StaleConnection()
+            parts = status_line.decode("latin-1").split(None, 2)
+            if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+                raise HttpError(f"malformed status line {status_line[:60]!r}")
+            status = int(parts[1])
+            headers: Dict[str, str] = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body, reusable = await self._read_body(reader, headers, status, method)
+            if parts[0] == "HTTP/1.0" or headers.get("connection", "").lower() == "close":
+                reusable = False
+            return Response(status, headers, body)
+        except (ConnectionError, asyncio.IncompleteReadError) as exc:
+            raise HttpError(str(exc) or exc.__class__.__name__) from exc
+        finally:
+            if reusable:
+                self._idle.setdefault(origin, []).append((reader, writer))
+            else:
+                writer.close()
+
+    @staticmethod
+    async def _read_body(
+        reader: asyncio.StreamReader,
+        headers: Dict[str, str],
+        status: int,
+        method: str,
+    ) -> Tuple[bytes, bool]:
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            return b"", True
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            chunks: List[bytes] = []
+            total = 0
+            while True:
+                size_line = await reader.readline()
+                size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                if size == 0:
+                    # Trailers end with an empty line.
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks), True
+                total += size
+                if total > MAX_BODY_BYTES:
+                    raise HttpError("response body too large")
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+        if "content-length" in headers:
+            length = int(headers["content-length"])
+            if length > MAX_BODY_BYTES:
+                raise HttpError("response body too large")
+            return await reader.readexactly(length), True
+        body = await reader.read(MAX_BODY_BYTES + 1)
+        if len(body) > MAX_BODY_BYTES:
+            raise HttpError("response body too large")
+        return body, False
+
+
+def load_devices(
+    interfaces: pathlib.Path,
+    overrides: Optional[Dict[str, str]] = None,
+    only: Optional[List[str]] = None,
+) -> List[Device]:
+    """Read device API descriptors; bearer tokens come from ``auth.token_env``."""
+    doc = load_compiled(interfaces)["document"]
+    entries = doc.get("devices") if isinstance(doc, dict) else None
+    if not isinstance(entries, list):
+        raise ValueError(f"{interfaces}: top-level 'devices' list missing")
+    overrides = overrides or {}
+    devices: List[Device] = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("id"):
+            continue
+        device_id = str(entry["id"])
+        if only and device_id not in only:
+            continue
+        api = entry.get("api") if isinstance(entry.get("api"), dict) else {}
+        base_url = overrides.get(device_id) or api.get("base_url")
+        if not base_url:
+            continue
+        auth = api.get("auth") if isinstance(api.get("auth"), dict) else {}
+        token_env = auth.get("token_env")
+        token = os.environ.get(token_env) if token_env else None
+        devices.append(
+            Device(
+                id=device_id,
+                role=str(entry.get("role") or ""),
+                base_url=str(base_url).rstrip("/"),
+                paths={name: str(api[key]) for name, key in ENDPOINTS if api.get(key)},
+                token=token or None,
+            )
+        )
+    return devices
+
+
+async def fetch_endpoint(
+    pool: HttpPool,
+    device: Device,
+    name: str,
+    deadline: float,
+    timeout: float,
+    retries: int,
+) -> EndpointResult:
+    url = device.base_url + device.paths[name]
+    headers = {"Authorization": f"Bearer {device.token}"} if device.token else {}
+    result = EndpointResult(ok=False)
+    loop = asyncio.get_running_loop()
+    for attempt in range(retries + 1):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            result.error = result.error or "deadline exceeded"
+            break
+        result.attempts = attempt + 1
+        started = time.perf_counter()
+        try:
+            response = await pool.request("GET", url, headers, timeout=min(timeout, remaining))
+        except asyncio.TimeoutError:
+            result.error = "timeout"
+        except (HttpError, OSError, ValueError) as exc:
+            result.error = str(exc) or exc.__class__.__name__
+        else:
+            result.latency_ms = round((time.perf_counter() - started) * 1000, 2)
+            result.status = response.status
+            result.ok = 200 <= response.status < 300
+            result.error = None if result.ok else f"HTTP {response.status}"
+            if result.ok:
+                result.body = _summarise(name, response)
+            # 4xx (auth, missing route) will not change on retry.
+            if result.ok or response.status < 500:
+                break
+        if attempt < retries:
+            await asyncio.sleep(min(RETRY_BACKOFF * (2 ** attempt), max(deadline - loop.time(), 0)))
+    return result
+
+
+def _summarise(name: str, response: Response) -> Any:
+    text = response.body.decode("utf-8", "replace")
+    if name == "metrics":
+        samples = sum(1 for line in text.splitlines() if line and not line.startswith("#"))
+        return {"samples": samples, "bytes": len(response.body)}
+    if "json" in response.headers.get("content-type", ""):
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass
+    return text.strip()[:200]
+
+
+async def check_device(
+    pool: HttpPool,
+    device: Device,
+    deadline: float,
+    timeout: float,
+    retries: int,
+    include_metrics: bool = True,
+) -> DeviceResult:
+    names = [n for n, _ in ENDPOINTS if n in device.paths and (include_metrics or n != "metrics")]
+    results = await asyncio.gather(
+        *(fetch_endpoint(pool, device, n, deadline, timeout, retries) for n in names)
+    )
+    outcome = DeviceResult(id=device.id, role=device.role, base_url=device.base_url)
+    outcome.endpoints = dict(zip(names, results))
+    health = outcome.endpoints.get("health")
+    if health is not None:
+        outcome.latency_ms = health.latency_ms
+    healthy = health.ok if health is not None else any(r.ok for r in results)
+    if healthy and all(r.ok for r in results):
+        outcome.state = "ok"
+    elif healthy:
+        outcome.state = "degraded"
+    return outcome
+
+
+async def collect(
+    devices: List[Device],
+    timeout: float = DEFAULT_TIMEOUT,
+    deadline: float = DEFAULT_DEADLINE,
+    retries: int = DEFAULT_RETRIES,
+    per_host: int = DEFAULT_PER_HOST,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    include_metrics: bool = True,
+) -> Dict[str, Any]:
+    """Fetch every device once and return the merged snapshot."""
+    pool = HttpPool(per_host=per_host, concurrency=concurrency)
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    until = loop.time() + deadline
+    try:
+        outcomes = await asyncio.gather(
+            *(check_device(pool, d, until, timeout, retries, include_metrics) for d in devices)
+        )
+    finally:
+        await pool.close()
+    summary = {"ok": 0, "degraded": 0, "down": 0}
+    for outcome in outcomes:
+        summary[outcome.state] += 1
+    return {
+        "generated_at": time.time(),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        "summary": summary,
+        "connections": {"opened": pool.connections_opened, "reused": pool.connections_reused},
+        "devices": {o.id: asdict(o) for o in outcomes},
+    }
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus(snapshot: Dict[str, Any]) -> str:
+    lines = [
+        "# HELP fleet_device_up Device health endpoint answered 2xx (1=yes)",
+        "# TYPE fleet_device_up gauge",
+    ]
+    devices = snapshot["devices"]
+    for device_id, device in devices.items():
+        labels = f'device="{_label(device_id)}",role="{_label(device["role"])}"'
+        lines.append(f"fleet_device_up{{{labels}}} {1 if device['state'] != 'down' else 0}")
+    lines += [
+        "# HELP fleet_device_endpoint_up Endpoint answered 2xx (1=yes)",
+        "# TYPE fleet_device_endpoint_up gauge",
+    ]
+    latency = [
+        "# HELP fleet_device_endpoint_latency_seconds Latency of the successful attempt",
+        "# TYPE fleet_device_endpoint_latency_seconds gauge",
+    ]
+    attempts = [
+        "# HELP fleet_device_endpoint_attempts Requests made for the endpoint in this run",
+        "# TYPE fleet_device_endpoint_attempts gauge",
+    ]
+    for device_id, device in devices.items():
+        for name, result in device["endpoints"].items():
+            labels = f'device="{_label(device_id)}",endpoint="{name}"'
+            lines.append(f"fleet_device_endpoint_up{{{labels}}} {1 if result['ok'] else 0}")
+            if result["latency_ms"] is not None:
+                latency.append(f"fleet_device_endpoint_latency_seconds{{{labels}}} {result['latency_ms'] / 1000:.6f}")
+            attempts.append(f"fleet_device_endpoint_attempts{{{labels}}} {result['attempts']}")
+    lines += latency + attempts
+    lines += [
+        "# HELP fleet_health_devices Devices by aggregated state",
+        "# TYPE fleet_health_devices gauge",
+    ]
+    for state, count in snapshot["summary"].items():
+        lines.append(f'fleet_health_devices{{state="{state}"}} {count}')
+    lines += [
+        "# HELP fleet_health_collect_seconds Wall time of the fleet-wide collection",
+        "# TYPE fleet_health_collect_seconds gauge",
+        f"fleet_health_collect_seconds {snapshot['elapsed_ms'] / 1000:.6f}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _parse_override(value: str) -> Tuple[str, str]:
+    device_id, sep, url = value.partition("=")
+    if not sep or not device_id or not url:
+        raise argparse.ArgumentTypeError("expected ID=URL")
+    return device_id, url
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--interfaces", type=pathlib.Path, default=DEFAULT_INTERFACES)
+    parser.add_argument("--device", action="append", help="limit to this device id (repeatable)")
+    parser.add_argument(
+        "--override",
+        action="append",
+        type=_parse_override,
+        default=[],
+        metavar="ID=URL",
+        help="use URL instead of the device's api.base_url (e.g. a local stand-in)",
+    )
+    parser.add_argument("--format", choices=("json", "prometheus"), default="json")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="per-request timeout (s)")
+    parser.add_argument("--deadline", type=float, default=DEFAULT_DEADLINE, help="overall deadline (s)")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES)
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST, help="concurrent requests per device")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="concurrent requests overall")
+    parser.add_argument("--no-metrics", action="store_true", help="skip the metrics endpoints")
+    args = parser.parse_args()
+
+    try:
+        devices = load_devices(args.interfaces, dict(args.override), args.device)
+    except FileNotFoundError:
+        print(f"interfaces file not found: {args.interfaces}", file=sys.stderr)
+        return 1
+    except YamlError as exc:
+        print(f"{args.interfaces}:{exc.line}:{exc.column}: {exc.message}", file=sys.stderr)
+        return 1
+    except ValueError as exc:
+        print(str(exc), file=sys.stderr)
+        return 1
+    if not devices:
+        print("no devices with an api.base_url matched", file=sys.stderr)
+        return 1
+
+    snapshot = asyncio.run(
+        collect(
+            devices,
+            timeout=args.timeout,
+            deadline=args.deadline,
+            retries=args.retries,
+            per_host=args.per_host,
+            concurrency=args.concurrency,
+            include_metrics=not args.no_metrics,
+        )
+    )
+    if args.format == "prometheus":
+        sys.stdout.write(render_prometheus(snapshot))
+    else:
+        json.dump(snapshot, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    summary = snapshot["summary"]
+    return EXIT_UNHEALTHY if summary["down"] or summary["degraded"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
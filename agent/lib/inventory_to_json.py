@@ -1,59 +1,979 @@
 #!/usr/bin/env python3
-"""Convert inventory/devices.yaml to JSON without external deps."""
+"""Convert inventory YAML files to JSON without external deps.
+
+The loader understands the YAML subset used under ``inventory/``: block
+mappings and sequences (including compact ``- key: value`` entries), plain,
+single- and double-quoted scalars, literal/folded block scalars, single-line
+or wrapped flow collections, comments, anchors, aliases and ``<<`` merge
+keys. Plain scalars resolve with the YAML 1.2 core schema (null, bool, int,
+float, str). Anything outside the subset raises ``YamlError`` with the line
+and column of the offending text.
+
+Parsed documents are cached as JSON artifacts keyed by a hash of the file
+(``<repo>/.cache/inventory`` unless ``INVENTORY_CACHE_DIR`` is set), so
+repeated agent runs skip parsing. ``--host NAME --field role`` prints a
+single value and exits 3 when the host or field is missing.
+"""
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
+import math
+import os
 import pathlib
+import re
 import sys
-from typing import Dict, Any
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class YamlError(ValueError):
+    """Parse error carrying a 1-based line and column."""
+
+    def __init__(self, message: str, line: int, column: int):
+        super().__init__(f"line {line}, column {column}: {message}")
+        self.message = message
+        self.line = line
+        self.column = column
+
+
+class _Incomplete(Exception):
+    """Flow collection continues on the next line."""
+
+
+_NULLS = {"", "~", "null", "Null", "NULL"}
+_TRUES = {"true", "True", "TRUE"}
+_FALSES = {"false", "False", "FALSE"}
+_INT_RE = re.compile(r"[-+]?[0-9]+$")
+_OCT_RE = re.compile(r"0o[0-7]+$")
+_HEX_RE = re.compile(r"0x[0-9a-fA-F]+$")
+_FLOAT_RE = re.compile(r"[-+]?(\.[0-9]+|[0-9]+(\.[0-9]*)?)([eE][-+]?[0-9]+)?$")
+_INF_RE = re.compile(r"[-+]?\.(inf|Inf|INF)$")
+_NAN_RE = re.compile(r"\.(nan|NaN|NAN)$")
+_ANCHOR_RE = re.compile(r"[^\s,\[\]{}]+")
+_BLOCK_HEADER_RE = re.compile(r"([|>])([-+]?)([1-9]?)([-+]?)\s*(#.*)?$")
+
+_ESCAPES = {
+    "0": "\0", "a": "\a", "b": "\b", "t": "\t", "\t": "\t", "n": "\n", "v": "\v",
+    "f": "\f", "r": "\r", "e": "\x1b", " ": " ", '"': '"', "/": "/", "\\": "\\",
+    "N": "\x85", "_": "\xa0", "L": "\u2028", "P": "\u2029",
+}
+_HEX_ESCAPES = {"x": 2, "u": 4, "U": 8}
+_PLAIN_FORBIDDEN_START = set("@`%!?|>")
+
+
+def resolve_scalar(text: str) -> Any:
+    """Resolve a plain scalar with the YAML 1.2 core schema."""
+    if text in _NULLS:
+        return None
+    if text in _TRUES:
+        return True
+    if text in _FALSES:
+        return False
+    first = text[0]
+    if first.isdigit() or first in "+-.":
+        if _INT_RE.match(text):
+            return int(text)
+        if _OCT_RE.match(text):
+            return int(text[2:], 8)
+        if _HEX_RE.match(text):
+            return int(text[2:], 16)
+        if _FLOAT_RE.match(text):
+            return float(text)
+        if _INF_RE.match(text):
+            return -math.inf if first == "-" else math.inf
+        if _NAN_RE.match(text):
+            return math.nan
+    return text
+
+
+def _is_seq_entry(content: str) -> bool:
+    return content == "-" or content.startswith(("- ", "-\t"))
+
+
+def _quoted_end(s: str, start: int = 0) -> Optional[int]:
+    """Index just past the quoted scalar starting at ``start``, if closed on this line."""
+    quote = s[start]
+    i = start + 1
+    n = len(s)
+    while i < n:
+        c = s[i]
+        if quote == "'" and c == "'":
+            if i + 1 < n and s[i + 1] == "'":
+                i += 2
+                continue
+            return i + 1
+        if quote == '"':
+            if c == "\\":
+                i += 2
+                continue
+            if c == '"':
+                return i + 1
+        i += 1
+    return None
+
+
+def _find_colon(s: str) -> Optional[int]:
+    """Return the index of the ``:`` separating a block mapping key, if any."""
+    if not s or s[0] in "[{#":
+        return None
+    if s[0] in "\"'":
+        end = _quoted_end(s)
+        if end is None:
+            return None
+        rest = s[end:].lstrip(" \t")
+        if rest.startswith(":") and (len(rest) == 1 or rest[1] in " \t"):
+            return len(s) - len(rest)
+        return None
+    comment = s.find(" #")
+    i = 0
+    while True:
+        i = s.find(":", i)
+        if i < 0 or 0 <= comment < i:
+            return None
+        if i + 1 == len(s) or s[i + 1] in " \t":
+            return i
+        i += 1
+
+
+def _strip_comment(s: str) -> str:
+    """Drop a trailing `` #`` comment from plain text."""
+    if s.startswith("#"):
+        return ""
+    idx = s.find(" #")
+    tab = s.find("\t#")
+    if tab >= 0 and (idx < 0 or tab < idx):
+        idx = tab
+    return (s[:idx] if idx >= 0 else s).rstrip(" \t")
+
+
+class _Parser:
+    """Single pass over the source lines with recursive descent per block."""
+
+    def __init__(self, text: str, track_lines: bool = False):
+        if text.startswith("\ufeff"):
+            text = text[1:]
+        self.lines = text.splitlines()
+        self.pos = 0
+        # (indent, content) standing in for the rest of the current line,
+        # used when a node starts mid-line (``- key: value``).
+        self.override: Optional[Tuple[int, str]] = None
+        self.anchors: Dict[str, Any] = {}
+        # id(container) -> {None: first line, key or index: line}
+        self.marks: Optional[Dict[int, Dict[Any, int]]] = {} if track_lines else None
+        self._peeked_pos = -1
+        self._peeked: Optional[Tuple[int, str]] = None
+
+    # -- line handling -------------------------------------------------------
+
+    @property
+    def lineno(self) -> int:
+        return self.pos + 1
+
+    def error(self, message: str, column: int, line: Optional[int] = None) -> YamlError:
+        return YamlError(message, line or self.lineno, column + 1)
+
+    def peek(self) -> Optional[Tuple[int, str]]:
+        """Return ``(indent, content)`` of the next structural line."""
+        if self.override is not None:
+            return self.override
+        if self._peeked_pos == self.pos:
+            return self._peeked
+        lines = self.lines
+        while self.pos < len(lines):
+            raw = lines[self.pos]
+            content = raw.lstrip(" ")
+            if not content or content[0] == "#" or content.isspace():
+                self.pos += 1
+                continue
+            indent = len(raw) - len(content)
+            if content[0] == "\t":
+                if content.lstrip().startswith("#"):
+                    self.pos += 1
+                    continue
+                raise self.error("tab character used for indentation", indent)
+            content = content.rstrip()
+            if indent == 0 and content[:3] in ("---", "...") and content[3:4] in ("", " ", "\t"):
+                # Document markers close every open block.
+                indent = -1
+            self._peeked_pos = self.pos
+            self._peeked = (indent, content)
+            return self._peeked
+        return None
+
+    def consume(self) -> None:
+        self.override = None
+        self.pos += 1
+
+    # -- documents -----------------------------------------------------------
+
+    def parse(self) -> Any:
+        nxt = self.peek()
+        if nxt is None:
+            return None
+        indent, content = nxt
+        if indent < 0 and content.startswith("---"):
+            rest = content[3:].lstrip()
+            if rest and not rest.startswith("#"):
+                self.override = (len(content) - len(rest), rest)
+            else:
+                self.consume()
+            nxt = self.peek()
+            if nxt is None:
+                return None
+            indent, content = nxt
+        value = None if indent < 0 else self.parse_block(indent)
+        nxt = self.peek()
+        if nxt is not None:
+            indent, content = nxt
+            if indent < 0 and content.startswith("..."):
+                return value
+            if indent < 0:
+                raise self.error("multiple documents are not supported", 0)
+            raise self.error("unexpected content after document end", indent)
+        return value
+
+    # -- block nodes ---------------------------------------------------------
+
+    def parse_block(self, indent: int) -> Any:
+        _, content = self.peek()
+        if _is_seq_entry(content):
+            return self.parse_sequence(indent)
+        if content.startswith("? "):
+            raise self.error("complex mapping keys are not supported", indent)
+        if _find_colon(content) is not None:
+            return self.parse_mapping(indent)
+        return self.parse_value(content, indent, indent - 1)
+
+    def parse_sequence(self, indent: int) -> List[Any]:
+        items: List[Any] = []
+        lines: Dict[Any, int] = {None: self.lineno}
+        while True:
+            nxt = self.peek()
+            if nxt is None:
+                break
+            ind, content = nxt
+            if ind < indent or not _is_seq_entry(content):
+                break
+            if ind > indent:
+                raise self.error("bad indentation of a sequence entry", ind)
+            rest = content[1:]
+            stripped = rest.lstrip(" \t")
+            col = indent + 1 + len(rest) - len(stripped)
+            lines[len(items)] = self.lineno
+            items.append(self.parse_value(stripped, col, indent, in_sequence=True))
+        if self.marks is not None:
+            self.marks[id(items)] = lines
+        return items
+
+    def parse_mapping(self, indent: int) -> Dict[Any, Any]:
+        result: Dict[Any, Any] = {}
+        merges: List[Dict[Any, Any]] = []
+        lines: Dict[Any, int] = {None: self.lineno}
+        while True:
+            nxt = self.peek()
+            if nxt is None:
+                break
+            ind, content = nxt
+            if ind < indent:
+                break
+            if ind > indent:
+                raise self.error("bad indentation of a mapping entry", ind)
+            if _is_seq_entry(content):
+                raise self.error("expected a mapping key, found a sequence entry", ind)
+            line = self.lineno
+            colon = _find_colon(content)
+            if colon is None:
+                raise self.error("expected a mapping key", ind)
+            key, rest, col = self.parse_key(content, colon, indent)
+            value = self.parse_value(rest, col, indent, mapping_value=True)
+            if key == "<<":
+                sources = value if isinstance(value, list) else [value]
+                for source in sources:
+                    if not isinstance(source, dict):
+                        raise self.error("merge key expects a mapping or list of mappings", ind, line)
+                    merges.append(source)
+                continue
+            if key in result:
+                raise self.error(f"duplicate key {key!r}", ind, line)
+            result[key] = value
+            lines[key] = line
+        for source in merges:
+            for key, value in source.items():
+                result.setdefault(key, value)
+        if self.marks is not None:
+            self.marks[id(result)] = lines
+        return result
+
+    def parse_key(self, content: str, colon: int, indent: int) -> Tuple[Any, str, int]:
+        if content[0] in "\"'":
+            end = _quoted_end(content)
+            key: Any = self.unquote(content[:end], indent)
+        else:
+            if content[0] in "&*":
+                raise self.error("anchors and aliases on keys are not supported", indent)
+            key = resolve_scalar(content[:colon].rstrip())
+        if isinstance(key, (list, dict)):
+            raise self.error("mapping keys must be scalars", indent)
+        rest = content[colon + 1:]
+        stripped = rest.lstrip(" \t")
+        return key, stripped, indent + colon + 1 + len(rest) - len(stripped)
+
+    def parse_nested(self, parent_indent: int, mapping_value: bool) -> Any:
+        nxt = self.peek()
+        if nxt is None:
+            return None
+        ind, content = nxt
+        if ind > parent_indent:
+            return self.parse_block(ind)
+        if mapping_value and ind == parent_indent and _is_seq_entry(content):
+            return self.parse_sequence(ind)
+        return None
+
+    def parse_value(
+        self,
+        text: str,
+        col: int,
+        parent_indent: int,
+        mapping_value: bool = False,
+        in_sequence: bool = False,
+    ) -> Any:
+        """Parse the node starting at ``text`` (column ``col``) on the current line."""
+        anchor = None
+        if text.startswith("&"):
+            match = _ANCHOR_RE.match(text, 1)
+            if not match:
+                raise self.error("anchor name expected", col)
+            anchor = match.group(0)
+            rest = text[match.end():]
+            stripped = rest.lstrip(" \t")
+            col += match.end() + len(rest) - len(stripped)
+            text = stripped
+        value = self._parse_value(text, col, parent_indent, mapping_value, in_sequence)
+        if anchor is not None:
+            self.anchors[anchor] = value
+        return value
+
+    def _parse_value(self, text: str, col: int, parent_indent: int, mapping_value: bool, in_sequence: bool) -> Any:
+        if not text or text.startswith("#"):
+            self.consume()
+            return self.parse_nested(parent_indent, mapping_value)
+        first = text[0]
+        if first == "*":
+            match = _ANCHOR_RE.match(text, 1)
+            name = match.group(0) if match else ""
+            if name not in self.anchors:
+                raise self.error(f"unknown alias {name!r}", col)
+            self.expect_end(text[1 + len(name):], col + 1 + len(name))
+            self.consume()
+            return self.anchors[name]
+        if in_sequence and (_is_seq_entry(text) or _find_colon(text) is not None):
+            # Compact nested node: ``- key: value`` or ``- - item``.
+            self.override = (col, text)
+            return self.parse_block(col)
+        if first in "|>":
+            return self.parse_block_scalar(text, col, parent_indent)
+        if first in "[{":
+            return self.parse_flow(text, col)
+        if first in "\"'":
+            return self.parse_quoted(text, col, parent_indent)
+        if first == "!":
+            raise self.error("tags are not supported", col)
+        if first in _PLAIN_FORBIDDEN_START or (first == "-" and _is_seq_entry(text)):
+            raise self.error(f"plain scalar cannot start with {first!r}", col)
+        if mapping_value and _find_colon(text) is not None:
+            raise self.error("mapping values are not allowed here", col + _find_colon(text))
+        return self.parse_plain(text, col, parent_indent)
+
+    def expect_end(self, rest: str, col: int) -> None:
+        stripped = rest.lstrip(" \t")
+        if stripped and not stripped.startswith("#"):
+            raise self.error("unexpected text after value", col + len(rest) - len(stripped))
+
+    # -- scalars -------------------------------------------------------------
+
+    def parse_plain(self, text: str, col: int, parent_indent: int) -> Any:
+        parts = [_strip_comment(text)]
+        # A comment ends a plain scalar; it cannot continue on the next line.
+        ended = parts[-1] != text.rstrip()
+        self.consume()
+        while not ended:
+            nxt = self.peek()
+            if nxt is None:
+                break
+            ind, content = nxt
+            if ind <= parent_indent:
+                break
+            if _find_colon(content) is not None:
+                raise self.error("mapping values are not allowed here", ind + _find_colon(content))
+            parts.append(_strip_comment(content))
+            ended = parts[-1] != content
+            self.consume()
+        if len(parts) == 1:
+            return resolve_scalar(parts[0])
+        return " ".join(parts)
+
+    def parse_quoted(self, text: str, col: int, parent_indent: int) -> str:
+        end = _quoted_end(text)
+        if end is not None:
+            value = self.unquote(text[:end], col)
+            self.expect_end(text[end:], col + end)
+            self.consume()
+            return value
+        # Multi-line quoted scalar: fold continuation lines into one string.
+        start_line = self.lineno
+        pieces = [text]
+        while True:
+            self.pos += 1
+            self.override = None
+            if self.pos >= len(self.lines):
+                raise self.error("unterminated quoted scalar", col, start_line)
+            line = self.lines[self.pos].strip()
+            pieces.append(line)
+            joined = self._fold_quoted(pieces)
+            end = _quoted_end(joined)
+            if end is not None:
+                break
+        value = self.unquote(joined[:end], col)
+        last = self.lines[self.pos]
+        tail = joined[end:]
+        self.expect_end(tail, len(last) - len(tail))
+        self.consume()
+        return value
+
+    @staticmethod
+    def _fold_quoted(pieces: List[str]) -> str:
+        out = pieces[0].rstrip(" \t")
+        pending_breaks = 0
+        for piece in pieces[1:]:
+            if not piece:
+                pending_breaks += 1
+                continue
+            if out.endswith("\\") and not out.endswith("\\\\"):
+                out = out[:-1]
+            elif pending_breaks:
+                out += "\\n" * pending_breaks if out.startswith('"') else "\n" * pending_breaks
+            else:
+                out += " "
+            out += piece
+            pending_breaks = 0
+        return out
+
+    def unquote(self, token: str, col: int) -> str:
+        body = token[1:-1]
+        if token[0] == "'":
+            return body.replace("''", "'")
+        if "\\" not in body:
+            return body
+        out: List[str] = []
+        i = 0
+        n = len(body)
+        while i < n:
+            c = body[i]
+            if c != "\\":
+                out.append(c)
+                i += 1
+                continue
+            if i + 1 >= n:
+                raise self.error("dangling escape in double-quoted scalar", col + 1 + i)
+            e = body[i + 1]
+            if e in _ESCAPES:
+                out.append(_ESCAPES[e])
+                i += 2
+            elif e in _HEX_ESCAPES:
+                width = _HEX_ESCAPES[e]
+                digits = body[i + 2:i + 2 + width]
+                if len(digits) != width or not all(d in "0123456789abcdefABCDEF" for d in digits):
+                    raise self.error(f"invalid \\{e} escape", col + 1 + i)
+                out.append(chr(int(digits, 16)))
+                i += 2 + width
+            else:
+                raise self.error(f"unknown escape \\{e}", col + 1 + i)
+        return "".join(out)
+
+    def parse_block_scalar(self, text: str, col: int, parent_indent: int) -> str:
+        match = _BLOCK_HEADER_RE.match(text)
+        if not match or (match.group(2) and match.group(4)):
+            raise self.error("invalid block scalar header", col)
+        style, chomp, explicit = match.group(1), match.group(2) or match.group(4), match.group(3)
+        self.consume()
+        content_indent = parent_indent + int(explicit) if explicit else None
+        lines: List[str] = []
+        while self.pos < len(self.lines):
+            raw = self.lines[self.pos]
+            if not raw.strip(" "):
+                lines.append("")
+                self.pos += 1
+                continue
+            indent = len(raw) - len(raw.lstrip(" "))
+            if content_indent is None:
+                if indent <= max(parent_indent, -1):
+                    break
+                content_indent = indent
+            if indent < content_indent:
+                if indent > parent_indent and raw.strip() and not raw.strip().startswith("#"):
+                    raise self.error("bad indentation in block scalar", indent)
+                break
+            lines.append(raw[content_indent:])
+            self.pos += 1
+        self.override = None
+        trailing = 0
+        while lines and lines[-1] == "":
+            lines.pop()
+            trailing += 1
+        if not lines:
+            return "\n" * trailing if chomp == "+" else ""
+        if style == "|":
+            body = "\n".join(lines)
+        else:
+            body = self._fold_block(lines)
+        if chomp == "-":
+            return body
+        if chomp == "+":
+            return body + "\n" * (trailing + 1)
+        return body + "\n"
+
+    @staticmethod
+    def _fold_block(lines: List[str]) -> str:
+        out = ""
+        prev: Optional[str] = None
+        empties = 0
+        for line in lines:
+            if line == "":
+                empties += 1
+                continue
+            more = line[0] in " \t"
+            if prev is None:
+                out += "\n" * empties
+            elif prev == "normal" and not more:
+                out += " " if empties == 0 else "\n" * empties
+            else:
+                out += "\n" * (empties + 1)
+            out += line
+            prev = "more" if more else "normal"
+            empties = 0
+        return out
+
+    # -- flow collections ----------------------------------------------------
+
+    def parse_flow(self, text: str, col: int) -> Any:
+        start_line = self.lineno
+        buf = text
+        while True:
+            flow = _FlowParser(self, buf, col, start_line)
+            try:
+                value = flow.parse_node()
+                flow.skip_ws()
+                if flow.i < len(buf):
+                    raise self.error("unexpected text after flow collection", col + flow.i, start_line)
+                break
+            except _Incomplete:
+                self.pos += 1
+                self.override = None
+                if self.pos >= len(self.lines):
+                    raise self.error("unterminated flow collection", col, start_line)
+                buf += "\n" + self.lines[self.pos].strip()
+        self.consume()
+        return value
+
+
+class _FlowParser:
+    def __init__(self, parser: _Parser, text: str, col: int, line: int):
+        self.parser = parser
+        self.s = text
+        self.i = 0
+        self.col = col
+        self.line = line
+
+    def error(self, message: str) -> YamlError:
+        return YamlError(message, self.line, self.col + self.i + 1)
+
+    def skip_ws(self) -> None:
+        s = self.s
+        while self.i < len(s):
+            c = s[self.i]
+            if c in " \t\n":
+                self.i += 1
+            elif c == "#" and (self.i == 0 or s[self.i - 1] in " \t\n"):
+                end = s.find("\n", self.i)
+                self.i = len(s) if end < 0 else end
+            else:
+                break
+
+    def peek(self) -> str:
+        self.skip_ws()
+        if self.i >= len(self.s):
+            raise _Incomplete()
+        return self.s[self.i]
+
+    def parse_node(self) -> Any:
+        c = self.peek()
+        anchor = None
+        if c == "&":
+            match = _ANCHOR_RE.match(self.s, self.i + 1)
+            if not match:
+                raise self.error("anchor name expected")
+            anchor = match.group(0)
+            self.i = match.end()
+            c = self.peek()
+        if c == "[":
+            value: Any = self.parse_seq()
+        elif c == "{":
+            value = self.parse_map()
+        elif c == "*":
+            match = _ANCHOR_RE.match(self.s, self.i + 1)
+            name = match.group(0) if match else ""
+            if name not in self.parser.anchors:
+                raise self.error(f"unknown alias {name!r}")
+            self.i += 1 + len(name)
+            value = self.parser.anchors[name]
+        elif c in "\"'":
+            end = _quoted_end(self.s, self.i)
+            if end is None:
+                raise _Incomplete()
+            value = self.parser.unquote(self.s[self.i:end], self.col + self.i)
+            self.i = end
+        else:
+            value = self.parse_plain()
+        if anchor is not None:
+            self.parser.anchors[anchor] = value
+        return value
+
+    def parse_plain(self) -> Any:
+        start = self.i
+        s = self.s
+        n = len(s)
+        while self.i < n:
+            c = s[self.i]
+            if c in ",[]{}":
+                break
+            if c == ":" and (self.i + 1 == n or s[self.i + 1] in " \t\n,[]{}"):
+                break
+            if c == "#" and s[self.i - 1] in " \t\n":
+                break
+            self.i += 1
+        text = " ".join(s[start:self.i].split())
+        if not text:
+            raise self.error("expected a flow node")
+        return resolve_scalar(text)
+
+    def parse_seq(self) -> List[Any]:
+        self.i += 1
+        items: List[Any] = []
+        while True:
+            c = self.peek()
+            if c == "]":
+                self.i += 1
+                return items
+            items.append(self.parse_node())
+            c = self.peek()
+            if c == ",":
+                self.i += 1
+            elif c != "]":
+                raise self.error("expected ',' or ']' in flow sequence")
+
+    def parse_map(self) -> Dict[Any, Any]:
+        self.i += 1
+        result: Dict[Any, Any] = {}
+        while True:
+            c = self.peek()
+            if c == "}":
+                self.i += 1
+                return result
+            key = self.parse_node()
+            if isinstance(key, (list, dict)):
+                raise self.error("mapping keys must be scalars")
+            value = None
+            c = self.peek()
+            if c == ":":
+                self.i += 1
+                c = self.peek()
+                if c not in ",}":
+                    value = self.parse_node()
+            if key in result:
+                raise self.error(f"duplicate key {key!r}")
+            result[key] = value
+            c = self.peek()
+            if c == ",":
+                self.i += 1
+            elif c != "}":
+                raise self.error("expected ',' or '}' in flow mapping")
+
+
+def load_yaml(text: str) -> Any:
+    """Parse one YAML document from ``text``."""
+    return _Parser(text).parse()
+
+
+class LineMap:
+    """Source line numbers of mapping keys and sequence items.
+
+    Entries are looked up by the parsed container object, so the map is only
+    valid alongside the document it was built with.
+    """
+
+    def __init__(self, doc: Any, marks: Dict[int, Dict[Any, int]]):
+        self._doc = doc  # keeps container ids stable
+        self._marks = marks
+
+    def line(self, container: Any, key: Any = None) -> Optional[int]:
+        """Line of ``container[key]``, or of the container itself without a key."""
+        entry = self._marks.get(id(container))
+        if entry is None:
+            return None
+        return entry.get(key, entry.get(None))
+
+
+def load_yaml_with_lines(text: str) -> Tuple[Any, LineMap]:
+    """Parse ``text`` and also return where each key and item was defined."""
+    parser = _Parser(text, track_lines=True)
+    doc = parser.parse()
+    return doc, LineMap(doc, parser.marks or {})
+
+
+def load_yaml_file(path: pathlib.Path) -> Any:
+    return load_yaml(path.read_text(encoding="utf-8"))
 
 
 def parse_devices_yaml(text: str) -> Dict[str, Dict[str, Any]]:
-    devices: Dict[str, Dict[str, Any]] = {}
-    current_section = None
-    current_device = None
-    for raw_line in text.splitlines():
-        line = raw_line.rstrip()
-        stripped = line.strip()
-        if not stripped or stripped.startswith("#"):
-            continue
-        indent = len(line) - len(line.lstrip(" "))
-        if indent == 0:
-            current_section = stripped.rstrip(":")
-            current_device = None
-            continue
-        if current_section != "devices":
-            continue
-        if indent == 2 and stripped.endswith(":"):
-            current_device = stripped.rstrip(":")
-            devices.setdefault(current_device, {})
-            continue
-        if indent >= 4 and ":" in stripped and current_device:
-            key, value = stripped.split(":", 1)
-            key = key.strip()
-            value = value.strip()
-            if "#" in value:
-                value = value.split("#", 1)[0].strip()
-            if value.startswith(("'", '"')) and value.endswith(("'", '"')):
-                value = value[1:-1]
-            devices[current_device][key] = value
-    return devices
+    """Return the ``devices`` mapping of inventory/devices.yaml."""
+    return devices_from_document(load_yaml(text))
+
+
+def devices_from_document(doc: Any) -> Dict[str, Dict[str, Any]]:
+    if not isinstance(doc, dict):
+        return {}
+    devices = doc.get("devices") or {}
+    if not isinstance(devices, dict):
+        return {}
+    return {host: (attrs if isinstance(attrs, dict) else {}) for host, attrs in devices.items()}
+
+
+def build_host_index(doc: Any) -> Dict[str, Dict[str, Any]]:
+    """Map host name to its record for either inventory file layout.
+
+    devices.yaml keys ``devices`` by host; device-interfaces.yaml lists
+    devices with an ``id``.
+    """
+    if not isinstance(doc, dict):
+        return {}
+    devices = doc.get("devices")
+    if isinstance(devices, dict):
+        return devices_from_document(doc)
+    if isinstance(devices, list):
+        return {
+            str(item["id"]): item
+            for item in devices
+            if isinstance(item, dict) and item.get("id") is not None
+        }
+    return {}
+
+
+# -- compiled cache ----------------------------------------------------------
+
+CACHE_DIR_ENV = "INVENTORY_CACHE_DIR"
+EXIT_NOT_FOUND = 3
+
+_parser_digest: Optional[bytes] = None
+
+
+def default_cache_dir(inventory: pathlib.Path) -> pathlib.Path:
+    """``<repo>/.cache/inventory`` for ``<repo>/inventory/<file>.yaml``."""
+    override = os.environ.get(CACHE_DIR_ENV)
+    if override:
+        return pathlib.Path(override)
+    return inventory.resolve().parent.parent / ".cache" / "inventory"
+
+
+def _cache_key(data: bytes) -> str:
+    # Key on the parser source as well so a parser change invalidates artifacts.
+    global _parser_digest
+    if _parser_digest is None:
+        _parser_digest = hashlib.sha256(pathlib.Path(__file__).read_bytes()).digest()
+    return hashlib.sha256(_parser_digest + data).hexdigest()[:20]
+
+
+def _write_artifact(cache_dir: pathlib.Path, stem: str, artifact: pathlib.Path, compiled: dict) -> None:
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = artifact.with_name(f".{artifact.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(compiled, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, artifact)
+        for stale in cache_dir.glob(f"{stem}-*.json"):
+            if stale != artifact:
+                stale.unlink()
+    except OSError:
+        # The cache is an optimisation; a read-only checkout still works.
+        pass
+
+
+def load_compiled(
+    path: pathlib.Path,
+    cache_dir: Optional[pathlib.Path] = None,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """Return ``{"document", "hosts", ...}`` for ``path``.
+
+    The parsed document and its host index are stored as a JSON artifact
+    named after a hash of the file content; while the YAML is unchanged the
+    artifact is loaded instead of parsing again.
+    """
+    data = path.read_bytes()
+    key = _cache_key(data)
+    cache_dir = cache_dir or default_cache_dir(path)
+    artifact = cache_dir / f"{path.stem}-{key}.json"
+    if use_cache:
+        try:
+            compiled = json.loads(artifact.read_text(encoding="utf-8"))
+            if compiled.get("key") == key:
+                return compiled
+        except (OSError, ValueError):
+            pass
+    doc = load_yaml(data.decode("utf-8"))
+    compiled = {
+        "key": key,
+        "source": str(path),
+        "document": doc,
+        "hosts": build_host_index(doc),
+    }
+    if use_cache:
+        _write_artifact(cache_dir, path.stem, artifact, compiled)
+    return compiled
+
+
+def lookup(compiled: Dict[str, Any], host: str, field: Optional[str] = None) -> Any:
+    """Return a host record, or one dotted field of it; ``None`` when absent."""
+    value: Any = compiled["hosts"].get(host)
+    if field:
+        for part in field.split("."):
+            if isinstance(value, dict):
+                value = value.get(part)
+            elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+                value = value[int(part)]
+            else:
+                return None
+    return value
+
+
+_YAML11_BOOLS = {
+    v
+    for word in ("y", "yes", "n", "no", "on", "off")
+    for v in (word, word.capitalize(), word.upper())
+}
+
+
+def _differences(ours: Any, theirs: Any, path: str = "") -> List[str]:
+    if isinstance(ours, str) and isinstance(theirs, bool) and ours in _YAML11_BOOLS:
+        return []  # PyYAML follows YAML 1.1 here; the core schema keeps the string.
+    if isinstance(ours, dict) and isinstance(theirs, dict):
+        out: List[str] = []
+        for key in set(ours) | set(theirs):
+            out += _differences(ours.get(key), theirs.get(key), f"{path}/{key}")
+        return out
+    if isinstance(ours, list) and isinstance(theirs, list) and len(ours) == len(theirs):
+        out = []
+        for i, (a, b) in enumerate(zip(ours, theirs)):
+            out += _differences(a, b, f"{path}[{i}]")
+        return out
+    if ours != theirs or type(ours) is not type(theirs):
+        return [f"{path or '/'}: {ours!r} != {theirs!r}"]
+    return []
+
+
+def benchmark(text: str, iterations: int) -> int:
+    """Time this parser against PyYAML on the same document."""
+    def timed(fn) -> Tuple[Any, float]:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            value = fn(text)
+        return value, (time.perf_counter() - started) / iterations * 1000
+
+    ours, ours_ms = timed(load_yaml)
+    print(f"inventory_to_json: {ours_ms:.3f} ms/parse")
+    try:
+        import yaml  # type: ignore
+    except ImportError:
+        print("PyYAML not installed; skipping comparison")
+        return 0
+    rc = 0
+    loaders = [("yaml.SafeLoader", yaml.SafeLoader)]
+    if hasattr(yaml, "CSafeLoader"):
+        loaders.append(("yaml.CSafeLoader", yaml.CSafeLoader))
+    for name, loader in loaders:
+        theirs, theirs_ms = timed(lambda t: yaml.load(t, Loader=loader))
+        diffs = _differences(ours, theirs)
+        print(f"{name}: {theirs_ms:.3f} ms/parse ({theirs_ms / ours_ms:.1f}x), "
+              f"{'output matches' if not diffs else f'{len(diffs)} differences'}")
+        for line in diffs[:10]:
+            print(f"  {line}")
+        if diffs:
+            rc = 1
+    return rc
 
 
 def main() -> int:
-    parser = argparse.ArgumentParser(description=__doc__)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
     parser.add_argument("inventory", type=pathlib.Path)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="dump the whole document instead of the devices mapping",
+    )
+    parser.add_argument("--host", help="print only this host's record")
+    parser.add_argument(
+        "--field",
+        help="with --host, print one (dotted) field; strings are printed raw",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=pathlib.Path,
+        help=f"compiled artifact directory (default: ${CACHE_DIR_ENV} or <repo>/.cache/inventory)",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="always parse the YAML")
+    parser.add_argument(
+        "--benchmark",
+        type=int,
+        metavar="N",
+        help="parse N times and compare speed and output with PyYAML",
+    )
     args = parser.parse_args()
+    if args.field and not args.host:
+        parser.error("--field requires --host")
+
+    if args.benchmark:
+        try:
+            text = args.inventory.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            print(f"inventory file not found: {args.inventory}", file=sys.stderr)
+            return 1
+        return benchmark(text, args.benchmark)
 
     try:
-        text = args.inventory.read_text(encoding="utf-8")
+        compiled = load_compiled(args.inventory, args.cache_dir, not args.no_cache)
     except FileNotFoundError:
         print(f"inventory file not found: {args.inventory}", file=sys.stderr)
         return 1
+    except YamlError as exc:
+        print(f"{args.inventory}:{exc.line}:{exc.column}: {exc.message}", file=sys.stderr)
+        return 1
+
+    if args.host:
+        value = lookup(compiled, args.host, args.field)
+        if value is None:
+            what = f"field '{args.field}' for host" if args.field else "host"
+            print(f"{what} '{args.host}' not found in {args.inventory}", file=sys.stderr)
+            return EXIT_NOT_FOUND
+        if isinstance(value, str):
+            sys.stdout.write(value + "\n")
+        else:
+            json.dump(value, sys.stdout, indent=2, sort_keys=True)
+            sys.stdout.write("\n")
+        return 0
 
-    devices = parse_devices_yaml(text)
-    json.dump(devices, sys.stdout, indent=2, sort_keys=True)
+    doc = compiled["document"]
+    output = doc if args.full else devices_from_document(doc)
+    json.dump(output, sys.stdout, indent=2, sort_keys=True)
     sys.stdout.write("\n")
     return 0
 
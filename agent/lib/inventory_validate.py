@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""Cross-file consistency checks for the inventory.
+
+Loads ``inventory/devices.yaml``, ``inventory/device-interfaces.yaml``, every
+``roles/<role>/openapi*.yaml`` and ``infra/vps/prometheus.yml`` (plus the
+file_sd target files it references) into one in-memory index, then runs all
+checks in a single pass. Every finding is reported as
+``file:line: severity: message [check]`` so editors and pre-commit hooks can
+jump to it. Exits 1 when any error is found (or any warning with
+``--strict``).
+
+Only the standard library and ``inventory_to_json`` are used, so the whole
+run stays in the tens of milliseconds.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import pathlib
+import re
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from inventory_to_json import LineMap, YamlError, load_yaml_with_lines  # noqa: E402
+
+DEVICES_FILE = "inventory/devices.yaml"
+INTERFACES_FILE = "inventory/device-interfaces.yaml"
+PROMETHEUS_FILE = "infra/vps/prometheus.yml"
+# prometheus.yml refers to file_sd targets by their path inside the container.
+PROMETHEUS_TARGETS_MOUNT = "/etc/prometheus/targets/"
+PROMETHEUS_TARGETS_DIR = "infra/vps"
+
+HTTP_METHODS = {"get", "put", "post", "delete", "patch", "head", "options", "trace"}
+_PARAM_RE = re.compile(r"\\\{[^/]+?\\\}")
+
+
+@dataclass
+class Finding:
+    severity: str
+    file: str
+    line: Optional[int]
+    check: str
+    message: str
+
+    def format(self) -> str:
+        where = f"{self.file}:{self.line}" if self.line else self.file
+        return f"{where}: {self.severity}: {self.message} [{self.check}]"
+
+
+@dataclass
+class Source:
+    """A parsed YAML file together with its line map."""
+
+    path: str
+    doc: Any
+    lines: Optional[LineMap]
+
+    def line(self, container: Any, key: Any = None) -> Optional[int]:
+        if self.lines is None:
+            return None
+        return self.lines.line(container, key)
+
+
+@dataclass
+class RoleSpec:
+    """Union of the operations and servers declared in a role's OpenAPI files."""
+
+    files: List[str] = field(default_factory=list)
+    operations: List[Tuple[re.Pattern, Set[str], str]] = field(default_factory=list)
+    ports: Set[int] = field(default_factory=set)
+
+    def match(self, path: str) -> Optional[Set[str]]:
+        """Methods declared for ``path`` (templated segments match any value)."""
+        found: Optional[Set[str]] = None
+        for pattern, methods, _ in self.operations:
+            if pattern.match(path):
+                found = (found or set()) | methods
+        return found
+
+
+def _path_pattern(template: str) -> re.Pattern:
+    return re.compile("^" + _PARAM_RE.sub("[^/]+", re.escape(template)) + "/?$")
+
+
+def _url_port(url: str) -> Optional[int]:
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    if port is None and parts.scheme in ("http", "https") and parts.hostname:
+        port = 443 if parts.scheme == "https" else 80
+    return port
+
+
+class Validator:
+    def __init__(self, repo: pathlib.Path):
+        self.repo = repo
+        self.findings: List[Finding] = []
+        self._specs: Dict[str, Optional[RoleSpec]] = {}
+        self._jobs: Optional[Dict[str, Tuple[Optional[Set[str]], Optional[int]]]] = None
+
+    # -- reporting -------------------------------------------------------
+
+    def report(self, severity: str, source: str, line: Optional[int], check: str, message: str) -> None:
+        self.findings.append(Finding(severity, source, line, check, message))
+
+    def error(self, source: Source, line: Optional[int], check: str, message: str) -> None:
+        self.report("error", source.path, line, check, message)
+
+    def warn(self, source: Source, line: Optional[int], check: str, message: str) -> None:
+        self.report("warning", source.path, line, check, message)
+
+    # -- loading ---------------------------------------------------------
+
+    def load(self, relative: str, required: bool = True) -> Optional[Source]:
+        path = self.repo / relative
+        try:
+            text = path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            if required:
+                self.report("error", relative, None, "load", "file not found")
+            return None
+        try:
+            doc, lines = load_yaml_with_lines(text)
+        except YamlError as exc:
+            self.report("error", relative, exc.line, "yaml", exc.message)
+            return None
+        return Source(relative, doc, lines)
+
+    def role_spec(self, role: str) -> Optional[RoleSpec]:
+        if role in self._specs:
+            return self._specs[role]
+        spec: Optional[RoleSpec] = None
+        role_dir = self.repo / "roles" / role
+        for path in sorted(role_dir.glob("openapi*.y*ml")):
+            source = self.load(str(path.relative_to(self.repo)))
+            if source is None or not isinstance(source.doc, dict):
+                continue
+            spec = spec or RoleSpec()
+            spec.files.append(source.path)
+            for server in source.doc.get("servers") or []:
+                if isinstance(server, dict) and isinstance(server.get("url"), str):
+                    port = _url_port(server["url"])
+                    # Proxied servers (https on 443) say nothing about the device port.
+                    if port is not None and port != 443:
+                        spec.ports.add(port)
+            paths = source.doc.get("paths") or {}
+            if not isinstance(paths, dict):
+                continue
+            for template, item in paths.items():
+                if not isinstance(item, dict):
+                    continue
+                methods = {m.upper() for m in item if isinstance(m, str) and m.lower() in HTTP_METHODS}
+                spec.operations.append((_path_pattern(str(template)), methods, source.path))
+        self._specs[role] = spec
+        return spec
+
+    def prometheus_jobs(self) -> Dict[str, Tuple[Optional[Set[str]], Optional[int]]]:
+        """job_name -> (known targets or None if not enumerable, line)."""
+        if self._jobs is not None:
+            return self._jobs
+        self._jobs = {}
+        source = self.load(PROMETHEUS_FILE)
+        if source is None or not isinstance(source.doc, dict):
+            return self._jobs
+        for scrape in source.doc.get("scrape_configs") or []:
+            if not isinstance(scrape, dict) or not scrape.get("job_name"):
+                continue
+            targets: Optional[Set[str]] = set()
+            for static in scrape.get("static_configs") or []:
+                for target in (static or {}).get("targets") or []:
+                    targets.add(str(target))
+            for file_sd in scrape.get("file_sd_configs") or []:
+                for container_path in (file_sd or {}).get("files") or []:
+                    loaded = self._file_sd_targets(str(container_path), source, scrape)
+                    if loaded is None:
+                        targets = None
+                    elif targets is not None:
+                        targets |= loaded
+            self._jobs[str(scrape["job_name"])] = (targets, source.line(scrape))
+        return self._jobs
+
+    def _file_sd_targets(self, container_path: str, source: Source, scrape: dict) -> Optional[Set[str]]:
+        if not container_path.startswith(PROMETHEUS_TARGETS_MOUNT) or "*" in container_path:
+            return None
+        name = container_path[len(PROMETHEUS_TARGETS_MOUNT):]
+        relative = f"{PROMETHEUS_TARGETS_DIR}/targets-{name}"
+        try:
+            groups = json.loads((self.repo / relative).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            self.error(source, source.line(scrape), "prometheus",
+                       f"job '{scrape['job_name']}' reads {container_path} but {relative} does not exist")
+            return set()
+        except json.JSONDecodeError as exc:
+            self.report("error", relative, exc.lineno, "prometheus", f"invalid JSON: {exc.msg}")
+            return set()
+        targets: Set[str] = set()
+        for group in groups if isinstance(groups, list) else []:
+            if isinstance(group, dict):
+                targets.update(str(t) for t in group.get("targets") or [])
+        return targets
+
+    # -- checks ----------------------------------------------------------
+
+    def run(self) -> List[Finding]:
+        devices_src = self.load(DEVICES_FILE)
+        interfaces_src = self.load(INTERFACES_FILE)
+        inventory = self.check_devices(devices_src) if devices_src else {}
+        if interfaces_src is not None:
+            self.check_interfaces(interfaces_src, devices_src, inventory)
+        return self.findings
+
+    def check_devices(self, source: Source) -> Dict[str, Dict[str, Any]]:
+        doc = source.doc
+        devices = doc.get("devices") if isinstance(doc, dict) else None
+        if not isinstance(devices, dict):
+            self.error(source, 1, "devices", "top-level 'devices' mapping missing")
+            return {}
+        for host, record in devices.items():
+            line = source.line(devices, host)
+            role = record.get("role") if isinstance(record, dict) else None
+            if not role:
+                self.error(source, line, "devices", f"host '{host}' has no role")
+                continue
+            if not (self.repo / "roles" / str(role)).is_dir():
+                self.error(source, source.line(record, "role"), "devices",
+                           f"host '{host}' uses role '{role}' but roles/{role} does not exist")
+        return {h: r for h, r in devices.items() if isinstance(r, dict)}
+
+    def check_interfaces(
+        self,
+        source: Source,
+        devices_src: Optional[Source],
+        inventory: Dict[str, Dict[str, Any]],
+    ) -> None:
+        doc = source.doc
+        entries = doc.get("devices") if isinstance(doc, dict) else None
+        if not isinstance(entries, list):
+            self.error(source, 1, "interfaces", "top-level 'devices' list missing")
+            return
+        seen: Dict[str, int] = {}
+        for index, entry in enumerate(entries):
+            line = source.line(entries, index)
+            if not isinstance(entry, dict):
+                self.error(source, line, "interfaces", "device entry is not a mapping")
+                continue
+            device_id = entry.get("id")
+            if not device_id:
+                self.error(source, line, "interfaces", "device entry has no id")
+                continue
+            if device_id in seen:
+                self.error(source, source.line(entry, "id"), "interfaces",
+                           f"duplicate device id '{device_id}' (first defined on line {seen[device_id]})")
+                continue
+            seen[device_id] = source.line(entry, "id") or 0
+            record = inventory.get(device_id)
+            if devices_src is not None and record is None:
+                self.error(source, source.line(entry, "id"), "interfaces",
+                           f"device '{device_id}' is not listed in {DEVICES_FILE}")
+            self.check_device(source, entry, device_id, record)
+
+        if devices_src is not None:
+            devices = devices_src.doc["devices"]
+            for host in inventory:
+                if host not in seen:
+                    self.error(devices_src, devices_src.line(devices, host), "interfaces",
+                               f"host '{host}' has no entry in {INTERFACES_FILE}")
+
+    def check_device(
+        self,
+        source: Source,
+        entry: Dict[str, Any],
+        device_id: str,
+        record: Optional[Dict[str, Any]],
+    ) -> None:
+        role = entry.get("role")
+        inventory_role = record.get("role") if record else None
+        if inventory_role and role and role != inventory_role:
+            self.warn(source, source.line(entry, "role"), "roles",
+                      f"device '{device_id}' has role '{role}' here but '{inventory_role}' in {DEVICES_FILE}")
+        spec_role = inventory_role or role
+        spec = self.role_spec(str(spec_role)) if spec_role else None
+        if spec_role and spec is None:
+            self.warn(source, source.line(entry, "role"), "openapi",
+                      f"role '{spec_role}' has no roles/{spec_role}/openapi*.yaml; paths not checked")
+
+        api = entry.get("api")
+        base_url = api.get("base_url") if isinstance(api, dict) else None
+        base_port: Optional[int] = None
+        base_host: Optional[str] = None
+        if not base_url:
+            self.error(source, source.line(entry, "api") or source.line(entry), "api",
+                       f"device '{device_id}' has no api.base_url")
+        else:
+            parts = urlsplit(str(base_url))
+            base_host = parts.hostname
+            base_port = _url_port(str(base_url))
+            if base_host is None or base_port is None:
+                self.error(source, source.line(api, "base_url"), "api",
+                           f"device '{device_id}' api.base_url '{base_url}' is not an http(s) URL")
+            elif spec is not None and spec.ports and base_port not in spec.ports:
+                self.warn(source, source.line(api, "base_url"), "api",
+                          f"device '{device_id}' uses port {base_port} but the {spec_role} OpenAPI servers "
+                          f"list {', '.join(str(p) for p in sorted(spec.ports))}")
+            if parts.path not in ("", "/"):
+                # Paths are resolved under the base URL's own prefix; skip spec matching.
+                spec = None
+
+        if isinstance(api, dict) and spec is not None:
+            for key in ("health_path", "status_path", "metrics_path"):
+                path = api.get(key)
+                if path and spec.match(str(path)) is None:
+                    self.error(source, source.line(api, key), "api",
+                               f"device '{device_id}' {key} {path} is not in {', '.join(spec.files)}")
+
+        self.check_prometheus(source, entry, device_id, base_host, base_port)
+        self.check_operations(source, entry, device_id, spec)
+
+    def check_prometheus(
+        self,
+        source: Source,
+        entry: Dict[str, Any],
+        device_id: str,
+        base_host: Optional[str],
+        base_port: Optional[int],
+    ) -> None:
+        monitoring = entry.get("monitoring")
+        targets = monitoring.get("prometheus_targets") if isinstance(monitoring, dict) else None
+        if not isinstance(targets, list):
+            return
+        jobs = self.prometheus_jobs()
+        for index, item in enumerate(targets):
+            line = source.line(targets, index)
+            if not isinstance(item, dict) or not item.get("job") or not item.get("target"):
+                self.error(source, line, "prometheus", f"device '{device_id}' prometheus target needs job and target")
+                continue
+            job, target = str(item["job"]), str(item["target"])
+            if base_host and base_port and target != f"{base_host}:{base_port}":
+                self.error(source, source.line(item, "target"), "prometheus",
+                           f"device '{device_id}' target {target} does not match api.base_url {base_host}:{base_port}")
+            if job not in jobs:
+                self.error(source, source.line(item, "job"), "prometheus",
+                           f"job '{job}' referenced by '{device_id}' is not declared in {PROMETHEUS_FILE}")
+                continue
+            known, _ = jobs[job]
+            if known is not None and target not in known:
+                self.error(source, source.line(item, "target"), "prometheus",
+                           f"target {target} for job '{job}' is missing from the job's targets")
+
+    def check_operations(
+        self,
+        source: Source,
+        entry: Dict[str, Any],
+        device_id: str,
+        spec: Optional[RoleSpec],
+    ) -> None:
+        operations = entry.get("operations")
+        if operations is None:
+            return
+        if not isinstance(operations, list):
+            self.error(source, source.line(entry, "operations"), "operations",
+                       f"device '{device_id}' operations must be a list")
+            return
+        op_ids: Dict[str, int] = {}
+        for index, op in enumerate(operations):
+            line = source.line(operations, index)
+            if not isinstance(op, dict):
+                self.error(source, line, "operations", f"device '{device_id}' operation is not a mapping")
+                continue
+            op_id = op.get("id")
+            if not op_id:
+                self.error(source, line, "operations", f"device '{device_id}' has an operation without id")
+                continue
+            if op_id in op_ids:
+                self.error(source, source.line(op, "id"), "operations",
+                           f"device '{device_id}' has duplicate operation id '{op_id}' "
+                           f"(first defined on line {op_ids[op_id]})")
+            else:
+                op_ids[op_id] = source.line(op, "id") or 0
+            method, path = op.get("method"), op.get("path")
+            if not method or not path:
+                self.error(source, line, "operations", f"operation '{op_id}' needs method and path")
+            elif spec is not None:
+                methods = spec.match(str(path))
+                if methods is None:
+                    self.error(source, source.line(op, "path"), "operations",
+                               f"operation '{op_id}' path {path} is not in {', '.join(spec.files)}")
+                elif str(method).upper() not in methods:
+                    self.error(source, source.line(op, "method"), "operations",
+                               f"operation '{op_id}' uses {str(method).upper()} {path} but the spec only "
+                               f"declares {', '.join(sorted(methods)) or 'no methods'}")
+            ui = op.get("ui")
+            if isinstance(ui, dict) and ui.get("type") == "slider" and not ui.get("body_key"):
+                self.error(source, source.line(op, "ui"), "operations",
+                           f"slider operation '{op_id}' is missing ui.body_key")
+
+
+def iter_sorted(findings: List[Finding]) -> Iterator[Finding]:
+    return iter(sorted(findings, key=lambda f: (f.file, f.line or 0, f.severity)))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--repo",
+        type=pathlib.Path,
+        default=pathlib.Path(__file__).resolve().parents[2],
+        help="repository root (default: the checkout containing this script)",
+    )
+    parser.add_argument("--format", choices=("text", "json"), default="text")
+    parser.add_argument("--strict", action="store_true", help="treat warnings as errors")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    findings = Validator(args.repo).run()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    errors = sum(1 for f in findings if f.severity == "error")
+    warnings = len(findings) - errors
+
+    if args.format == "json":
+        json.dump(
+            {
+                "errors": errors,
+                "warnings": warnings,
+                "elapsed_ms": round(elapsed_ms, 2),
+                "findings": [asdict(f) for f in iter_sorted(findings)],
+            },
+            sys.stdout,
+            indent=2,
+        )
+        sys.stdout.write("\n")
+    else:
+        for finding in iter_sorted(findings):
+            print(finding.format(), file=sys.stderr)
+        print(f"{errors} error(s), {warnings} warning(s) in {elapsed_ms:.1f} ms")
+
+    return 1 if errors or (args.strict and warnings) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
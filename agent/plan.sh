@@ -52,12 +52,15 @@ else
     echo "inventory parser missing: $parser" >&2
     exit 1
   fi
-  inventory_json=$(python3 "$parser" "$inventory" 2>/dev/null || true)
-  if [[ -z "$inventory_json" ]]; then
+  if role=$(python3 "$parser" "$inventory" --host "$HOSTNAME" --field role 2>/dev/null); then
+    rc=0
+  else
+    rc=$?
+  fi
+  if (( rc != 0 && rc != 3 )); then
     echo "failed to parse inventory at $inventory" >&2
     exit 1
   fi
-  role=$(printf '%s' "$inventory_json" | jq -r --arg host "$HOSTNAME" '.[$host].role // empty')
   if [[ -z "$role" ]]; then
     cat >&2 <<EOF
 Host '$HOSTNAME' not found in inventory.
@@ -305,13 +305,17 @@ if [[ ! -x "$INVENTORY_TO_JSON" ]]; then
   exit $EXIT_PREREQ_MISSING
 fi
 
-INVENTORY_JSON=$(/usr/bin/env python3 "$INVENTORY_TO_JSON" "$REPO_DIR/inventory/devices.yaml" 2>/dev/null || true)
-if [[ -z "$INVENTORY_JSON" ]]; then
+# Host lookup against the compiled inventory cache; exit 3 means not found.
+if ROLE=$(/usr/bin/env python3 "$INVENTORY_TO_JSON" "$REPO_DIR/inventory/devices.yaml" --host "$HOSTNAME_ACTUAL" --field role 2>/dev/null); then
+  inventory_rc=0
+else
+  inventory_rc=$?
+fi
+if (( inventory_rc != 0 && inventory_rc != 3 )); then
   append_error "failed to parse inventory at $REPO_DIR/inventory/devices.yaml"
   exit $EXIT_PREREQ_MISSING
 fi
 
-ROLE=$(printf '%s' "$INVENTORY_JSON" | jq -r --arg host "$HOSTNAME_ACTUAL" '.[$host].role // empty')
 if [[ -z "$ROLE" || "$ROLE" == "null" ]]; then
   append_error "Role for host $HOSTNAME_ACTUAL not found. Add to inventory/devices.yaml:\n  devices:\n    $HOSTNAME_ACTUAL:\n      role: <role-name>"
   exit $EXIT_INVENTORY_NOT_FOUND
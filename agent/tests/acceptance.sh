@@ -26,6 +26,8 @@ if [[ ! -x "$PARSER" ]]; then
   exit 1
 fi
 
+python3 "$SCRIPT_DIR/test_inventory_to_json.py"
+
 inventory_json=$(python3 "$PARSER" "$REPO_DIR/inventory/devices.yaml")
 if [[ -z "$inventory_json" ]]; then
   echo "failed to parse inventory" >&2
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Table-driven checks for the YAML-subset loader in lib/inventory_to_json.py.
+
+Standard library only, like the loader itself:
+
+    python3 agent/tests/test_inventory_to_json.py
+"""
+from __future__ import annotations
+
+import json
+import math
+import pathlib
+import subprocess
+import sys
+import tempfile
+import unittest
+
+AGENT_DIR = pathlib.Path(__file__).resolve().parents[1]
+REPO_DIR = AGENT_DIR.parent
+sys.path.insert(0, str(AGENT_DIR / "lib"))
+
+from inventory_to_json import YamlError, load_yaml, load_yaml_with_lines  # noqa: E402
+
+PARSER = AGENT_DIR / "lib" / "inventory_to_json.py"
+
+# (name, yaml text, expected document)
+DOCUMENTS = [
+    (
+        "yaml 1.1 booleans stay strings",
+        "a: yes\nb: on\nc: No\nd: off\ne: y\nf: n\n",
+        {"a": "yes", "b": "on", "c": "No", "d": "off", "e": "y", "f": "n"},
+    ),
+    (
+        "core schema booleans and nulls",
+        "a: true\nb: False\nc: TRUE\nd: ~\ne: null\nf:\ng: 'true'\nh: \"null\"\n",
+        {"a": True, "b": False, "c": True, "d": None, "e": None, "f": None, "g": "true", "h": "null"},
+    ),
+    (
+        "integers: decimal, octal, hex",
+        "a: 42\nb: +12\nc: -7\nd: 0o17\ne: 0x1F\nf: 017\n",
+        {"a": 42, "b": 12, "c": -7, "d": 15, "e": 31, "f": 17},
+    ),
+    (
+        "yaml 1.1 number forms stay strings",
+        "a: 0b101\nb: 1_000\nc: -0x10\nd: 0o9\ne: 1:30\n",
+        {"a": "0b101", "b": "1_000", "c": "-0x10", "d": "0o9", "e": "1:30"},
+    ),
+    (
+        "floats",
+        "a: 1.5\nb: .5\nc: 1e3\nd: -2.5E-1\ne: .inf\nf: -.Inf\n",
+        {"a": 1.5, "b": 0.5, "c": 1000.0, "d": -0.25, "e": math.inf, "f": -math.inf},
+    ),
+    (
+        "merge key with a single alias; explicit keys win",
+        "base: &b\n  x: 1\n  y: 2\nd:\n  <<: *b\n  y: 3\n",
+        {"base": {"x": 1, "y": 2}, "d": {"x": 1, "y": 3}},
+    ),
+    (
+        "merge key with a list; earlier mappings win",
+        "a: &a {p: 1, r: a}\nb: &b {q: 2, r: b}\nc:\n  <<: [*a, *b]\n  p: 9\n",
+        {"a": {"p": 1, "r": "a"}, "b": {"q": 2, "r": "b"}, "c": {"p": 9, "q": 2, "r": "a"}},
+    ),
+    (
+        "anchored scalars and sequences",
+        "a: &v 8080\nb: *v\nl: &l [1, 2]\nm: *l\n",
+        {"a": 8080, "b": 8080, "l": [1, 2], "m": [1, 2]},
+    ),
+    (
+        "compact sequence entries and flow collections",
+        "l:\n  - a: 1\n    b: 2\n  - [x, 'y', \"z\"]\n  - {k: v, n: 3}\n  -\n    nested: true\n",
+        {"l": [{"a": 1, "b": 2}, ["x", "y", "z"], {"k": "v", "n": 3}, {"nested": True}]},
+    ),
+    (
+        "flow collection wrapped over lines",
+        "w: [a,\n  b, c]\nm: {x: 1,\n  y: [2, 3]}\n",
+        {"w": ["a", "b", "c"], "m": {"x": 1, "y": [2, 3]}},
+    ),
+    (
+        "block scalars",
+        "s: |\n  one\n  two\nf: >-\n  a\n  b\nk: |+\n  keep\n\nz: 1\n",
+        {"s": "one\ntwo\n", "f": "a b", "k": "keep\n\n", "z": 1},
+    ),
+    (
+        "quoted scalars and escapes",
+        "q: \"tab\\tnl\\n\\u00e9\"\nr: 'it''s'\ns: 'x # not a comment'\n",
+        {"q": "tab\tnl\n\u00e9", "r": "it's", "s": "x # not a comment"},
+    ),
+    (
+        "comments and urls",
+        "# header\na: 1 # trailing\nu: http://host:8080/path#frag\n",
+        {"a": 1, "u": "http://host:8080/path#frag"},
+    ),
+]
+
+# (name, yaml text, line, column, message fragment)
+ERRORS = [
+    ("nested plain mapping on one line", "a: b: c\n", 1, 5, "mapping values are not allowed"),
+    ("unterminated flow collection", "a: [1, 2\n", 1, 4, "unterminated flow collection"),
+    ("dedented mapping entry", "a:\n  - 1\n b: 2\n", 3, 2, "bad indentation"),
+    ("unknown alias", "a: 1\nb: *missing\n", 2, 4, "unknown alias 'missing'"),
+    ("unterminated double quote", "x: \"open\n", 1, 4, "unterminated quoted scalar"),
+    ("merge of a scalar", "d:\n  <<: 5\n", 2, 3, "merge key expects a mapping"),
+    ("tab indentation", "a: 1\n\tb: 2\n", 2, 1, "tab character"),
+]
+
+
+class LoaderTest(unittest.TestCase):
+    def test_documents(self) -> None:
+        for name, text, expected in DOCUMENTS:
+            with self.subTest(name):
+                self.assertEqual(load_yaml(text), expected)
+
+    def test_nan(self) -> None:
+        self.assertTrue(math.isnan(load_yaml("a: .nan\n")["a"]))
+
+    def test_error_positions(self) -> None:
+        for name, text, line, column, fragment in ERRORS:
+            with self.subTest(name):
+                with self.assertRaises(YamlError) as ctx:
+                    load_yaml(text)
+                self.assertEqual((ctx.exception.line, ctx.exception.column), (line, column))
+                self.assertIn(fragment, ctx.exception.message)
+
+    def test_line_map(self) -> None:
+        doc, lines = load_yaml_with_lines("devices:\n  pi-a:\n    role: x\n  pi-b:\n    role: y\n")
+        self.assertEqual(lines.line(doc["devices"], "pi-b"), 4)
+        self.assertEqual(lines.line(doc["devices"]["pi-a"], "role"), 3)
+
+
+class CliTest(unittest.TestCase):
+    def run_parser(self, *args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, str(PARSER), "--no-cache", *args],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+
+    def test_devices_inventory_types(self) -> None:
+        # logs: true used to come out as the string "true"; it is a JSON boolean now.
+        proc = self.run_parser(str(REPO_DIR / "inventory" / "devices.yaml"))
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        devices = json.loads(proc.stdout)
+        self.assertTrue(devices)
+        for host, record in devices.items():
+            with self.subTest(host):
+                self.assertIsInstance(record.get("role"), str)
+                if "logs" in record:
+                    self.assertIsInstance(record["logs"], bool)
+
+    def test_field_output(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp) / "devices.yaml"
+            path.write_text("devices:\n  pi-a:\n    role: audio-player\n    logs: true\n    port: 0x1F90\n")
+            self.assertEqual(self.run_parser(str(path), "--host", "pi-a", "--field", "role").stdout, "audio-player\n")
+            self.assertEqual(self.run_parser(str(path), "--host", "pi-a", "--field", "logs").stdout, "true\n")
+            self.assertEqual(self.run_parser(str(path), "--host", "pi-a", "--field", "port").stdout, "8080\n")
+            self.assertEqual(self.run_parser(str(path), "--host", "pi-b").returncode, 3)
+
+    def test_error_report(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp) / "devices.yaml"
+            path.write_text("devices:\n  pi-a:\n    role: [audio\n")
+            proc = self.run_parser(str(path))
+            self.assertEqual(proc.returncode, 1)
+            self.assertEqual(proc.stderr.strip(), f"{path}:3:11: unterminated flow collection")
+
+
+if __name__ == "__main__":
+    unittest.main()
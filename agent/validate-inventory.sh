@@ -3,19 +3,26 @@ set -euo pipefail
 
 usage() {
   cat <<EOF
-Usage: $(basename "$0") [--host HOSTNAME]
+Usage: $(basename "$0") [--host HOSTNAME] [--deep]
 
 Validates inventory/devices.yaml ensuring each device maps to a role.
+With --deep, also cross-checks device-interfaces.yaml, role OpenAPI specs
+and Prometheus targets (agent/lib/inventory_validate.py).
 EOF
 }
 
 HOST_FILTER=""
+DEEP=0
 while [[ $# -gt 0 ]]; do
   case "$1" in
     --host)
       HOST_FILTER="$2"
       shift 2
       ;;
+    --deep)
+      DEEP=1
+      shift
+      ;;
     --help|-h)
       usage
       exit 0
@@ -32,6 +39,7 @@ SCRIPT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)
 REPO_DIR=${ROLE_AGENT_REPO_DIR:-$(cd "$SCRIPT_DIR/.." && pwd)}
 INVENTORY="$REPO_DIR/inventory/devices.yaml"
 PARSER="$SCRIPT_DIR/lib/inventory_to_json.py"
+VALIDATOR="$SCRIPT_DIR/lib/inventory_validate.py"
 
 if [[ ! -f "$INVENTORY" ]]; then
   echo "inventory file not found: $INVENTORY" >&2
@@ -43,14 +51,16 @@ if [[ ! -x "$PARSER" ]]; then
   exit 1
 fi
 
-INVENTORY_JSON=$(python3 "$PARSER" "$INVENTORY")
-if [[ -z "$INVENTORY_JSON" ]]; then
-  echo "failed to parse inventory" >&2
-  exit 1
-fi
-
 if [[ -n "$HOST_FILTER" ]]; then
-  role=$(printf '%s' "$INVENTORY_JSON" | jq -r --arg host "$HOST_FILTER" '.[$host].role // empty')
+  if role=$(python3 "$PARSER" "$INVENTORY" --host "$HOST_FILTER" --field role); then
+    rc=0
+  else
+    rc=$?
+  fi
+  if (( rc != 0 && rc != 3 )); then
+    echo "failed to parse inventory" >&2
+    exit 1
+  fi
   if [[ -z "$role" ]]; then
     cat >&2 <<EOF
 Host '$HOST_FILTER' missing or lacks role in inventory.
@@ -62,9 +72,18 @@ EOF
     exit 1
   fi
   echo "Host $HOST_FILTER has role: $role"
+  if (( DEEP )); then
+    python3 "$VALIDATOR" --repo "$REPO_DIR"
+  fi
   exit 0
 fi
 
+INVENTORY_JSON=$(python3 "$PARSER" "$INVENTORY")
+if [[ -z "$INVENTORY_JSON" ]]; then
+  echo "failed to parse inventory" >&2
+  exit 1
+fi
+
 missing=$(printf '%s' "$INVENTORY_JSON" | jq -r 'to_entries[] | select((.value.role // "") == "") | .key')
 if [[ -n "$missing" ]]; then
   echo "The following hosts are missing roles:" >&2
@@ -76,4 +95,7 @@ fi
 
 count=$(printf '%s' "$INVENTORY_JSON" | jq 'length')
 echo "Inventory OK. Hosts with roles: $count"
+if (( DEEP )); then
+  python3 "$VALIDATOR" --repo "$REPO_DIR"
+fi
 exit 0
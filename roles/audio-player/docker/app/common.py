@@ -2,7 +2,10 @@ from __future__ import annotations
 
 import json
 import os
-from typing import Any, Dict, Mapping
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
 
 
 def load_json(path: str, default: Mapping[str, Any]) -> Dict[str, Any]:
@@ -20,10 +23,19 @@ def load_json(path: str, default: Mapping[str, Any]) -> Dict[str, Any]:
 def save_json(path: str, payload: Mapping[str, Any]) -> None:
     directory = os.path.dirname(path) or "."
     os.makedirs(directory, exist_ok=True)
-    tmp_path = f"{path}.tmp"
-    with open(tmp_path, "w", encoding="utf-8") as handle:
-        json.dump(payload, handle)
-    os.replace(tmp_path, path)
+    # Unique temp name: concurrent writers must not replace each other's file.
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
 
 
 def clamp(value: float, minimum: float, maximum: float) -> float:
@@ -36,3 +48,52 @@ def clamp(value: float, minimum: float, maximum: float) -> float:
 
 def ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
+
+
+class SystemClock:
+    """Wall-clock time and sleep for the supervision loops.
+
+    The failover simulator (``tests/bench/failover.py``) replaces a module's
+    ``clock`` with a virtual one to replay fault timelines deterministically.
+    """
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+
+class Histogram:
+    """Labelled histogram rendered in the Prometheus text format."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # Per-bucket counts, then sum and count.
+            series = self._series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self, name: str, help_text: str) -> List[str]:
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, values in series:
+            labels = ",".join(f'{label}="{value}"' for label, value in key)
+            prefix = f"{labels}," if labels else ""
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {int(count)}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {int(values[-1])}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {values[-2]}")
+            lines.append(f"{name}_count{suffix} {int(values[-1])}")
+        return lines
@@ -1,14 +1,17 @@
 from __future__ import annotations
 
 import logging
+import math
 import os
-import re
-import subprocess
+import time
 from typing import Any, Dict
 
 from flask import Flask, Response, jsonify, request
 
 from common import clamp, ensure_dir, load_json, save_json
+from loudness import LOUDNESS_ENABLED, analyse_in_background, entry_for
+from mixer import Mixer, MixerError, get_mixer
+from status_stream import StatusStream
 
 BIND = os.environ.get("CONTROL_BIND", "0.0.0.0")
 PORT = int(os.environ.get("CONTROL_PORT", "8081"))
@@ -16,11 +19,14 @@ DATA_DIR = os.environ.get("AUDIO_DATA_DIR", "/data")
 CFG_PATH = os.path.join(DATA_DIR, "config.json")
 STATE_PATH = os.path.join(DATA_DIR, "state.json")
 FALLBACK_PATH = os.path.join(DATA_DIR, "fallback.mp3")
+LOUDNESS_INDEX = os.path.join(DATA_DIR, "loudness.json")
 TOKEN = os.environ.get("AUTH_TOKEN", "")
 MIXER_CARD = os.environ.get("MIXER_CARD", "0")
 MIXER_CONTROL = os.environ.get("MIXER_CONTROL", "Master")
 DEFAULT_VOLUME = clamp(float(os.environ.get("AUDIO_VOLUME", "1.0")), 0.0, 2.0)
 DEFAULT_STREAM_URL = os.environ.get("STREAM_URL", "")
+# Furthest ahead a synchronized /play start may be scheduled.
+SYNC_MAX_LEAD_SECONDS = float(os.environ.get("PLAY_SYNC_MAX_LEAD_SECONDS", "300"))
 
 VALID_SOURCES = {"stream", "file", "stop"}
 VALID_MODES = {"auto", "manual"}
@@ -51,6 +57,7 @@ def load_config() -> Dict[str, Any]:
 
 def save_config(config: Dict[str, Any]) -> None:
     save_json(CFG_PATH, config)
+    status_stream.notify()
 
 
 def load_state() -> Dict[str, Any]:
@@ -67,6 +74,7 @@ def load_state() -> Dict[str, Any]:
 
 def save_state(state: Dict[str, Any]) -> None:
     save_json(STATE_PATH, state)
+    status_stream.notify()
 
 
 def _authed() -> bool:
@@ -79,7 +87,7 @@ def _authed() -> bool:
 @app.before_request
 def require_auth():
     # Allow unauthenticated access to read-only monitoring endpoints
-    if request.path in ("/healthz", "/status", "/config", "/metrics", "/openapi.yaml"):
+    if request.path in ("/healthz", "/status", "/status/stream", "/config", "/metrics", "/openapi.yaml"):
         return None
     if not _authed():
         return jsonify({"error": "unauthorized"}), 401
@@ -94,8 +102,7 @@ def _escape_label(value: str) -> str:
     return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
 
 
-@app.get("/status")
-def get_status():
+def status_document() -> Dict[str, Any]:
     cfg = load_config()
     state = load_state()
     fallback_exists = os.path.exists(FALLBACK_PATH) or bool(state.get("fallback_exists"))
@@ -110,7 +117,44 @@ def get_status():
     last_error = state.get("last_error")
     if last_error:
         response["last_error"] = last_error
-    return jsonify(response)
+    if isinstance(state.get("sync"), dict):
+        response["sync"] = state["sync"]
+    if isinstance(state.get("buffer"), dict):
+        response["buffer"] = state["buffer"]
+    if isinstance(state.get("levels"), dict):
+        response["levels"] = state["levels"]
+    loudness = entry_for(FALLBACK_PATH, LOUDNESS_INDEX)
+    if loudness is not None:
+        response["fallback_loudness"] = loudness
+    return response
+
+
+# player.py writes state.json from its own container, so watch both files;
+# the loudness index changes when an upload's analysis finishes.
+status_stream = StatusStream(status_document, (CFG_PATH, STATE_PATH, LOUDNESS_INDEX), log=app.logger.warning)
+
+
+@app.get("/status")
+def get_status():
+    return jsonify(status_document())
+
+
+@app.get("/status/stream")
+def get_status_stream():
+    sub = status_stream.subscribe()
+    if sub is None:
+        response = jsonify({"error": "too many status stream subscribers"})
+        response.status_code = 503
+        response.headers["Retry-After"] = "5"
+        return response
+    response = Response(
+        status_stream.events(sub),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Frees the slot even if the client leaves before the body starts.
+    response.call_on_close(lambda: status_stream.unsubscribe(sub))
+    return response
 
 
 @app.get("/config")
@@ -198,8 +242,27 @@ def post_play():
         if mode not in VALID_MODES:
             return _bad_request("mode must be 'auto' or 'manual'")
         cfg["mode"] = mode
+    start_at = None
+    if data.get("start_at") is not None or data.get("start_in") is not None:
+        now = time.time()
+        try:
+            if data.get("start_at") is not None:
+                start_at = float(data.get("start_at"))
+            else:
+                start_at = now + float(data.get("start_in"))
+        except Exception:
+            return _bad_request("start_at/start_in must be numeric")
+        if not math.isfinite(start_at) or start_at <= now:
+            return _bad_request("start_at must be in the future")
+        if start_at - now > SYNC_MAX_LEAD_SECONDS:
+            return _bad_request(f"start_at must be within {SYNC_MAX_LEAD_SECONDS:g}s")
+        cfg["start_at"] = round(start_at, 3)
+    else:
+        cfg.pop("start_at", None)
     save_config(cfg)
-    app.logger.info("POST /play -> source=%s mode=%s", cfg.get("source"), cfg.get("mode"))
+    app.logger.info(
+        "POST /play -> source=%s mode=%s start_at=%s", cfg.get("source"), cfg.get("mode"), cfg.get("start_at")
+    )
     return jsonify(cfg)
 
 
@@ -207,6 +270,7 @@ def post_play():
 def post_stop():
     cfg = load_config()
     cfg["source"] = "stop"
+    cfg.pop("start_at", None)
     save_config(cfg)
     app.logger.info("POST /stop -> stop")
     return jsonify(cfg)
@@ -224,7 +288,13 @@ def post_upload():
     except Exception:
         size = 0
     app.logger.info("POST /upload -> saved fallback (%s bytes)", size)
-    return jsonify({"saved": True, "path": FALLBACK_PATH, "size": size})
+    analyse_in_background(FALLBACK_PATH, LOUDNESS_INDEX)
+    return jsonify({
+        "saved": True,
+        "path": FALLBACK_PATH,
+        "size": size,
+        "loudness": "analysing" if LOUDNESS_ENABLED else "disabled",
+    })
 
 
 @app.get("/healthz")
@@ -232,19 +302,23 @@ def healthz():
     return "ok"
 
 
-def _amixer_cmd(*args: str) -> list[str]:
-    return ["amixer", "-c", str(MIXER_CARD), *args]
+def _mixer() -> Mixer:
+    return get_mixer(MIXER_CARD, MIXER_CONTROL)
 
 
 @app.get("/hwvolume")
 def get_hwvolume():
-    try:
-        output = subprocess.check_output(_amixer_cmd("get", MIXER_CONTROL), text=True)
-        match = re.search(r"\[(\d+)%\]", output)
-        volume = int(match.group(1)) if match else None
-    except Exception:
-        volume = None
-    return jsonify({"mixer_card": int(MIXER_CARD), "mixer_control": MIXER_CONTROL, "volume_percent": volume})
+    # Served from the mixer cache, which ALSA change events keep current.
+    mixer = _mixer()
+    return jsonify(
+        {
+            "mixer_card": int(MIXER_CARD),
+            "mixer_control": MIXER_CONTROL,
+            "volume_percent": mixer.percent,
+            "backend": mixer.backend,
+            "error": mixer.error,
+        }
+    )
 
 
 @app.post("/hwvolume")
@@ -256,8 +330,10 @@ def post_hwvolume():
         return _bad_request("volume_percent must be numeric")
     value = max(0, min(100, value))
     try:
-        subprocess.check_call(_amixer_cmd("set", MIXER_CONTROL, f"{value}%"))
-    except Exception as exc:
+        # Applied by the mixer writer (rapid updates collapse to the latest);
+        # waits for the write so failures still surface as a 500.
+        value = _mixer().set_percent(value)
+    except MixerError as exc:
         return str(exc), 500
     app.logger.info("POST /hwvolume -> %s%%", value)
     return jsonify({"ok": True, "volume_percent": value})
@@ -288,6 +364,14 @@ def get_metrics():
     lines.append("# HELP audio_fallback_exists Whether fallback file exists on disk")
     lines.append("# TYPE audio_fallback_exists gauge")
     lines.append(f"audio_fallback_exists {1 if fallback_exists else 0}")
+    loudness = entry_for(FALLBACK_PATH, LOUDNESS_INDEX)
+    if loudness is not None and loudness.get("integrated_lufs") is not None:
+        lines.append("# HELP audio_fallback_loudness_lufs Measured integrated loudness of the fallback file")
+        lines.append("# TYPE audio_fallback_loudness_lufs gauge")
+        lines.append(f"audio_fallback_loudness_lufs {loudness.get('integrated_lufs')}")
+        lines.append("# HELP audio_fallback_gain_db Static gain applied to the fallback file at playback")
+        lines.append("# TYPE audio_fallback_gain_db gauge")
+        lines.append(f"audio_fallback_gain_db {loudness.get('gain_db')}")
     lines.append("# HELP audio_fallback_active Indicates fallback playback is active")
     lines.append("# TYPE audio_fallback_active gauge")
     lines.append(f"audio_fallback_active {fallback_active}")
@@ -312,6 +396,51 @@ def get_metrics():
     lines.append("# HELP audio_player_state_info Info metric capturing the last player error message")
     lines.append("# TYPE audio_player_state_info gauge")
     lines.append(f"audio_player_state_info{{last_error=\"{_escape_label(last_error or '')}\"}} 1")
+    buffer = state.get("buffer") if isinstance(state.get("buffer"), dict) else {}
+    lines.append("# HELP audio_buffer_seconds Current audio buffer depth in seconds")
+    lines.append("# TYPE audio_buffer_seconds gauge")
+    lines.append(f"audio_buffer_seconds {float(buffer.get('seconds') or 0.0)}")
+    if buffer:
+        lines.append("# HELP audio_buffer_spilled_bytes Read-ahead bytes currently spooled to disk")
+        lines.append("# TYPE audio_buffer_spilled_bytes gauge")
+        lines.append(f"audio_buffer_spilled_bytes {int(buffer.get('spilled_bytes') or 0)}")
+        lines.append("# HELP audio_buffer_reconnects_total Stream reconnects by the read-ahead fetcher")
+        lines.append("# TYPE audio_buffer_reconnects_total counter")
+        lines.append(f"audio_buffer_reconnects_total {int(buffer.get('reconnects') or 0)}")
+        lines.append("# HELP audio_buffer_underruns_total Times the read-ahead buffer ran dry")
+        lines.append("# TYPE audio_buffer_underruns_total counter")
+        lines.append(f"audio_buffer_underruns_total {int(buffer.get('underruns') or 0)}")
+    levels = state.get("levels") if isinstance(state.get("levels"), dict) else {}
+    if levels:
+        lines.append("# HELP audio_level_rms_dbfs RMS level of the last analysed window of the stream (dBFS)")
+        lines.append("# TYPE audio_level_rms_dbfs gauge")
+        lines.append(f"audio_level_rms_dbfs {float(levels.get('rms_dbfs') or 0.0)}")
+        lines.append("# HELP audio_level_peak_dbfs Peak sample of the last analysed window of the stream (dBFS)")
+        lines.append("# TYPE audio_level_peak_dbfs gauge")
+        lines.append(f"audio_level_peak_dbfs {float(levels.get('peak_dbfs') or 0.0)}")
+        lines.append("# HELP audio_level_clipped_samples_total Full-scale samples seen in the stream")
+        lines.append("# TYPE audio_level_clipped_samples_total counter")
+        lines.append(f"audio_level_clipped_samples_total {int(levels.get('clipped_samples') or 0)}")
+        lines.append("# HELP audio_silence_seconds Length of the current run of silence in the stream")
+        lines.append("# TYPE audio_silence_seconds gauge")
+        lines.append(f"audio_silence_seconds {float(levels.get('silence_seconds') or 0.0)}")
+        lines.append("# HELP audio_clipping_seconds Length of the current run of clipping in the stream")
+        lines.append("# TYPE audio_clipping_seconds gauge")
+        lines.append(f"audio_clipping_seconds {float(levels.get('clipping_seconds') or 0.0)}")
+    lines.append("# HELP audio_status_stream_subscribers Clients connected to /status/stream")
+    lines.append("# TYPE audio_status_stream_subscribers gauge")
+    lines.append(f"audio_status_stream_subscribers {status_stream.subscribers}")
+    sync = state.get("sync")
+    if isinstance(sync, dict) and sync.get("offset_ms") is not None:
+        lines.append("# HELP audio_sync_start_offset_seconds First sample of the last synchronized start minus its target time")
+        lines.append("# TYPE audio_sync_start_offset_seconds gauge")
+        lines.append(f"audio_sync_start_offset_seconds {float(sync['offset_ms']) / 1000.0}")
+        lines.append("# HELP audio_sync_target_timestamp Unix timestamp the last synchronized start was scheduled for")
+        lines.append("# TYPE audio_sync_target_timestamp gauge")
+        lines.append(f"audio_sync_target_timestamp {float(sync.get('start_at') or 0.0)}")
+        lines.append("# HELP audio_sync_prebuffer_seconds Audio buffered when the last synchronized start was released")
+        lines.append("# TYPE audio_sync_prebuffer_seconds gauge")
+        lines.append(f"audio_sync_prebuffer_seconds {float(sync.get('prebuffered_ms') or 0.0) / 1000.0}")
     return Response("\n".join(lines) + "\n", mimetype="text/plain")
 
 
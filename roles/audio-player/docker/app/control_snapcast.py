@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import logging
 import os
-import re
+import socket
 import subprocess
 import json
 import time
@@ -12,7 +12,10 @@ from typing import Any, Dict, Optional
 import docker
 from flask import Flask, Response, jsonify, request
 
-from common import clamp, ensure_dir, load_json, save_json
+from common import Histogram, SystemClock, clamp, ensure_dir, load_json, save_json
+from loudness import LOUDNESS_ENABLED, analyse_in_background, entry_for
+from mixer import Mixer, MixerError, get_mixer
+from status_stream import StatusStream
 
 BIND = os.environ.get("CONTROL_BIND", "0.0.0.0")
 PORT = int(os.environ.get("CONTROL_PORT", "8081"))
@@ -20,6 +23,9 @@ DATA_DIR = os.environ.get("AUDIO_DATA_DIR", "/data")
 CFG_PATH = os.path.join(DATA_DIR, "config.json")
 STATE_PATH = os.path.join(DATA_DIR, "state.json")
 FALLBACK_PATH = os.path.join(DATA_DIR, "fallback.mp3")
+LOUDNESS_INDEX = os.path.join(DATA_DIR, "loudness.json")
+# Plain-text copy of the fallback's gain in dB for fallback.liq.
+FALLBACK_GAIN_PATH = os.path.join(DATA_DIR, "fallback.gain")
 TOKEN = os.environ.get("AUTH_TOKEN", "")
 MIXER_CARD = os.environ.get("MIXER_CARD", "0")
 MIXER_CONTROL = os.environ.get("MIXER_CONTROL", "Master")
@@ -28,6 +34,27 @@ DEFAULT_STREAM_URL = os.environ.get("STREAM_URL", "")
 DEVICE_ID = os.environ.get("DEVICE_ID", "unknown")
 SNAPCAST_SERVER = os.environ.get("SNAPCAST_SERVER", "vps")
 SNAPCAST_PORT = int(os.environ.get("SNAPCAST_PORT", "1705"))
+# Buffer configured on the Snapcast server (snapserver.conf `buffer`, ms).
+SNAPCAST_BUFFER_MS = float(os.environ.get("SNAPCAST_BUFFER_MS", "1000"))
+# Failover tuning: consecutive failed checks (one per SNAPCAST_CHECK_SECONDS)
+# before the fallback starts, and how long a restored connection must hold
+# before switching back.
+SNAPCAST_CHECK_SECONDS = float(os.environ.get("SNAPCAST_CHECK_SECONDS", "1"))
+SNAPCAST_FAILURE_THRESHOLD = int(os.environ.get("SNAPCAST_FAILURE_THRESHOLD", "3"))
+SNAPCAST_FAILBACK_STABLE_SECONDS = float(os.environ.get("SNAPCAST_FAILBACK_STABLE_SECONDS", "5"))
+# Warm standby keeps audio-fallback running with its output closed, so a
+# failover is Liquidsoap's enable switch and fade instead of a container boot.
+FALLBACK_WARM_STANDBY = os.environ.get("FALLBACK_WARM_STANDBY", "1") == "1"
+# Upper bound on waiting for Liquidsoap to answer / confirm a switch.
+FALLBACK_READY_TIMEOUT_SECONDS = float(os.environ.get("FALLBACK_READY_TIMEOUT_SECONDS", "10"))
+FALLBACK_PROBE_INTERVAL_SECONDS = 0.1
+# Liquidsoap's telnet server in audio-fallback, reached over the compose
+# network: a socket round trip instead of a `docker exec` per command.
+LIQUIDSOAP_HOST = os.environ.get("LIQUIDSOAP_TELNET_HOST", "audio-fallback")
+LIQUIDSOAP_PORT = int(os.environ.get("LIQUIDSOAP_TELNET_PORT", "1235"))
+LIQUIDSOAP_TIMEOUT_SECONDS = 2.0
+FALLBACK_STANDBY_CHECK_SECONDS = 30.0
+SWITCH_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)
 
 VALID_SOURCES = {"stream", "file", "stop"}
 VALID_MODES = {"auto", "manual"}
@@ -54,6 +81,9 @@ class PlaybackMode:
 current_mode = PlaybackMode.STOPPED
 snapcast_connected = False
 last_mode_switch = time.time()
+last_standby_check: Optional[float] = None
+switch_latency = Histogram(SWITCH_BUCKETS)
+clock = SystemClock()
 
 
 def load_config() -> Dict[str, Any]:
@@ -68,6 +98,7 @@ def load_config() -> Dict[str, Any]:
 
 def save_config(config: Dict[str, Any]) -> None:
     save_json(CFG_PATH, config)
+    status_stream.notify()
 
 
 def load_state() -> Dict[str, Any]:
@@ -84,6 +115,7 @@ def load_state() -> Dict[str, Any]:
 
 def save_state(state: Dict[str, Any]) -> None:
     save_json(STATE_PATH, state)
+    status_stream.notify()
 
 
 def docker_container_running(name: str) -> bool:
@@ -124,40 +156,96 @@ def docker_container_stop(name: str) -> bool:
         return False
 
 
-def check_snapcast_connection() -> bool:
-    """Check if Snapcast client is connected to server."""
+def check_snapcast_connection() -> Optional[bool]:
+    """Check if Snapcast client is connected to server (None if Docker cannot tell)."""
     global snapcast_connected
     try:
-        # Use Docker API to exec into snapcast-client container
         client = docker.from_env()
+    except Exception as e:
+        # The Docker API being down says nothing about the audio path; now
+        # that Liquidsoap is reached without it, a failover would overlap.
+        app.logger.debug(f"Docker API unavailable: {e}")
+        return None
+    try:
+        # Use Docker API to exec into snapcast-client container
         container = client.containers.get("snapcast-client")
         exit_code, _ = container.exec_run("pgrep snapclient")
         connected = exit_code == 0
-        snapcast_connected = connected
-        return connected
     except Exception:
-        snapcast_connected = False
-        return False
+        connected = False
+    if connected != snapcast_connected:
+        snapcast_connected = connected
+        status_stream.notify()
+    return connected
 
 
 def liquidsoap_command(command: str) -> str:
-    """Send command to Liquidsoap fallback via telnet."""
+    """Send command to Liquidsoap fallback via telnet; returns the reply before ``END``."""
     try:
-        result = subprocess.run(
-            ["docker", "exec", "audio-fallback", "sh", "-c",
-             f'echo "{command}" | nc 127.0.0.1 1235'],
-            capture_output=True,
-            timeout=2,
-            text=True
-        )
-        return result.stdout.strip()
-    except Exception as e:
+        with socket.create_connection(
+            (LIQUIDSOAP_HOST, LIQUIDSOAP_PORT), timeout=LIQUIDSOAP_TIMEOUT_SECONDS
+        ) as conn:
+            conn.sendall(f"{command}\n".encode())
+            reply = b""
+            while b"END" not in reply.splitlines():
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                reply += chunk
+        lines = reply.decode(errors="replace").splitlines()
+        return "\n".join(lines[: lines.index("END")] if "END" in lines else lines).strip()
+    except OSError as e:
         app.logger.error(f"Liquidsoap command failed: {e}")
         return ""
 
 
+def liquidsoap_output_status() -> Optional[str]:
+    """``on``/``off`` for the fallback ALSA output, or None if Liquidsoap does not answer."""
+    for line in liquidsoap_command("alsa_output.status").splitlines():
+        line = line.strip()
+        if line in ("on", "off"):
+            return line
+    return None
+
+
+def wait_for_fallback(expect: Optional[str], timeout: float) -> bool:
+    """Probe Liquidsoap until it answers (and its output reports ``expect``)."""
+    deadline = clock.time() + timeout
+    while True:
+        status = liquidsoap_output_status()
+        if status is not None and (expect is None or status == expect):
+            return True
+        if clock.time() >= deadline:
+            return False
+        clock.sleep(FALLBACK_PROBE_INTERVAL_SECONDS)
+
+
+def ensure_fallback_standby() -> None:
+    """Keep audio-fallback running (muted) while Snapcast plays."""
+    global last_standby_check
+    if not FALLBACK_WARM_STANDBY:
+        return
+    now = clock.time()
+    if last_standby_check is not None and now - last_standby_check < FALLBACK_STANDBY_CHECK_SECONDS:
+        return
+    last_standby_check = now
+    if not docker_container_running("audio-fallback"):
+        app.logger.info("Starting audio-fallback in warm standby")
+        docker_container_start("audio-fallback")
+
+
+def write_fallback_gain(entry: Optional[Dict[str, Any]]) -> None:
+    """Publish the fallback's measured gain where Liquidsoap polls for it."""
+    gain = entry.get("gain_db", 0.0) if entry else 0.0
+    try:
+        with open(FALLBACK_GAIN_PATH, "w", encoding="utf-8") as handle:
+            handle.write(f"{gain}\n")
+    except OSError as exc:
+        app.logger.warning("Could not write %s: %s", FALLBACK_GAIN_PATH, exc)
+
+
 def start_fallback_mode():
-    """Start Liquidsoap fallback container."""
+    """Switch to the Liquidsoap fallback, starting its container only if it is not warm."""
     global current_mode, last_mode_switch
 
     if current_mode == PlaybackMode.FALLBACK:
@@ -166,17 +254,24 @@ def start_fallback_mode():
     app.logger.info("Network failure detected - switching to fallback mode")
 
     try:
-        # Start fallback container
+        started = clock.time()
+        path = "warm"
         if not docker_container_running("audio-fallback"):
+            path = "cold"
             docker_container_start("audio-fallback")
-            time.sleep(2)  # Wait for container to fully start
+            if not wait_for_fallback(None, FALLBACK_READY_TIMEOUT_SECONDS):
+                app.logger.warning("audio-fallback not answering after %.0fs", FALLBACK_READY_TIMEOUT_SECONDS)
 
-        # Enable playback via Liquidsoap
+        # Enable playback via Liquidsoap; it opens ALSA and fades in.
         liquidsoap_command("var.set enabled = true")
+        if wait_for_fallback("on", FALLBACK_READY_TIMEOUT_SECONDS):
+            switch_latency.observe(clock.time() - started, direction="to_fallback", path=path)
+        else:
+            app.logger.warning("Fallback output did not confirm start")
 
         current_mode = PlaybackMode.FALLBACK
-        last_mode_switch = time.time()
-        app.logger.info("Fallback mode active - playing local file")
+        last_mode_switch = clock.time()
+        app.logger.info("Fallback mode active (%s start) - playing local file", path)
 
         # Update state
         state = load_state()
@@ -192,7 +287,7 @@ def start_fallback_mode():
 
 
 def stop_fallback_mode():
-    """Stop Liquidsoap fallback and return to Snapcast."""
+    """Mute the Liquidsoap fallback and return to Snapcast."""
     global current_mode, last_mode_switch
 
     if current_mode != PlaybackMode.FALLBACK:
@@ -201,16 +296,20 @@ def stop_fallback_mode():
     app.logger.info("Network restored - switching back to Snapcast")
 
     try:
-        # Disable fallback playback
+        started = clock.time()
+        # Disable fallback playback; Liquidsoap fades out, then closes ALSA.
         liquidsoap_command("var.set enabled = false")
-        time.sleep(0.5)
+        if wait_for_fallback("off", FALLBACK_READY_TIMEOUT_SECONDS):
+            path = "warm" if FALLBACK_WARM_STANDBY else "cold"
+            switch_latency.observe(clock.time() - started, direction="to_snapcast", path=path)
+        else:
+            app.logger.warning("Fallback output did not confirm stop")
 
-        # Stop fallback container
-        if docker_container_running("audio-fallback"):
+        if not FALLBACK_WARM_STANDBY and docker_container_running("audio-fallback"):
             docker_container_stop("audio-fallback")
 
         current_mode = PlaybackMode.SNAPCAST
-        last_mode_switch = time.time()
+        last_mode_switch = clock.time()
         app.logger.info("Snapcast synchronized mode active")
 
         # Update state
@@ -231,13 +330,16 @@ def monitor_connection():
     global current_mode
 
     consecutive_failures = 0
-    FAILURE_THRESHOLD = 3  # 3 seconds before switching
 
     while True:
-        time.sleep(1)
+        clock.sleep(SNAPCAST_CHECK_SECONDS)
 
         # Always check connection status for metrics/UI
         connected = check_snapcast_connection()
+        if connected is None:
+            continue
+        if current_mode != PlaybackMode.FALLBACK:
+            ensure_fallback_standby()
 
         # Only perform mode switching if not stopped
         if current_mode == PlaybackMode.STOPPED:
@@ -246,24 +348,47 @@ def monitor_connection():
 
         if not connected:
             consecutive_failures += 1
-            if consecutive_failures >= FAILURE_THRESHOLD and current_mode == PlaybackMode.SNAPCAST:
+            if consecutive_failures >= SNAPCAST_FAILURE_THRESHOLD and current_mode == PlaybackMode.SNAPCAST:
                 start_fallback_mode()
         else:
             if consecutive_failures > 0:
-                app.logger.info(f"Snapcast connection restored (was down {consecutive_failures}s)")
+                app.logger.info(f"Snapcast connection restored (was down {consecutive_failures} checks)")
             consecutive_failures = 0
 
             # Return from fallback to Snapcast
             if current_mode == PlaybackMode.FALLBACK:
-                # Wait 5 seconds for stable connection
-                time.sleep(5)
+                # Wait for the connection to prove stable
+                clock.sleep(SNAPCAST_FAILBACK_STABLE_SECONDS)
                 if check_snapcast_connection():
                     stop_fallback_mode()
 
 
-# Start monitoring thread
+def status_document() -> Dict[str, Any]:
+    cfg = load_config()
+    fallback_exists = os.path.exists(FALLBACK_PATH)
+
+    return {
+        "mode": current_mode,
+        "snapcast_connected": snapcast_connected,
+        "fallback_exists": fallback_exists,
+        "volume": cfg.get("volume", DEFAULT_VOLUME),
+        "device_id": DEVICE_ID,
+        "snapcast_server": SNAPCAST_SERVER,
+        "now_playing": current_mode,
+        "fallback_active": (current_mode == PlaybackMode.FALLBACK),
+        "stream_up": 1 if snapcast_connected else 0,
+        "last_switch_timestamp": last_mode_switch,
+        "stream_url": cfg.get("stream_url", DEFAULT_STREAM_URL),
+        "fallback_loudness": entry_for(FALLBACK_PATH, LOUDNESS_INDEX),
+    }
+
+
+# Mode and connection changes notify directly; the file watch catches
+# config.json edits made outside this process and the loudness index, which
+# an upload's background analysis writes.
+status_stream = StatusStream(status_document, (CFG_PATH, LOUDNESS_INDEX), log=app.logger.warning)
+
 monitor_thread = threading.Thread(target=monitor_connection, daemon=True)
-monitor_thread.start()
 
 
 def _authed() -> bool:
@@ -275,7 +400,7 @@ def _authed() -> bool:
 
 @app.before_request
 def require_auth():
-    if request.path in ("/healthz", "/status", "/config", "/metrics", "/openapi.yaml"):
+    if request.path in ("/healthz", "/status", "/status/stream", "/config", "/metrics", "/openapi.yaml"):
         return None
     if not _authed():
         return jsonify({"error": "unauthorized"}), 401
@@ -293,24 +418,26 @@ def _escape_label(value: str) -> str:
 @app.get("/status")
 def get_status():
     """Get device playback status."""
-    cfg = load_config()
-    fallback_exists = os.path.exists(FALLBACK_PATH)
-
-    response = {
-        "mode": current_mode,
-        "snapcast_connected": snapcast_connected,
-        "fallback_exists": fallback_exists,
-        "volume": cfg.get("volume", DEFAULT_VOLUME),
-        "device_id": DEVICE_ID,
-        "snapcast_server": SNAPCAST_SERVER,
-        "now_playing": current_mode,
-        "fallback_active": (current_mode == PlaybackMode.FALLBACK),
-        "stream_up": 1 if snapcast_connected else 0,
-        "last_switch_timestamp": last_mode_switch,
-        "stream_url": cfg.get("stream_url", DEFAULT_STREAM_URL),
-    }
-
-    return jsonify(response)
+    return jsonify(status_document())
+
+
+@app.get("/status/stream")
+def get_status_stream():
+    """Server-sent events: full status snapshot, then deltas as they happen."""
+    sub = status_stream.subscribe()
+    if sub is None:
+        response = jsonify({"error": "too many status stream subscribers"})
+        response.status_code = 503
+        response.headers["Retry-After"] = "5"
+        return response
+    response = Response(
+        status_stream.events(sub),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Frees the slot even if the client leaves before the body starts.
+    response.call_on_close(lambda: status_stream.unsubscribe(sub))
+    return response
 
 
 @app.get("/config")
@@ -465,7 +592,14 @@ def post_upload():
         size = 0
 
     app.logger.info("POST /upload -> saved fallback (%s bytes)", size)
-    return jsonify({"saved": True, "path": FALLBACK_PATH, "size": size})
+    write_fallback_gain(None)
+    analyse_in_background(FALLBACK_PATH, LOUDNESS_INDEX, on_done=write_fallback_gain)
+    return jsonify({
+        "saved": True,
+        "path": FALLBACK_PATH,
+        "size": size,
+        "loudness": "analysing" if LOUDNESS_ENABLED else "disabled",
+    })
 
 
 @app.get("/healthz")
@@ -473,19 +607,23 @@ def healthz():
     return "ok"
 
 
-def _amixer_cmd(*args: str) -> list[str]:
-    return ["amixer", "-c", str(MIXER_CARD), *args]
+def _mixer() -> Mixer:
+    return get_mixer(MIXER_CARD, MIXER_CONTROL)
 
 
 @app.get("/hwvolume")
 def get_hwvolume():
-    try:
-        output = subprocess.check_output(_amixer_cmd("get", MIXER_CONTROL), text=True)
-        match = re.search(r"\[(\d+)%\]", output)
-        volume = int(match.group(1)) if match else None
-    except Exception:
-        volume = None
-    return jsonify({"mixer_card": int(MIXER_CARD), "mixer_control": MIXER_CONTROL, "volume_percent": volume})
+    # Served from the mixer cache, which ALSA change events keep current.
+    mixer = _mixer()
+    return jsonify(
+        {
+            "mixer_card": int(MIXER_CARD),
+            "mixer_control": MIXER_CONTROL,
+            "volume_percent": mixer.percent,
+            "backend": mixer.backend,
+            "error": mixer.error,
+        }
+    )
 
 
 @app.post("/hwvolume")
@@ -499,8 +637,10 @@ def post_hwvolume():
     value = max(0, min(100, value))
 
     try:
-        subprocess.check_call(_amixer_cmd("set", MIXER_CONTROL, f"{value}%"))
-    except Exception as exc:
+        # Applied by the mixer writer (rapid updates collapse to the latest);
+        # waits for the write so failures still surface as a 500.
+        value = _mixer().set_percent(value)
+    except MixerError as exc:
         return str(exc), 500
 
     app.logger.info("POST /hwvolume -> %s%%", value)
@@ -525,6 +665,14 @@ def get_metrics():
     lines.append("# HELP audio_fallback_exists Whether fallback file exists on disk")
     lines.append("# TYPE audio_fallback_exists gauge")
     lines.append(f"audio_fallback_exists {1 if fallback_exists else 0}")
+    loudness = entry_for(FALLBACK_PATH, LOUDNESS_INDEX)
+    if loudness is not None and loudness.get("integrated_lufs") is not None:
+        lines.append("# HELP audio_fallback_loudness_lufs Measured integrated loudness of the fallback file")
+        lines.append("# TYPE audio_fallback_loudness_lufs gauge")
+        lines.append(f"audio_fallback_loudness_lufs {loudness.get('integrated_lufs')}")
+        lines.append("# HELP audio_fallback_gain_db Static gain applied to the fallback file at playback")
+        lines.append("# TYPE audio_fallback_gain_db gauge")
+        lines.append(f"audio_fallback_gain_db {loudness.get('gain_db')}")
 
     # Fallback active
     lines.append("# HELP audio_fallback_active Indicates fallback playback is active")
@@ -541,8 +689,13 @@ def get_metrics():
     lines.append("# TYPE snapcast_connected gauge")
     lines.append(f"snapcast_connected {1 if snapcast_connected else 0}")
 
-    # NEW: Buffer seconds (for Snapcast, typically 1s)
-    buffer_seconds = 1.0 if snapcast_connected else 0.0
+    # Buffer depth: measured by player.py's read-ahead stage when it runs,
+    # otherwise the Snapcast server's configured buffer while connected.
+    buffer = load_state().get("buffer")
+    if isinstance(buffer, dict):
+        buffer_seconds = float(buffer.get("seconds") or 0.0)
+    else:
+        buffer_seconds = SNAPCAST_BUFFER_MS / 1000.0 if snapcast_connected else 0.0
     lines.append("# HELP audio_buffer_seconds Current audio buffer depth in seconds")
     lines.append("# TYPE audio_buffer_seconds gauge")
     lines.append(f"audio_buffer_seconds {buffer_seconds}")
@@ -558,6 +711,21 @@ def get_metrics():
     lines.append("# TYPE audio_last_switch_timestamp gauge")
     lines.append(f"audio_last_switch_timestamp {last_mode_switch}")
 
+    lines.append("# HELP audio_fallback_warm_standby Whether audio-fallback is kept running between failovers")
+    lines.append("# TYPE audio_fallback_warm_standby gauge")
+    lines.append(f"audio_fallback_warm_standby {1 if FALLBACK_WARM_STANDBY else 0}")
+    lines.extend(
+        switch_latency.render(
+            "audio_fallback_switch_seconds",
+            "Time from a switch decision to Liquidsoap confirming its output state",
+        )
+    )
+
+    # Push subscribers
+    lines.append("# HELP audio_status_stream_subscribers Clients connected to /status/stream")
+    lines.append("# TYPE audio_status_stream_subscribers gauge")
+    lines.append(f"audio_status_stream_subscribers {status_stream.subscribers}")
+
     return Response("\n".join(lines) + "\n", mimetype="text/plain")
 
 
@@ -590,6 +758,7 @@ def main() -> None:
     if not os.path.exists(STATE_PATH):
         save_state(load_state())
 
+    monitor_thread.start()
     app.logger.info("audio-control (Snapcast mode) starting on %s:%s", BIND, PORT)
     app.logger.info("Device ID: %s, Snapcast server: %s:%s", DEVICE_ID, SNAPCAST_SERVER, SNAPCAST_PORT)
     app.run(host=BIND, port=PORT)
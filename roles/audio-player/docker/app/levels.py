@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from typing import IO, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # level analysis is skipped without numpy
+    np = None
+
+LEVELS_ENABLED = os.environ.get("PLAYER_LEVELS_ENABLED", "1") == "1"
+WINDOW_SECONDS = float(os.environ.get("PLAYER_LEVEL_WINDOW_SECONDS", "0.5"))
+# A window whose RMS is below this counts as silent.
+SILENCE_DBFS = float(os.environ.get("PLAYER_SILENCE_DBFS", "-55"))
+# Sustained silence / clipping that makes auto mode fall back (0 disables).
+SILENCE_SECONDS = float(os.environ.get("PLAYER_SILENCE_SECONDS", "15"))
+CLIP_SECONDS = float(os.environ.get("PLAYER_CLIP_SECONDS", "10"))
+# Fraction of full-scale samples in a window that counts it as clipping.
+CLIP_RATIO = float(os.environ.get("PLAYER_CLIP_RATIO", "0.01"))
+# How long auto mode stays on the fallback after dead air before retrying.
+RETRY_SECONDS = float(os.environ.get("PLAYER_LEVEL_RETRY_SECONDS", "60"))
+SAMPLE_RATE = 48000
+CHANNELS = 2
+FULL_SCALE = 32768.0
+CLIP_LEVEL = 32767
+FLOOR_DBFS = -120.0
+READ_BYTES = 16384
+
+
+def available() -> bool:
+    return LEVELS_ENABLED and np is not None
+
+
+def tap_args() -> List[str]:
+    """Extra ffmpeg output that copies the decoded audio to stdout for analysis.
+
+    It sits after the ALSA output and has no volume filter, so it measures the
+    stream as received rather than the software gain.
+    """
+    if not available():
+        return []
+    return ["-vn", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1"]
+
+
+def _dbfs(value: float) -> float:
+    if value <= 0:
+        return FLOOR_DBFS
+    return max(20 * math.log10(value / FULL_SCALE), FLOOR_DBFS)
+
+
+class LevelMeter:
+    """Windowed RMS, peak and clip counts over interleaved s16le PCM.
+
+    Complete windows are analysed together as one NumPy block. Runs of
+    silent windows (RMS below ``PLAYER_SILENCE_DBFS``) and clipping windows
+    (at least ``PLAYER_CLIP_RATIO`` of samples at full scale) are timed, and
+    ``fault`` names the first one that lasts past its limit.
+    """
+
+    def __init__(
+        self,
+        window: float = WINDOW_SECONDS,
+        silence_dbfs: float = SILENCE_DBFS,
+        silence_seconds: float = SILENCE_SECONDS,
+        clip_ratio: float = CLIP_RATIO,
+        clip_seconds: float = CLIP_SECONDS,
+    ):
+        self.window_frames = max(int(window * SAMPLE_RATE), 1)
+        self.window_seconds = self.window_frames / SAMPLE_RATE
+        self.window_bytes = self.window_frames * CHANNELS * 2
+        self.silence_dbfs = silence_dbfs
+        self.silence_limit = silence_seconds
+        self.clip_ratio = clip_ratio
+        self.clip_limit = clip_seconds
+        self.rms_dbfs = FLOOR_DBFS
+        self.peak_dbfs = FLOOR_DBFS
+        self.clipped_samples = 0
+        self.silence_seconds = 0.0
+        self.clipping_seconds = 0.0
+        self.analysed_seconds = 0.0
+        self.updated_at: Optional[float] = None
+        self._pending = bytearray()
+        self._lock = threading.Lock()
+
+    def feed(self, data: bytes) -> None:
+        self._pending += data
+        count = len(self._pending) // self.window_bytes
+        if not count:
+            return
+        size = count * self.window_bytes
+        block = np.frombuffer(bytes(self._pending[:size]), dtype="<i2").reshape(count, -1)
+        del self._pending[:size]
+        samples = block.astype(np.float32)
+        rms = np.sqrt(np.mean(samples * samples, axis=1))
+        magnitude = np.abs(block.astype(np.int32))
+        peak = magnitude.max(axis=1)
+        clips = np.count_nonzero(magnitude >= CLIP_LEVEL, axis=1)
+        clip_threshold = self.clip_ratio * block.shape[1]
+        with self._lock:
+            for window_rms, window_clips in zip(rms.tolist(), clips.tolist()):
+                if _dbfs(window_rms) < self.silence_dbfs:
+                    self.silence_seconds += self.window_seconds
+                else:
+                    self.silence_seconds = 0.0
+                if window_clips and window_clips >= clip_threshold:
+                    self.clipping_seconds += self.window_seconds
+                else:
+                    self.clipping_seconds = 0.0
+            self.rms_dbfs = _dbfs(float(rms[-1]))
+            self.peak_dbfs = _dbfs(float(peak[-1]))
+            self.clipped_samples += int(clips.sum())
+            self.analysed_seconds += count * self.window_seconds
+            self.updated_at = time.time()
+
+    def fault(self) -> Optional[str]:
+        with self._lock:
+            if self.silence_limit > 0 and self.silence_seconds >= self.silence_limit:
+                return f"dead air for {self.silence_seconds:.0f}s"
+            if self.clip_limit > 0 and self.clipping_seconds >= self.clip_limit:
+                return f"clipping for {self.clipping_seconds:.0f}s"
+        return None
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "rms_dbfs": round(self.rms_dbfs, 1),
+                "peak_dbfs": round(self.peak_dbfs, 1),
+                "clipped_samples": self.clipped_samples,
+                "silence_seconds": round(self.silence_seconds, 1),
+                "clipping_seconds": round(self.clipping_seconds, 1),
+                "analysed_seconds": round(self.analysed_seconds, 1),
+                "updated_at": self.updated_at,
+            }
+
+
+def start_tap(stdout: Optional[IO[bytes]]) -> Optional[LevelMeter]:
+    """Drain ``stdout`` (the ``tap_args`` output) into a new meter on a thread.
+
+    The pipe is always drained, even if analysis fails, because ffmpeg blocks
+    every output, the audible one included, when the pipe fills up.
+    """
+    if stdout is None or not available():
+        return None
+    meter = LevelMeter()
+
+    def pump() -> None:
+        analysing = True
+        while True:
+            try:
+                chunk = stdout.read1(READ_BYTES)
+            except (ValueError, OSError):
+                return
+            if not chunk:
+                return
+            if analysing:
+                try:
+                    meter.feed(chunk)
+                except Exception:
+                    analysing = False
+
+    threading.Thread(target=pump, name="level-tap", daemon=True).start()
+    return meter
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from common import load_json, save_json
+
+LOUDNESS_ENABLED = os.environ.get("LOUDNESS_ANALYSIS", "1") == "1"
+# Integrated loudness files are brought to (EBU R128 is -23; streams sit near -16).
+TARGET_LUFS = float(os.environ.get("LOUDNESS_TARGET_LUFS", "-16"))
+# Gain is reduced so the measured true peak stays below this.
+MAX_TRUE_PEAK_DBTP = float(os.environ.get("LOUDNESS_MAX_TRUE_PEAK_DBTP", "-1"))
+MAX_GAIN_DB = float(os.environ.get("LOUDNESS_MAX_GAIN_DB", "12"))
+ANALYSIS_TIMEOUT_SECONDS = float(os.environ.get("LOUDNESS_ANALYSIS_TIMEOUT_SECONDS", "600"))
+# ebur128 reports this for digital silence; no gain is derived from it.
+SILENT_LUFS = -70.0
+
+logger = logging.getLogger("audio.loudness")
+
+_SUMMARY_RE = {
+    "integrated_lufs": re.compile(r"I:\s+(-?[\d.]+|-inf) LUFS"),
+    "lra_lu": re.compile(r"LRA:\s+(-?[\d.]+) LU"),
+    "true_peak_dbtp": re.compile(r"Peak:\s+(-?[\d.]+|-inf) dBFS"),
+}
+_index_lock = threading.Lock()
+
+
+def measure_args(path: str) -> list:
+    """ffmpeg command that decodes ``path`` once through the EBU R128 meter."""
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostats",
+        "-i",
+        path,
+        "-vn",
+        "-af",
+        "ebur128=peak=true",
+        "-f",
+        "null",
+        "-",
+    ]
+
+
+def parse_summary(output: str) -> Optional[Dict[str, float]]:
+    """Pull integrated loudness, LRA and true peak out of ebur128's summary."""
+    marker = output.rfind("Summary:")
+    if marker < 0:
+        return None
+    summary = output[marker:]
+    values: Dict[str, float] = {}
+    for key, pattern in _SUMMARY_RE.items():
+        match = pattern.search(summary)
+        if match is None:
+            return None
+        values[key] = float("-inf") if match.group(1) == "-inf" else float(match.group(1))
+    return values
+
+
+def measure(path: str) -> Optional[Dict[str, float]]:
+    try:
+        proc = subprocess.run(
+            measure_args(path),
+            capture_output=True,
+            text=True,
+            timeout=ANALYSIS_TIMEOUT_SECONDS,
+        )
+    except (OSError, subprocess.TimeoutExpired) as exc:
+        logger.warning("loudness analysis of %s failed: %s", path, exc)
+        return None
+    values = parse_summary(proc.stderr)
+    if proc.returncode != 0 or values is None:
+        logger.warning("loudness analysis of %s failed (exit %s)", path, proc.returncode)
+        return None
+    return values
+
+
+def gain_for(values: Dict[str, float]) -> float:
+    """Static gain in dB: reach ``TARGET_LUFS`` without pushing the true peak
+    above ``MAX_TRUE_PEAK_DBTP``, limited to +/- ``MAX_GAIN_DB``."""
+    integrated = values["integrated_lufs"]
+    if integrated <= SILENT_LUFS:
+        return 0.0
+    gain = TARGET_LUFS - integrated
+    peak = values["true_peak_dbtp"]
+    if peak > float("-inf"):
+        gain = min(gain, MAX_TRUE_PEAK_DBTP - peak)
+    return round(max(-MAX_GAIN_DB, min(MAX_GAIN_DB, gain)), 2)
+
+
+def _fingerprint(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return {"size": st.st_size, "mtime": int(st.st_mtime)}
+
+
+def entry_for(path: str, index_path: str) -> Optional[Dict[str, Any]]:
+    """Index entry for ``path``, or None if it is missing or the file changed since."""
+    entry = load_json(index_path, {}).get(os.path.basename(path))
+    fingerprint = _fingerprint(path)
+    if not isinstance(entry, dict) or fingerprint is None:
+        return None
+    if entry.get("size") != fingerprint["size"] or entry.get("mtime") != fingerprint["mtime"]:
+        return None
+    return entry
+
+
+def gain_db(path: str, index_path: str) -> float:
+    entry = entry_for(path, index_path)
+    if entry is None:
+        return 0.0
+    try:
+        return float(entry.get("gain_db", 0.0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def gain_factor(path: str, index_path: str) -> float:
+    return 10 ** (gain_db(path, index_path) / 20)
+
+
+def _update(index_path: str, name: str, entry: Optional[Dict[str, Any]]) -> None:
+    with _index_lock:
+        index = load_json(index_path, {})
+        if entry is None:
+            index.pop(name, None)
+        else:
+            index[name] = entry
+        save_json(index_path, index)
+
+
+def forget(path: str, index_path: str) -> None:
+    _update(index_path, os.path.basename(path), None)
+
+
+def analyse(path: str, index_path: str) -> Optional[Dict[str, Any]]:
+    """Measure ``path`` and record its gain in the sidecar index at ``index_path``."""
+    fingerprint = _fingerprint(path)
+    values = measure(path) if fingerprint is not None else None
+    if values is None:
+        return None
+    entry: Dict[str, Any] = {
+        key: (round(value, 2) if value > float("-inf") else None) for key, value in values.items()
+    }
+    entry.update(fingerprint)
+    entry["gain_db"] = gain_for(values)
+    entry["target_lufs"] = TARGET_LUFS
+    entry["analysed_at"] = time.time()
+    _update(index_path, os.path.basename(path), entry)
+    logger.info(
+        "loudness %s: %.1f LUFS, true peak %s dBTP, gain %+.2f dB",
+        os.path.basename(path),
+        values["integrated_lufs"],
+        entry["true_peak_dbtp"],
+        entry["gain_db"],
+    )
+    return entry
+
+
+def analyse_in_background(path: str, index_path: str, on_done=None) -> Optional[threading.Thread]:
+    """Forget ``path``'s old entry and analyse it on a thread (upload handlers)."""
+    forget(path, index_path)
+    if not LOUDNESS_ENABLED:
+        return None
+
+    def run() -> None:
+        entry = analyse(path, index_path)
+        if on_done is not None:
+            on_done(entry)
+
+    thread = threading.Thread(target=run, name="loudness", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import re
+import select
+import subprocess
+import threading
+import time
+from typing import Callable, List, Optional
+
+logger = logging.getLogger("audio.mixer")
+
+# snd_mixer_selem_channel_id_t: SND_MIXER_SCHN_FRONT_LEFT
+_FRONT_LEFT = 0
+
+
+# How long POST /hwvolume waits for the writer thread to apply a value.
+WRITE_TIMEOUT = 2.0
+
+
+class MixerError(RuntimeError):
+    pass
+
+
+class _PollFd(ctypes.Structure):
+    _fields_ = [("fd", ctypes.c_int), ("events", ctypes.c_short), ("revents", ctypes.c_short)]
+
+
+class AlsaMixerBackend:
+    """Simple-mixer element opened once through libasound via ctypes."""
+
+    name = "alsa"
+
+    def __init__(self, card: str, control: str):
+        path = ctypes.util.find_library("asound") or "libasound.so.2"
+        try:
+            lib = ctypes.CDLL(path)
+        except OSError as exc:
+            raise MixerError(f"libasound unavailable: {exc}") from exc
+        self._lib = lib
+        lib.snd_mixer_find_selem.restype = ctypes.c_void_p
+        lib.snd_strerror.restype = ctypes.c_char_p
+        # Raw volumes are C longs; declare them so values are not truncated to int.
+        lib.snd_mixer_selem_set_playback_volume_all.argtypes = [ctypes.c_void_p, ctypes.c_long]
+        lib.snd_mixer_selem_get_playback_volume.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_int,
+            ctypes.POINTER(ctypes.c_long),
+        ]
+        self._handle = ctypes.c_void_p()
+        self._check(lib.snd_mixer_open(ctypes.byref(self._handle), 0), "open")
+        device = card if str(card).startswith(("hw:", "default")) else f"hw:{card}"
+        try:
+            self._check(lib.snd_mixer_attach(self._handle, device.encode()), f"attach {device}")
+            self._check(lib.snd_mixer_selem_register(self._handle, None, None), "register")
+            self._check(lib.snd_mixer_load(self._handle), "load")
+            sid = ctypes.c_void_p()
+            self._check(lib.snd_mixer_selem_id_malloc(ctypes.byref(sid)), "selem id")
+            try:
+                lib.snd_mixer_selem_id_set_index(sid, 0)
+                lib.snd_mixer_selem_id_set_name(sid, control.encode())
+                elem = lib.snd_mixer_find_selem(self._handle, sid)
+            finally:
+                lib.snd_mixer_selem_id_free(sid)
+            if not elem:
+                raise MixerError(f"mixer control '{control}' not found on {device}")
+            self._elem = ctypes.c_void_p(elem)
+            if not lib.snd_mixer_selem_has_playback_volume(self._elem):
+                raise MixerError(f"mixer control '{control}' has no playback volume")
+            low, high = ctypes.c_long(), ctypes.c_long()
+            self._check(
+                lib.snd_mixer_selem_get_playback_volume_range(self._elem, ctypes.byref(low), ctypes.byref(high)),
+                "volume range",
+            )
+            self._min, self._max = low.value, high.value
+        except Exception:
+            lib.snd_mixer_close(self._handle)
+            raise
+
+    def _check(self, rc: int, what: str) -> None:
+        if rc < 0:
+            raise MixerError(f"snd_mixer {what}: {self._lib.snd_strerror(rc).decode(errors='replace')}")
+
+    def read_percent(self) -> int:
+        value = ctypes.c_long()
+        self._check(
+            self._lib.snd_mixer_selem_get_playback_volume(self._elem, _FRONT_LEFT, ctypes.byref(value)),
+            "get volume",
+        )
+        if self._max <= self._min:
+            return 0
+        return int(round((value.value - self._min) * 100 / (self._max - self._min)))
+
+    def write_percent(self, percent: int) -> None:
+        raw = self._min + int(round((self._max - self._min) * percent / 100))
+        self._check(self._lib.snd_mixer_selem_set_playback_volume_all(self._elem, raw), "set volume")
+
+    def poll_fds(self) -> List[int]:
+        count = self._lib.snd_mixer_poll_descriptors_count(self._handle)
+        if count <= 0:
+            return []
+        fds = (_PollFd * count)()
+        filled = self._lib.snd_mixer_poll_descriptors(self._handle, fds, count)
+        return [fds[i].fd for i in range(max(filled, 0))]
+
+    def handle_events(self) -> None:
+        self._check(self._lib.snd_mixer_handle_events(self._handle), "handle events")
+
+    def close(self) -> None:
+        self._lib.snd_mixer_close(self._handle)
+
+
+class AmixerCoprocessBackend:
+    """Fallback: one long-lived ``amixer -s`` reading commands from stdin.
+
+    Writes go down the pipe without a fork each; the level is read once at
+    start and afterwards tracked from our own writes (no change events).
+    """
+
+    name = "amixer"
+
+    def __init__(self, card: str, control: str):
+        self.card = str(card)
+        self.control = control
+        try:
+            output = subprocess.check_output(["amixer", "-c", self.card, "get", control], text=True, timeout=5)
+        except (OSError, subprocess.SubprocessError) as exc:
+            raise MixerError(f"amixer unavailable: {exc}") from exc
+        match = re.search(r"\[(\d+)%\]", output)
+        self._initial = int(match.group(1)) if match else None
+        self._proc: Optional[subprocess.Popen] = None
+
+    def _coprocess(self) -> subprocess.Popen:
+        if self._proc is None or self._proc.poll() is not None:
+            self._proc = subprocess.Popen(
+                ["amixer", "-q", "-c", self.card, "-s"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                text=True,
+            )
+        return self._proc
+
+    def read_percent(self) -> Optional[int]:
+        return self._initial
+
+    def write_percent(self, percent: int) -> None:
+        proc = self._coprocess()
+        try:
+            proc.stdin.write(f"sset '{self.control}' {percent}%\n")
+            proc.stdin.flush()
+        except (BrokenPipeError, OSError) as exc:
+            self._proc = None
+            raise MixerError(f"amixer coprocess died: {exc}") from exc
+        self._initial = percent
+
+    def poll_fds(self) -> List[int]:
+        return []
+
+    def handle_events(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.stdin.close()
+            self._proc.wait(timeout=2)
+
+
+class Mixer:
+    """Cached hardware volume with coalesced writes and change notifications.
+
+    ``percent`` never touches the hardware: it is refreshed by ALSA change
+    events (so external tools like alsamixer are seen too) and by our own
+    writes. ``set_percent`` records the target and waits for a writer thread
+    that applies only the latest pending value, so a burst of slider updates
+    costs one or two mixer writes while each caller still learns whether the
+    write (or a newer one covering it) succeeded.
+    """
+
+    def __init__(self, card: str, control: str):
+        self.card = str(card)
+        self.control = control
+        self.percent: Optional[int] = None
+        self.error: Optional[str] = None
+        self.writes = 0
+        self.coalesced = 0
+        self.lost_at = 0.0
+        self._backend = None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._pending: Optional[int] = None
+        # Request sequence numbers: the latest queued and the latest applied
+        # (with the error of that write, if any).
+        self._requested = 0
+        self._applied = 0
+        self._applied_error: Optional[str] = None
+        self._listeners: List[Callable[[int], None]] = []
+        for backend in (AlsaMixerBackend, AmixerCoprocessBackend):
+            try:
+                self._backend = backend(self.card, control)
+                break
+            except MixerError as exc:
+                self.error = str(exc)
+                logger.warning("mixer backend %s unavailable: %s", backend.name, exc)
+        if self._backend is None:
+            return
+        self.error = None
+        self.percent = self._backend.read_percent()
+        threading.Thread(target=self._writer, name="mixer-writer", daemon=True).start()
+        if self._backend.poll_fds():
+            threading.Thread(target=self._events, name="mixer-events", daemon=True).start()
+
+    @property
+    def backend(self) -> Optional[str]:
+        return self._backend.name if self._backend else None
+
+    @property
+    def available(self) -> bool:
+        return self._backend is not None
+
+    def subscribe(self, callback: Callable[[int], None]) -> None:
+        """Call ``callback(percent)`` whenever the level changes."""
+        self._listeners.append(callback)
+
+    def set_percent(self, percent: int, timeout: float = WRITE_TIMEOUT) -> int:
+        """Queue ``percent`` and wait until it (or a newer value) is written.
+
+        Raises MixerError when that write fails, the card is lost before it,
+        or nothing is written within ``timeout`` seconds.
+        """
+        if self._backend is None:
+            raise MixerError(self.error or "no mixer backend")
+        percent = max(0, min(100, int(percent)))
+        with self._cond:
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = percent
+            self._requested += 1
+            ticket = self._requested
+            self._cond.notify_all()
+            done = self._cond.wait_for(lambda: self._applied >= ticket or self._backend is None, timeout)
+            if self._applied >= ticket:
+                if self._applied_error is not None:
+                    raise MixerError(self._applied_error)
+                return percent
+        if not done:
+            raise MixerError(f"mixer write not applied within {timeout:g}s")
+        raise MixerError(self.error or "mixer lost")
+
+    def _publish(self, percent: Optional[int]) -> None:
+        if percent is None or percent == self.percent:
+            return
+        self.percent = percent
+        for callback in list(self._listeners):
+            try:
+                callback(percent)
+            except Exception:
+                logger.exception("mixer listener failed")
+
+    def _writer(self) -> None:
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    if self._backend is None:
+                        return
+                    self._cond.wait()
+                target, self._pending = self._pending, None
+                ticket = self._requested
+            error = None
+            try:
+                with self._lock:
+                    if self._backend is None:
+                        break  # card lost; get_mixer() opens a new Mixer
+                    self._backend.write_percent(target)
+                self.writes += 1
+                self.error = None
+                self._publish(target)
+            except MixerError as exc:
+                error = self.error = str(exc)
+                logger.error("mixer write failed: %s", exc)
+            with self._cond:
+                self._applied, self._applied_error = ticket, error
+                self._cond.notify_all()
+        # Wake callers still waiting for a write that will never happen.
+        with self._cond:
+            self._cond.notify_all()
+
+    def _lost(self, reason: str) -> None:
+        """Drop the backend after the card went away; get_mixer() reopens later."""
+        with self._lock:
+            backend, self._backend = self._backend, None
+            self.error = reason
+            self.lost_at = time.monotonic()
+            if backend is not None:
+                try:
+                    backend.close()
+                except Exception:
+                    pass
+        with self._cond:
+            self._cond.notify_all()
+        logger.error("mixer lost: %s; reopening in %.0fs", reason, RETRY_SECONDS)
+
+    def _events(self) -> None:
+        poller = select.poll()
+        for fd in self._backend.poll_fds():
+            poller.register(fd, select.POLLIN)
+        while True:
+            ready = poller.poll(5000)
+            if not ready:
+                continue
+            # An unplugged card reports these on every poll; reading on would spin.
+            if any(revents & (select.POLLERR | select.POLLHUP | select.POLLNVAL) for _, revents in ready):
+                self._lost("mixer device disconnected")
+                return
+            try:
+                with self._lock:
+                    self._backend.handle_events()
+                    level = self._backend.read_percent()
+            except MixerError as exc:
+                self._lost(str(exc))
+                return
+            self._publish(level)
+
+
+RETRY_SECONDS = 30.0
+
+_mixer: Optional[Mixer] = None
+_mixer_opened = 0.0
+_mixer_lock = threading.Lock()
+
+
+def get_mixer(card: str, control: str) -> Mixer:
+    """Process-wide mixer, opened on first use (and retried while unavailable)."""
+    global _mixer, _mixer_opened
+    with _mixer_lock:
+        # A lost card is retried RETRY_SECONDS after the disconnect, not after the last open.
+        if _mixer is None or (
+            not _mixer.available and time.monotonic() - max(_mixer_opened, _mixer.lost_at) > RETRY_SECONDS
+        ):
+            _mixer = Mixer(card, control)
+            _mixer_opened = time.monotonic()
+        return _mixer
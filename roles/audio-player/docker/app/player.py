@@ -1,13 +1,20 @@
 from __future__ import annotations
 
+import fcntl
 import os
 import signal
 import subprocess
 import sys
+import threading
 import time
-from typing import Optional
+from collections import deque
+from typing import List, Optional
 
-from common import clamp, ensure_dir, load_json, save_json
+from common import SystemClock, clamp, ensure_dir, load_json, save_json
+from levels import RETRY_SECONDS as LEVEL_RETRY_SECONDS
+from levels import start_tap, tap_args
+from loudness import gain_factor
+from readahead import BUFFER_SECONDS, PREFILL_SECONDS, StreamFetcher
 
 DATA_DIR = os.environ.get("AUDIO_DATA_DIR", "/data")
 CFG_PATH = os.path.join(DATA_DIR, "config.json")
@@ -16,13 +23,30 @@ LOG_PATH = os.path.join(DATA_DIR, "player.log")
 OUTPUT_DEVICE = os.environ.get("AUDIO_OUTPUT_DEVICE", "hw:0,0")
 DEFAULT_STREAM_URL = os.environ.get("STREAM_URL", "")
 FALLBACK_PATH = os.environ.get("FALLBACK_FILE", os.path.join(DATA_DIR, "fallback.mp3"))
+# Gains measured by the control API on upload (see loudness.py).
+LOUDNESS_INDEX = os.path.join(DATA_DIR, "loudness.json")
 HEARTBEAT_INTERVAL = float(os.environ.get("PLAYER_HEARTBEAT_SECONDS", "1.0"))
+# How long ffprobe may try to open the stream before auto mode gives up on it.
+PROBE_TIMEOUT_SECONDS = float(os.environ.get("PLAYER_PROBE_TIMEOUT_SECONDS", "2.0"))
+# Synchronized starts (POST /play with start_at): audio is decoded ahead of the
+# target time and held in memory, then released to a pre-opened ALSA sink.
+SYNC_PREBUFFER_SECONDS = float(os.environ.get("PLAYER_SYNC_PREBUFFER_SECONDS", "1.0"))
+# Known output latency of the DAC path; audio is released this much earlier.
+SYNC_OUTPUT_LATENCY_MS = float(os.environ.get("PLAYER_SYNC_OUTPUT_LATENCY_MS", "0"))
+# start_at values further in the past than this are ignored (plain restart).
+SYNC_STALE_SECONDS = 10.0
+SYNC_SAMPLE_RATE = 48000
+SYNC_CHANNELS = 2
+SYNC_BYTES_PER_SECOND = SYNC_SAMPLE_RATE * SYNC_CHANNELS * 2
+SYNC_CHUNK_BYTES = 4096
 
 try:
     DEFAULT_VOLUME = float(os.environ.get("AUDIO_VOLUME", "1.0"))
 except Exception:
     DEFAULT_VOLUME = 1.0
 
+clock = SystemClock()
+
 
 def log_event(message: str) -> None:
     timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
@@ -100,10 +124,109 @@ def play_stream(url: str, volume: float) -> subprocess.Popen:
         "alsa",
         OUTPUT_DEVICE,
     ]
-    return subprocess.Popen(args)
+    tap = tap_args()
+    proc = subprocess.Popen(args + tap, stdout=subprocess.PIPE if tap else None)
+    proc.levels = start_tap(proc.stdout)
+    return proc
+
+
+class BufferedStream:
+    """ffmpeg fed from a read-ahead buffer instead of reading the URL itself.
+
+    A ``StreamFetcher`` keeps up to ``PLAYER_BUFFER_SECONDS`` of the stream in
+    memory (spilling to disk when configured) and reconnects on its own, so
+    network drops shorter than the buffer never reach the decoder. Exposes the
+    subset of the ``Popen`` interface the player loop uses.
+    """
+
+    def __init__(self, url: str, volume: float):
+        self.fetcher = StreamFetcher(url, log=log_event)
+        self.fetcher.start()
+        args = [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "info",
+            "-i",
+            "pipe:0",
+            "-vn",
+            "-af",
+            f"volume={volume}",
+            "-c:a",
+            "pcm_s16le",
+            "-f",
+            "alsa",
+            OUTPUT_DEVICE,
+        ]
+        tap = tap_args()
+        self.decoder = subprocess.Popen(args + tap, stdin=subprocess.PIPE, stdout=subprocess.PIPE if tap else None)
+        self.levels = start_tap(self.decoder.stdout)
+        try:
+            # Keep the read-ahead in our buffer (where it is measured) rather
+            # than in a 64 KiB kernel pipe.
+            fcntl.fcntl(self.decoder.stdin.fileno(), fcntl.F_SETPIPE_SZ, 4096)
+        except (AttributeError, OSError):
+            pass
+        self.returncode: Optional[int] = None
+        self._pump = threading.Thread(target=self._pump_loop, name="buffer-pump", daemon=True)
+        self._pump.start()
+
+    def _pump_loop(self) -> None:
+        # Start with a little audio in hand; give up waiting after a while so
+        # ffmpeg's own errors surface instead of a silent hang.
+        self.fetcher.wait_prefill(timeout=max(PREFILL_SECONDS * 5, 10.0))
+        while True:
+            chunk = self.fetcher.read()
+            if chunk is None:
+                break
+            if not chunk:
+                continue
+            try:
+                self.decoder.stdin.write(chunk)
+                self.decoder.stdin.flush()
+            except (BrokenPipeError, ValueError, OSError):
+                break
+        try:
+            self.decoder.stdin.close()
+        except (BrokenPipeError, ValueError, OSError):
+            pass
+
+    def report(self) -> dict:
+        return self.fetcher.report()
+
+    def buffered(self) -> bool:
+        return self.fetcher.seconds() > 0
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None:
+            self.returncode = self.decoder.poll()
+            if self.returncode is not None:
+                self.fetcher.stop()
+        return self.returncode
+
+    def terminate(self) -> None:
+        self.fetcher.stop()
+        if self.decoder.poll() is None:
+            self.decoder.terminate()
+
+    def kill(self) -> None:
+        if self.decoder.poll() is None:
+            self.decoder.kill()
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        self.decoder.wait(timeout=timeout)
+        return self.poll()
+
+
+def start_stream(url: str, volume: float):
+    """Buffered playback for HTTP(S) streams when enabled, else direct ffmpeg."""
+    if BUFFER_SECONDS > 0 and url.startswith(("http://", "https://")):
+        return BufferedStream(url, volume)
+    return play_stream(url, volume)
 
 
 def play_fallback(path: str, volume: float) -> subprocess.Popen:
+    volume *= gain_factor(path, LOUDNESS_INDEX)
     args = [
         "ffmpeg",
         "-hide_banner",
@@ -126,6 +249,210 @@ def play_fallback(path: str, volume: float) -> subprocess.Popen:
     return subprocess.Popen(args)
 
 
+def decode_args(source: str, target: str, volume: float) -> List[str]:
+    """ffmpeg command that decodes ``target`` to raw PCM on stdout."""
+    args = ["ffmpeg", "-hide_banner", "-loglevel", "info"]
+    if source == "file":
+        volume *= gain_factor(target, LOUDNESS_INDEX)
+        args += ["-stream_loop", "-1"]
+    else:
+        args += [
+            "-reconnect",
+            "1",
+            "-reconnect_streamed",
+            "1",
+            "-reconnect_on_network_error",
+            "1",
+            "-reconnect_delay_max",
+            "2",
+        ]
+    args += [
+        "-i",
+        target,
+        "-vn",
+        "-af",
+        f"volume={volume}",
+        "-ac",
+        str(SYNC_CHANNELS),
+        "-ar",
+        str(SYNC_SAMPLE_RATE),
+        "-f",
+        "s16le",
+        "pipe:1",
+    ]
+    return args
+
+
+def sink_args() -> List[str]:
+    return [
+        "aplay",
+        "-q",
+        "-D",
+        OUTPUT_DEVICE,
+        "-t",
+        "raw",
+        "-f",
+        "S16_LE",
+        "-r",
+        str(SYNC_SAMPLE_RATE),
+        "-c",
+        str(SYNC_CHANNELS),
+    ]
+
+
+class SyncedPlayback:
+    """Decoder and ALSA sink started early, with audio released at ``start_at``.
+
+    The decoder fills an in-memory buffer while the sink (aplay) has already
+    opened the device and waits on stdin. For live streams the buffer keeps
+    only the newest ``SYNC_PREBUFFER_SECONDS`` so every device releases audio
+    the same distance behind the live edge; files are buffered from the start
+    and the decoder is paused once the buffer is full. Exposes the subset of
+    the ``Popen`` interface the player loop uses.
+    """
+
+    def __init__(self, source: str, target: str, volume: float, start_at: float):
+        self.source = source
+        self.start_at = start_at
+        self.release_at = start_at - SYNC_OUTPUT_LATENCY_MS / 1000.0
+        self.prebuffer_bytes = max(int(SYNC_PREBUFFER_SECONDS * SYNC_BYTES_PER_SECOND), SYNC_CHUNK_BYTES)
+        self.prepared_at = time.time()
+        self.released_at: Optional[float] = None
+        self.first_audio_at: Optional[float] = None
+        self.prebuffered_bytes = 0
+        self.returncode: Optional[int] = None
+        self._buffer: deque = deque()
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._released = threading.Event()
+        self._stopping = False
+        self.sink = subprocess.Popen(sink_args(), stdin=subprocess.PIPE)
+        self.decoder = subprocess.Popen(decode_args(source, target, volume), stdout=subprocess.PIPE)
+        self._reader = threading.Thread(target=self._read_loop, name="sync-reader", daemon=True)
+        self._timer = threading.Thread(target=self._release_loop, name="sync-release", daemon=True)
+        self._reader.start()
+        self._timer.start()
+
+    def _write(self, chunk: bytes) -> bool:
+        try:
+            self.sink.stdin.write(chunk)
+            self.sink.stdin.flush()
+        except (BrokenPipeError, ValueError, OSError):
+            return False
+        if self.first_audio_at is None:
+            self.first_audio_at = time.time()
+        return True
+
+    def _read_loop(self) -> None:
+        live = self.source != "file"
+        while not self._stopping:
+            try:
+                chunk = self.decoder.stdout.read1(SYNC_CHUNK_BYTES)
+            except (ValueError, OSError):
+                break
+            if not chunk:
+                break
+            with self._lock:
+                if self._released.is_set():
+                    if not self._write(chunk):
+                        break
+                    continue
+                self._buffer.append(chunk)
+                self._buffered += len(chunk)
+                # Drop whole chunks so the byte stream stays sample-aligned.
+                while live and self._buffered - len(self._buffer[0]) >= self.prebuffer_bytes:
+                    self._buffered -= len(self._buffer.popleft())
+                full = not live and self._buffered >= self.prebuffer_bytes
+            if full:
+                self._released.wait()
+        if self._released.is_set():
+            try:
+                self.sink.stdin.close()
+            except (BrokenPipeError, ValueError, OSError):
+                pass
+
+    def _release_loop(self) -> None:
+        while not self._stopping:
+            remaining = self.release_at - time.time()
+            if remaining <= 0:
+                break
+            # Coarse sleep, then spin for the last couple of milliseconds.
+            time.sleep(remaining - 0.002 if remaining > 0.004 else 0)
+        if self._stopping:
+            return
+        with self._lock:
+            self.released_at = time.time()
+            self.prebuffered_bytes = self._buffered
+            while self._buffer:
+                if not self._write(self._buffer.popleft()):
+                    break
+            self._buffered = 0
+            self._released.set()
+        log_event(
+            f"synchronized start released (offset {(self.released_at - self.release_at) * 1000:.1f} ms, "
+            f"prebuffer {self.prebuffered_bytes / SYNC_BYTES_PER_SECOND:.2f}s)"
+        )
+
+    def report(self) -> dict:
+        first = self.first_audio_at
+        if self.released_at is None:
+            status = "waiting"
+        elif first is None:
+            status = "no_audio"
+        else:
+            status = "started"
+        return {
+            "status": status,
+            "source": self.source,
+            "start_at": self.start_at,
+            "prepared_at": self.prepared_at,
+            "released_at": self.released_at,
+            "first_audio_at": first,
+            # Signed error of the first sample handed to ALSA vs. the target.
+            "offset_ms": None if first is None else round((first - self.release_at) * 1000, 3),
+            "prebuffered_ms": round(self.prebuffered_bytes * 1000 / SYNC_BYTES_PER_SECOND, 1),
+            "output_latency_ms": SYNC_OUTPUT_LATENCY_MS,
+        }
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None:
+            for proc in (self.decoder, self.sink):
+                rc = proc.poll()
+                if rc is not None:
+                    self.returncode = rc
+                    break
+        return self.returncode
+
+    def terminate(self) -> None:
+        self._stopping = True
+        self._released.set()
+        for proc in (self.decoder, self.sink):
+            if proc.poll() is None:
+                proc.terminate()
+
+    def kill(self) -> None:
+        for proc in (self.decoder, self.sink):
+            if proc.poll() is None:
+                proc.kill()
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        deadline = None if timeout is None else time.time() + timeout
+        for proc in (self.decoder, self.sink):
+            proc.wait(timeout=None if deadline is None else max(deadline - time.time(), 0))
+        return self.poll()
+
+
+def sync_target(cfg: dict) -> Optional[float]:
+    """Return the requested synchronized start time, if still relevant."""
+    try:
+        start_at = float(cfg.get("start_at") or 0)
+    except (TypeError, ValueError):
+        return None
+    if start_at <= 0 or start_at < time.time() - SYNC_STALE_SECONDS:
+        return None
+    return start_at
+
+
 def ffprobe_ok(url: str) -> bool:
     try:
         result = subprocess.run(
@@ -134,7 +461,7 @@ def ffprobe_ok(url: str) -> bool:
                 "-v",
                 "error",
                 "-timeout",
-                "2000000",
+                str(int(PROBE_TIMEOUT_SECONDS * 1_000_000)),
                 "-i",
                 url,
                 "-of",
@@ -143,7 +470,7 @@ def ffprobe_ok(url: str) -> bool:
             ],
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
-            timeout=4,
+            timeout=PROBE_TIMEOUT_SECONDS * 2,
             check=False,
         )
     except Exception:
@@ -151,7 +478,16 @@ def ffprobe_ok(url: str) -> bool:
     return result.returncode == 0
 
 
-def update_state(now_playing: str, fallback_exists: bool, stream_up: bool, last_switch: float, last_error: str) -> None:
+def update_state(
+    now_playing: str,
+    fallback_exists: bool,
+    stream_up: bool,
+    last_switch: float,
+    last_error: str,
+    sync: Optional[dict] = None,
+    buffer: Optional[dict] = None,
+    levels: Optional[dict] = None,
+) -> None:
     payload = {
         "now_playing": now_playing,
         "fallback_active": now_playing == "file",
@@ -160,6 +496,12 @@ def update_state(now_playing: str, fallback_exists: bool, stream_up: bool, last_
         "last_switch_timestamp": float(last_switch),
         "last_error": last_error or "",
     }
+    if sync is not None:
+        payload["sync"] = sync
+    if buffer is not None:
+        payload["buffer"] = buffer
+    if levels is not None:
+        payload["levels"] = levels
     save_state(payload)
 
 
@@ -170,16 +512,21 @@ def player_loop() -> None:
     cfg = load_config()
     save_config(cfg)
     state = load_state()
-    last_switch = float(state.get("last_switch_timestamp") or time.time())
+    last_switch = float(state.get("last_switch_timestamp") or clock.time())
     last_error = state.get("last_error", "")
+    last_sync = state.get("sync")
     proc: Optional[subprocess.Popen] = None
     current = "stop"
+    # Set when the level tap reports dead air or clipping: auto mode then
+    # stays on the fallback until this time before trying the stream again.
+    dead_air_until = 0.0
+    dead_air_reason = ""
     try:
         last_mtime = os.path.getmtime(CFG_PATH)
     except Exception:
         last_mtime = time.time()
 
-    update_state(current, os.path.exists(FALLBACK_PATH), False, last_switch, last_error)
+    update_state(current, os.path.exists(FALLBACK_PATH), False, last_switch, last_error, sync=last_sync)
 
     while True:
         cfg = load_config()
@@ -206,9 +553,21 @@ def player_loop() -> None:
             proc = terminate_process(proc)
             current = "stop"
             last_mtime = mtime
-            last_switch = time.time()
+            last_switch = clock.time()
+            dead_air_until = 0.0
 
         stream_up = False
+        # While the read-ahead buffer still holds audio, a failing probe is
+        # just the blip the buffer exists to ride through.
+        riding_buffer = current == "stream" and callable(getattr(proc, "buffered", None)) and proc.buffered()
+
+        meter = getattr(proc, "levels", None) if current == "stream" else None
+        level_fault = meter.fault() if meter is not None and auto_mode else None
+        if level_fault:
+            log_event(f"stream {level_fault}; switching to fallback for {LEVEL_RETRY_SECONDS:.0f}s")
+            dead_air_reason = level_fault
+            dead_air_until = clock.time() + LEVEL_RETRY_SECONDS
+        dead_air = auto_mode and clock.time() < dead_air_until
 
         if desired == "stop":
             if current != "stop":
@@ -217,23 +576,34 @@ def player_loop() -> None:
             current = "stop"
             stream_up = False
             last_error = ""
-        elif desired == "file" or (auto_mode and (not url or not ffprobe_ok(str(url)))):
+        elif (
+            desired == "file"
+            or dead_air
+            or (auto_mode and not riding_buffer and (not url or not ffprobe_ok(str(url))))
+        ):
             if not fallback_exists:
                 if current != "stop":
                     proc = terminate_process(proc)
                     current = "stop"
-                    last_switch = time.time()
+                    last_switch = clock.time()
                 last_error = "fallback file missing"
-                update_state(current, fallback_exists, False, last_switch, last_error)
-                time.sleep(2)
+                update_state(current, fallback_exists, False, last_switch, last_error, sync=last_sync)
+                clock.sleep(2)
                 continue
             if current != "file":
                 proc = terminate_process(proc)
-                log_event("switching to fallback file playback")
-                proc = play_fallback(FALLBACK_PATH, vol)
+                start_at = sync_target(cfg)
+                if start_at is not None:
+                    log_event(f"preparing synchronized fallback file playback at {start_at:.3f}")
+                    proc = SyncedPlayback("file", FALLBACK_PATH, vol, start_at)
+                else:
+                    log_event("switching to fallback file playback")
+                    proc = play_fallback(FALLBACK_PATH, vol)
                 current = "file"
-                last_switch = time.time()
-            if desired != "file" and auto_mode:
+                last_switch = clock.time()
+            if desired != "file" and dead_air:
+                last_error = f"stream {dead_air_reason}, playing fallback"
+            elif desired != "file" and auto_mode:
                 last_error = "stream unavailable, playing fallback"
             else:
                 last_error = ""
@@ -241,16 +611,34 @@ def player_loop() -> None:
         else:
             if current != "stream":
                 proc = terminate_process(proc)
-                log_event(f"starting stream playback: {url}")
-                proc = play_stream(str(url), vol)
+                start_at = sync_target(cfg)
+                if start_at is not None:
+                    log_event(f"preparing synchronized stream playback at {start_at:.3f}: {url}")
+                    proc = SyncedPlayback("stream", str(url), vol, start_at)
+                else:
+                    log_event(f"starting stream playback: {url}")
+                    proc = start_stream(str(url), vol)
                 current = "stream"
-                last_switch = time.time()
+                last_switch = clock.time()
             stream_up = proc is not None and proc.poll() is None
             last_error = ""
 
-        update_state(current, fallback_exists, stream_up, last_switch, last_error)
+        if isinstance(proc, SyncedPlayback):
+            last_sync = proc.report()
+        buffer = proc.report() if isinstance(proc, BufferedStream) else None
+        meter = getattr(proc, "levels", None)
+        update_state(
+            current,
+            fallback_exists,
+            stream_up,
+            last_switch,
+            last_error,
+            sync=last_sync,
+            buffer=buffer,
+            levels=meter.report() if meter is not None else None,
+        )
 
-        time.sleep(HEARTBEAT_INTERVAL)
+        clock.sleep(HEARTBEAT_INTERVAL)
 
         if proc is not None and proc.poll() is not None:
             rc = proc.returncode
@@ -259,8 +647,8 @@ def player_loop() -> None:
             proc = None
             if current != "stop":
                 current = "stop"
-                last_switch = time.time()
-            update_state(current, os.path.exists(FALLBACK_PATH), False, last_switch, last_error)
+                last_switch = clock.time()
+            update_state(current, os.path.exists(FALLBACK_PATH), False, last_switch, last_error, sync=last_sync)
 
 
 def handle_signal(signum: int, _frame) -> None:
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import deque
+from typing import Callable, Optional
+
+BUFFER_SECONDS = float(os.environ.get("PLAYER_BUFFER_SECONDS", "8"))
+PREFILL_SECONDS = float(os.environ.get("PLAYER_BUFFER_PREFILL_SECONDS", "2"))
+MEMORY_KB = int(os.environ.get("PLAYER_BUFFER_MEMORY_KB", "1024"))
+# Directory for overflow beyond the memory ring; empty keeps everything in RAM.
+SPILL_DIR = os.environ.get("PLAYER_BUFFER_SPILL_DIR", "")
+# Assumed stream bitrate until the server (icy-br) or playback tells us better.
+DEFAULT_BITRATE_KBPS = float(os.environ.get("PLAYER_BUFFER_BITRATE_KBPS", "128"))
+READ_TIMEOUT = float(os.environ.get("PLAYER_BUFFER_READ_TIMEOUT", "5"))
+CHUNK_BYTES = 8192
+RATE_WINDOW_SECONDS = 5.0
+
+
+class ReadAheadBuffer:
+    """Bounded FIFO of stream bytes: a memory ring that spills to a disk spool.
+
+    Data only goes to disk once ``memory_limit`` is reached, and later writes
+    keep going to disk until it is drained, so byte order is preserved. Reads
+    refill memory from the spool first. ``put`` blocks while ``limit`` bytes
+    are queued; ``get`` blocks while the buffer is empty.
+    """
+
+    def __init__(self, limit: int, memory_limit: int, spill_dir: str = ""):
+        self.limit = max(limit, CHUNK_BYTES)
+        self.memory_limit = max(min(memory_limit, self.limit), CHUNK_BYTES)
+        self.spill_dir = spill_dir
+        self._mem: deque = deque()
+        self._mem_bytes = 0
+        self._spool = None
+        self._spool_read = 0
+        self._spool_write = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def size(self) -> int:
+        return self._mem_bytes + self._spool_write - self._spool_read
+
+    @property
+    def spilled(self) -> int:
+        return self._spool_write - self._spool_read
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
+            self._cond.notify_all()
+
+    def clear(self) -> None:
+        with self._cond:
+            self._mem.clear()
+            self._mem_bytes = 0
+            self._reset_spool()
+            self._cond.notify_all()
+
+    def put(self, data: bytes) -> bool:
+        """Queue ``data``; returns False once the buffer is closed."""
+        with self._cond:
+            while not self._closed and self.size + len(data) > self.limit and self.size > 0:
+                self._cond.wait(0.5)
+            if self._closed:
+                return False
+            if self.spilled == 0 and self._mem_bytes + len(data) <= self.memory_limit:
+                self._mem.append(data)
+                self._mem_bytes += len(data)
+            elif self.spill_dir:
+                self._spool_append(data)
+            else:
+                # Memory-only: the ring is the limit.
+                while not self._closed and self._mem_bytes + len(data) > self.memory_limit and self._mem:
+                    self._cond.wait(0.5)
+                if self._closed:
+                    return False
+                self._mem.append(data)
+                self._mem_bytes += len(data)
+            self._cond.notify_all()
+            return True
+
+    def get(self, size: int, timeout: Optional[float] = None) -> Optional[bytes]:
+        """Return up to ``size`` bytes, ``b""`` on timeout, None once closed."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._closed and self.size == 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return b""
+                self._cond.wait(remaining)
+            if self._closed:
+                return None
+            if not self._mem:
+                self._refill_from_spool()
+            chunk = self._mem.popleft()
+            if len(chunk) > size:
+                self._mem.appendleft(chunk[size:])
+                chunk = chunk[:size]
+            self._mem_bytes -= len(chunk)
+            self._cond.notify_all()
+            return chunk
+
+    def wait_for(self, size: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._closed and self.size < size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return not self._closed
+
+    def _spool_append(self, data: bytes) -> None:
+        if self._spool is None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._spool = tempfile.TemporaryFile(dir=self.spill_dir)
+        self._spool.seek(self._spool_write)
+        self._spool.write(data)
+        self._spool_write += len(data)
+
+    def _refill_from_spool(self) -> None:
+        if self._spool is None or self.spilled == 0:
+            return
+        self._spool.seek(self._spool_read)
+        data = self._spool.read(min(self.memory_limit, self.spilled))
+        self._spool_read += len(data)
+        for start in range(0, len(data), CHUNK_BYTES):
+            self._mem.append(data[start:start + CHUNK_BYTES])
+        self._mem_bytes += len(data)
+        if self.spilled == 0:
+            self._reset_spool()
+
+    def _reset_spool(self) -> None:
+        if self._spool is not None:
+            self._spool.seek(0)
+            self._spool.truncate()
+        self._spool_read = 0
+        self._spool_write = 0
+
+
+class StreamFetcher:
+    """Keeps a ``ReadAheadBuffer`` filled from an HTTP stream, reconnecting itself.
+
+    Buffer depth in seconds is derived from the stream byte rate: the
+    ``icy-br`` header when the server sends one, otherwise
+    ``PLAYER_BUFFER_BITRATE_KBPS``, refined by the rate the decoder actually
+    consumes once playback is steady.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        max_seconds: float = BUFFER_SECONDS,
+        memory_kb: int = MEMORY_KB,
+        spill_dir: str = SPILL_DIR,
+        log: Optional[Callable[[str], None]] = None,
+    ):
+        self.url = url
+        self.byte_rate = DEFAULT_BITRATE_KBPS * 1000 / 8
+        self.max_seconds = max_seconds
+        self.buffer = ReadAheadBuffer(int(max_seconds * self.byte_rate), memory_kb * 1024, spill_dir)
+        self.connected = False
+        self.reconnects = 0
+        self.underruns = 0
+        self.bytes_fetched = 0
+        self.last_error = ""
+        self._log = log or (lambda _msg: None)
+        self._stopping = False
+        self._consumed = 0
+        self._rate_started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="stream-fetcher", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping = True
+        self.buffer.close()
+
+    def seconds(self) -> float:
+        return self.buffer.size / self.byte_rate if self.byte_rate > 0 else 0.0
+
+    def read(self, size: int = CHUNK_BYTES) -> Optional[bytes]:
+        """Next bytes for the decoder; waits for a refill after an underrun."""
+        chunk = self.buffer.get(size, timeout=0.2)
+        if chunk == b"":
+            self.underruns += 1
+            self._log(f"read-ahead buffer empty; waiting for {PREFILL_SECONDS:.1f}s refill")
+            self.buffer.wait_for(int(PREFILL_SECONDS * self.byte_rate), timeout=max(self.max_seconds, 1.0) * 4)
+            self._rate_started = time.monotonic()
+            self._consumed = 0
+            chunk = self.buffer.get(size, timeout=0.2)
+            if chunk == b"":
+                return b""
+        if chunk:
+            self._track_rate(len(chunk))
+        return chunk
+
+    def wait_prefill(self, timeout: float) -> bool:
+        return self.buffer.wait_for(int(min(PREFILL_SECONDS, self.max_seconds) * self.byte_rate), timeout)
+
+    def report(self) -> dict:
+        return {
+            "seconds": round(self.seconds(), 3),
+            "bytes": self.buffer.size,
+            "spilled_bytes": self.buffer.spilled,
+            "max_seconds": self.max_seconds,
+            "byte_rate": round(self.byte_rate, 1),
+            "connected": self.connected,
+            "reconnects": self.reconnects,
+            "underruns": self.underruns,
+            "last_error": self.last_error,
+        }
+
+    def _track_rate(self, size: int) -> None:
+        # The decoder is paced by ALSA, so its steady intake is the stream rate.
+        self._consumed += size
+        elapsed = time.monotonic() - self._rate_started
+        if elapsed >= RATE_WINDOW_SECONDS:
+            measured = self._consumed / elapsed
+            self.byte_rate = 0.8 * self.byte_rate + 0.2 * measured
+            self.buffer.limit = max(int(self.max_seconds * self.byte_rate), CHUNK_BYTES)
+            self._consumed = 0
+            self._rate_started = time.monotonic()
+
+    def _run(self) -> None:
+        backoff = 0.5
+        while not self._stopping:
+            try:
+                request = urllib.request.Request(self.url, headers={"Icy-MetaData": "0", "User-Agent": "fleet-audio-player"})
+                with urllib.request.urlopen(request, timeout=READ_TIMEOUT) as response:
+                    bitrate = response.headers.get("icy-br", "").split(",")[0].strip()
+                    if bitrate.isdigit() and int(bitrate) > 0:
+                        self.byte_rate = int(bitrate) * 1000 / 8
+                        self.buffer.limit = max(int(self.max_seconds * self.byte_rate), CHUNK_BYTES)
+                    self.connected = True
+                    self.last_error = ""
+                    backoff = 0.5
+                    while not self._stopping:
+                        data = response.read1(CHUNK_BYTES) if hasattr(response, "read1") else response.read(CHUNK_BYTES)
+                        if not data:
+                            raise EOFError("stream ended")
+                        self.bytes_fetched += len(data)
+                        if not self.buffer.put(data):
+                            return
+            except Exception as exc:  # network errors of every flavour end up here
+                if self._stopping:
+                    return
+                self.connected = False
+                self.reconnects += 1
+                self.last_error = str(exc) or exc.__class__.__name__
+                self._log(
+                    f"stream fetch failed ({self.last_error}); {self.seconds():.1f}s buffered, "
+                    f"reconnecting in {backoff:.1f}s"
+                )
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+        self.connected = False
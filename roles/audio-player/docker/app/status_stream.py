@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+MAX_SUBSCRIBERS = int(os.environ.get("STATUS_STREAM_MAX_SUBSCRIBERS", "16"))
+HEARTBEAT_SECONDS = float(os.environ.get("STATUS_STREAM_HEARTBEAT_SECONDS", "15"))
+# How often the shared JSON files are stat()ed for writes from other processes.
+POLL_SECONDS = float(os.environ.get("STATUS_STREAM_POLL_SECONDS", "0.2"))
+QUEUE_DEPTH = 64
+RETRY_MS = 2000
+
+
+def diff(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Top-level delta from ``old`` to ``new``; nested objects are replaced whole."""
+    changed = {key: value for key, value in new.items() if key not in old or old[key] != value}
+    removed = sorted(key for key in old if key not in new)
+    delta: Dict[str, Any] = {}
+    if changed:
+        delta["set"] = changed
+    if removed:
+        delta["unset"] = removed
+    return delta
+
+
+def _event(name: str, seq: int, payload: Any) -> str:
+    return f"event: {name}\nid: {seq}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+
+class _Subscriber:
+    def __init__(self) -> None:
+        self.queue: "queue.Queue[str]" = queue.Queue(maxsize=QUEUE_DEPTH)
+
+
+class StatusStream:
+    """Pushes ``/status`` changes to server-sent-event subscribers.
+
+    ``snapshot`` builds the same document ``GET /status`` returns. It is
+    re-evaluated when ``notify`` is called (writes made by this process) or
+    when one of ``paths`` changes on disk (writes from ``player.py``), and
+    only while someone is subscribed. Each subscriber gets the full snapshot
+    first and then ``delta`` events holding just the changed keys; a
+    subscriber that falls ``QUEUE_DEPTH`` events behind is resynchronised
+    with a fresh snapshot instead of an unbounded backlog.
+    """
+
+    def __init__(
+        self,
+        snapshot: Callable[[], Dict[str, Any]],
+        paths: Tuple[str, ...] = (),
+        max_subscribers: int = MAX_SUBSCRIBERS,
+        heartbeat: float = HEARTBEAT_SECONDS,
+        poll_interval: float = POLL_SECONDS,
+        log: Optional[Callable[[str], None]] = None,
+    ):
+        self._snapshot = snapshot
+        self._paths = paths
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        self.poll_interval = poll_interval
+        self.events_sent = 0
+        self.rejected = 0
+        self._log = log or (lambda _msg: None)
+        self._lock = threading.Lock()
+        self._subscribers: List[_Subscriber] = []
+        self._current: Optional[Dict[str, Any]] = None
+        self._seq = 0
+        self._watcher: Optional[threading.Thread] = None
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def notify(self) -> None:
+        """Recompute the snapshot and push a delta if anything changed."""
+        if not self._subscribers:
+            return
+        try:
+            snapshot = self._snapshot()
+        except Exception as exc:  # a half-written file must not kill the watcher
+            self._log(f"status stream snapshot failed: {exc}")
+            return
+        with self._lock:
+            if self._current is None:
+                self._current = snapshot
+                return
+            delta = diff(self._current, snapshot)
+            if not delta:
+                return
+            self._current = snapshot
+            self._seq += 1
+            message = _event("delta", self._seq, delta)
+            resync = _event("snapshot", self._seq, snapshot)
+            for sub in self._subscribers:
+                self._offer(sub, message, resync)
+
+    def subscribe(self) -> Optional[_Subscriber]:
+        """Register a subscriber, or return None when the cap is reached."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            sub = _Subscriber()
+            self._subscribers.append(sub)
+            start_watcher = self._watcher is None and bool(self._paths)
+            if start_watcher:
+                self._watcher = threading.Thread(target=self._watch, name="status-stream-watch", daemon=True)
+        if start_watcher:
+            self._watcher.start()
+        return sub
+
+    def unsubscribe(self, sub: _Subscriber) -> None:
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+            if not self._subscribers:
+                # Nobody is watching; the next subscriber starts from a fresh snapshot.
+                self._current = None
+
+    def events(self, sub: _Subscriber) -> Iterator[str]:
+        """SSE body for ``sub``: retry hint, snapshot, then deltas and heartbeats."""
+        try:
+            snapshot = self._snapshot()
+            with self._lock:
+                if self._current is None:
+                    self._current = snapshot
+                seq = self._seq
+            yield f"retry: {RETRY_MS}\n\n"
+            yield _event("snapshot", seq, snapshot)
+            self.events_sent += 1
+            while True:
+                try:
+                    message = sub.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield f": keepalive {int(time.time())}\n\n"
+                    continue
+                yield message
+                self.events_sent += 1
+        finally:
+            self.unsubscribe(sub)
+
+    def _offer(self, sub: _Subscriber, message: str, resync: str) -> None:
+        try:
+            sub.queue.put_nowait(message)
+        except queue.Full:
+            while True:
+                try:
+                    sub.queue.get_nowait()
+                except queue.Empty:
+                    break
+            sub.queue.put_nowait(resync)
+
+    def _stamp(self) -> Tuple[Any, ...]:
+        stamp = []
+        for path in self._paths:
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _watch(self) -> None:
+        last = self._stamp()
+        while True:
+            time.sleep(self.poll_interval)
+            if not self._subscribers:
+                continue
+            stamp = self._stamp()
+            if stamp != last:
+                last = stamp
+                self.notify()
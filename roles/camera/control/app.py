@@ -1,12 +1,12 @@
+import asyncio
 import os
 import time
-import socket
+from contextlib import asynccontextmanager
 from typing import Optional
-from urllib.parse import urlparse
 
 import httpx
-from fastapi import FastAPI, Header, HTTPException
-from fastapi.responses import PlainTextResponse
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import FileResponse, PlainTextResponse, Response
 from prometheus_client import (
     CollectorRegistry,
     Gauge,
@@ -14,50 +14,131 @@ from prometheus_client import (
     generate_latest,
 )
 
+from cameras import Camera, load_cameras
+from dvr import ClipError, DvrRecorder
+from hls_cache import HlsCache, HlsError
+from motion import MotionMonitor
+from rtsp_probe import probe_stream
+from snapshot import SnapshotSource
+
 
 CAMERA_CONTROL_TOKEN = os.environ.get("CAMERA_CONTROL_TOKEN", "")
-CAMERA_HLS_URL = os.environ.get(
-    "CAMERA_HLS_URL", "http://127.0.0.1:8888/camera/index.m3u8"
-)
-CAMERA_RTSP_URL = os.environ.get(
-    "CAMERA_RTSP_URL", "rtsp://127.0.0.1:8554/camera"
-)
 PROBE_TIMEOUT = float(os.environ.get("CAMERA_PROBE_TIMEOUT", "2.5"))
 PROBE_CACHE_SECONDS = float(os.environ.get("CAMERA_PROBE_CACHE_SECONDS", "10"))
+# Seconds of RTP to pull per probe to measure fps/bitrate (0 disables).
+RTSP_SAMPLE_SECONDS = float(os.environ.get("CAMERA_RTSP_SAMPLE_SECONDS", "0"))
+# Probes running at once across all cameras; each RTP sample holds an RTSP session.
+PROBE_CONCURRENCY = max(int(os.environ.get("CAMERA_PROBE_CONCURRENCY", "4")), 1)
+
+cameras = {camera.id: camera for camera in load_cameras()}
+# Snapshots, motion, DVR and the HLS cache decode or proxy this camera only.
+primary = next(iter(cameras.values()))
+
+_http_client: Optional[httpx.AsyncClient] = None
+_probe_slots = asyncio.Semaphore(PROBE_CONCURRENCY)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global _http_client
+    _http_client = httpx.AsyncClient(
+        timeout=PROBE_TIMEOUT,
+        headers={"User-Agent": "camera-control/1.0"},
+    )
+    await snapshots.start()
+    await motion.start()
+    await dvr.start()
+    await hls.start()
+    try:
+        yield
+    finally:
+        await hls.stop()
+        await dvr.stop()
+        await motion.stop()
+        await snapshots.stop()
+        await _http_client.aclose()
+        _http_client = None
 
-_rtsp = urlparse(CAMERA_RTSP_URL)
-RTSP_HOST = _rtsp.hostname or "127.0.0.1"
-RTSP_PORT = _rtsp.port or 8554
 
-app = FastAPI(title="Camera Control")
+app = FastAPI(title="Camera Control", lifespan=lifespan)
 
 registry = CollectorRegistry()
 g_stream_up = Gauge(
-    "camera_stream_online", "Camera HLS stream availability (1=up)", registry=registry
+    "camera_stream_online",
+    "Camera HLS stream availability (1=up)",
+    ["camera"],
+    registry=registry,
 )
 g_probe_duration = Gauge(
     "camera_probe_duration_seconds",
     "Seconds taken to probe the camera stream",
+    ["camera"],
     registry=registry,
 )
 g_last_probe = Gauge(
     "camera_last_probe_timestamp_seconds",
     "Unix timestamp of last probe",
+    ["camera"],
     registry=registry,
 )
 g_last_success = Gauge(
     "camera_last_success_timestamp_seconds",
     "Unix timestamp of last successful probe",
+    ["camera"],
     registry=registry,
 )
 g_rtsp_reachable = Gauge(
     "camera_rtsp_reachable",
-    "RTSP TCP port reachable (1=yes)",
+    "RTSP server answered OPTIONS (1=yes)",
+    ["camera"],
+    registry=registry,
+)
+g_rtsp_stream_ready = Gauge(
+    "camera_rtsp_stream_ready",
+    "RTSP DESCRIBE returned an SDP with a video track, i.e. a publisher is live (1=yes)",
+    ["camera"],
+    registry=registry,
+)
+g_rtsp_latency = Gauge(
+    "camera_rtsp_response_seconds",
+    "RTSP request round-trip time",
+    ["camera", "method"],
+    registry=registry,
+)
+g_rtp_fps = Gauge(
+    "camera_rtp_fps",
+    "Frame rate measured from sampled RTP timestamps",
+    ["camera"],
+    registry=registry,
+)
+g_rtp_bitrate = Gauge(
+    "camera_rtp_bitrate_bps",
+    "Video payload bitrate measured from sampled RTP packets",
+    ["camera"],
+    registry=registry,
+)
+g_rtp_fps_ratio = Gauge(
+    "camera_rtp_fps_ratio",
+    "Measured fps divided by the camera's expected framerate",
+    ["camera"],
+    registry=registry,
+)
+g_rtp_bitrate_ratio = Gauge(
+    "camera_rtp_bitrate_ratio",
+    "Measured bitrate divided by the camera's expected bitrate",
+    ["camera"],
+    registry=registry,
+)
+g_probe_slots = Gauge(
+    "camera_probes_in_flight",
+    "Camera probes currently running (limited by CAMERA_PROBE_CONCURRENCY)",
     registry=registry,
 )
 
-_last_probe_cache: Optional[dict[str, object]] = None
-_last_success_ts = 0.0
+snapshots = SnapshotSource(primary.rtsp_url, registry)
+motion = MotionMonitor(primary.rtsp_url, registry)
+dvr = DvrRecorder(primary.rtsp_url, registry)
+hls = HlsCache(primary.hls_url, registry)
 
 
 def check_auth(header: Optional[str]):
@@ -70,65 +151,88 @@ def check_auth(header: Optional[str]):
         raise HTTPException(status_code=401, detail="unauthorized")
 
 
-def probe_rtsp() -> bool:
+def get_camera(camera_id: str) -> Camera:
+    camera = cameras.get(camera_id)
+    if camera is None:
+        raise HTTPException(status_code=404, detail="unknown_camera")
+    return camera
+
+
+async def probe_rtsp(camera: Camera) -> dict:
+    result = await probe_stream(camera.rtsp_url, PROBE_TIMEOUT, RTSP_SAMPLE_SECONDS)
+    g_rtsp_reachable.labels(camera=camera.id).set(1.0 if result.reachable else 0.0)
+    g_rtsp_stream_ready.labels(camera=camera.id).set(1.0 if result.stream_ready else 0.0)
+    if result.options_latency is not None:
+        g_rtsp_latency.labels(camera=camera.id, method="OPTIONS").set(result.options_latency)
+    if result.describe_latency is not None:
+        g_rtsp_latency.labels(camera=camera.id, method="DESCRIBE").set(result.describe_latency)
+    if RTSP_SAMPLE_SECONDS > 0:
+        fps = result.fps or 0.0
+        bitrate = result.bitrate or 0.0
+        g_rtp_fps.labels(camera=camera.id).set(fps)
+        g_rtp_bitrate.labels(camera=camera.id).set(bitrate)
+        if camera.framerate > 0:
+            g_rtp_fps_ratio.labels(camera=camera.id).set(fps / camera.framerate)
+        if camera.bitrate > 0:
+            g_rtp_bitrate_ratio.labels(camera=camera.id).set(bitrate / camera.bitrate)
+    return result.as_dict()
+
+
+async def probe_hls(camera: Camera) -> tuple[bool, list[str], Optional[str], float]:
+    started = time.monotonic()
     try:
-        with socket.create_connection((RTSP_HOST, RTSP_PORT), timeout=1.5):
-            return True
-    except OSError:
-        return False
-
+        if _http_client is not None:
+            resp = await _http_client.get(camera.hls_url)
+        else:
+            async with httpx.AsyncClient(timeout=PROBE_TIMEOUT) as client:
+                resp = await client.get(
+                    camera.hls_url,
+                    headers={"User-Agent": "camera-control/1.0"},
+                )
+        resp.raise_for_status()
+        return True, resp.text.splitlines()[:5], None, time.monotonic() - started
+    except Exception as exc:
+        return False, [], str(exc), time.monotonic() - started
 
-async def perform_probe() -> dict:
-    global _last_success_ts
 
-    started = time.monotonic()
+async def perform_probe(camera: Camera) -> dict:
     ts = time.time()
-    ok = False
-    preview: list[str] = []
-    error: Optional[str] = None
-
-    try:
-        async with httpx.AsyncClient(timeout=PROBE_TIMEOUT) as client:
-            resp = await client.get(
-                CAMERA_HLS_URL,
-                headers={"User-Agent": "camera-control/1.0"},
+    async with _probe_slots:
+        g_probe_slots.inc()
+        try:
+            (ok, preview, error, duration), rtsp = await asyncio.gather(
+                probe_hls(camera), probe_rtsp(camera)
             )
-            resp.raise_for_status()
-            text = resp.text
-            preview = text.splitlines()[:5]
-            ok = True
-    except Exception as exc:
-        error = str(exc)
-        ok = False
-
-    duration = time.monotonic() - started
-    g_probe_duration.set(duration)
-    g_last_probe.set(ts)
+        finally:
+            g_probe_slots.dec()
 
-    rtsp_ok = probe_rtsp()
-    g_rtsp_reachable.set(1.0 if rtsp_ok else 0.0)
+    g_probe_duration.labels(camera=camera.id).set(duration)
+    g_last_probe.labels(camera=camera.id).set(ts)
 
     if ok:
-        _last_success_ts = ts
-        g_stream_up.set(1.0)
+        camera.last_success_ts = ts
+        g_stream_up.labels(camera=camera.id).set(1.0)
     else:
-        g_stream_up.set(0.0)
+        g_stream_up.labels(camera=camera.id).set(0.0)
 
-    if _last_success_ts:
-        g_last_success.set(_last_success_ts)
+    if camera.last_success_ts:
+        g_last_success.labels(camera=camera.id).set(camera.last_success_ts)
 
     result = {
+        "camera": camera.id,
         "ok": ok,
         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts)),
         "duration": duration,
-        "hls_url": CAMERA_HLS_URL,
-        "rtsp_url": CAMERA_RTSP_URL,
-        "rtsp_reachable": rtsp_ok,
+        "hls_url": camera.hls_url,
+        "rtsp_url": camera.rtsp_url,
+        "rtsp_reachable": rtsp["reachable"],
+        "rtsp_stream_ready": rtsp["stream_ready"],
+        "rtsp": rtsp,
         "preview": preview,
         "error": error,
         "last_success": (
-            time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(_last_success_ts))
-            if _last_success_ts
+            time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(camera.last_success_ts))
+            if camera.last_success_ts
             else None
         ),
         "cached": False,
@@ -136,54 +240,202 @@ async def perform_probe() -> dict:
     return result
 
 
-async def probe(force: bool = False) -> dict:
-    global _last_probe_cache
-    now = time.time()
-    if not force and _last_probe_cache:
-        ts_val = _last_probe_cache.get("ts")
-        cached_result = _last_probe_cache.get("result")
-        if (
-            isinstance(ts_val, (int, float))
-            and isinstance(cached_result, dict)
-            and now - ts_val < PROBE_CACHE_SECONDS
-        ):
-            cached = cached_result.copy()
-            cached["cached"] = True
+def cached_probe(camera: Camera, max_age: float) -> Optional[dict]:
+    if camera.last_probe is not None and time.time() - camera.last_probe_ts < max_age:
+        cached = camera.last_probe.copy()
+        cached["cached"] = True
+        return cached
+    return None
+
+
+async def probe(camera: Camera, force: bool = False) -> dict:
+    if not force:
+        cached = cached_probe(camera, PROBE_CACHE_SECONDS)
+        if cached is not None:
             return cached
 
-    result = await perform_probe()
-    _last_probe_cache = {"ts": now, "result": result}
+    generation = camera.generation
+    async with camera.lock:
+        # Callers that queued behind an in-flight probe reuse its result
+        # instead of probing the camera again.
+        if camera.generation != generation:
+            cached = cached_probe(camera, PROBE_CACHE_SECONDS)
+            if cached is not None:
+                return cached
+        now = time.time()
+        result = await perform_probe(camera)
+        camera.last_probe = result
+        camera.last_probe_ts = now
+        camera.generation += 1
     return result
 
 
+async def probe_all(force: bool = False) -> list[dict]:
+    """Probe every camera concurrently, at most ``CAMERA_PROBE_CONCURRENCY`` at a time."""
+    return list(await asyncio.gather(*(probe(camera, force) for camera in cameras.values())))
+
+
 @app.get("/healthz", response_class=PlainTextResponse)
 async def healthz():
-    result = await probe(force=False)
-    if result.get("ok"):
+    results = await probe_all(force=False)
+    down = [result["camera"] for result in results if not result.get("ok")]
+    if not down:
         return "ok"
-    raise HTTPException(status_code=503, detail="stream_unavailable")
+    raise HTTPException(status_code=503, detail=f"stream_unavailable: {', '.join(down)}")
 
 
 @app.get("/metrics")
 async def metrics():
-    await probe(force=False)
+    await probe_all(force=False)
     output = generate_latest(registry)
     return PlainTextResponse(content=output, media_type=CONTENT_TYPE_LATEST)
 
 
 @app.get("/status")
 async def status():
-    result = await probe(force=False)
+    result = await probe(primary, force=False)
     return result
 
 
 @app.post("/probe")
 async def manual_probe(Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
-    result = await probe(force=True)
+    result = await probe(primary, force=True)
     return result
 
 
+@app.get("/cameras")
+async def list_cameras():
+    results = await probe_all(force=False)
+    return {
+        "primary": primary.id,
+        "cameras": [
+            {**camera.describe(), "status": result}
+            for camera, result in zip(cameras.values(), results)
+        ],
+    }
+
+
+@app.get("/cameras/{camera_id}/status")
+async def camera_status(camera_id: str):
+    return await probe(get_camera(camera_id), force=False)
+
+
+@app.post("/cameras/{camera_id}/probe")
+async def camera_probe(camera_id: str, Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    return await probe(get_camera(camera_id), force=True)
+
+
+@app.get("/snapshot.jpg")
+async def snapshot(
+    If_None_Match: Optional[str] = Header(None),
+    Authorization: Optional[str] = Header(None),
+):
+    check_auth(Authorization)
+    frame = await snapshots.get()
+    if frame is None:
+        snapshots.c_requests.labels(status="503").inc()
+        raise HTTPException(status_code=503, detail="snapshot_unavailable")
+    headers = {
+        "ETag": frame.etag,
+        "Cache-Control": "no-cache",
+        "Last-Modified": time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(frame.ts)),
+        "X-Frame-Age": f"{max(0.0, time.time() - frame.ts):.3f}",
+        "X-Frame-Stale": "1" if snapshots.is_stale(frame) else "0",
+    }
+    if If_None_Match and frame.etag in [tag.strip() for tag in If_None_Match.split(",")]:
+        snapshots.c_requests.labels(status="304").inc()
+        return Response(status_code=304, headers=headers)
+    snapshots.c_requests.labels(status="200").inc()
+    return Response(content=frame.data, media_type="image/jpeg", headers=headers)
+
+
+@app.get("/hls/{path:path}")
+async def hls_proxy(path: str, request: Request):
+    # Unauthenticated, like MediaMTX's own HLS server it fronts.
+    try:
+        entry, result = await hls.get(path, request.url.query)
+    except HlsError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    headers = hls.headers(path, result)
+    if entry.status != 200:
+        headers["Cache-Control"] = "no-store"
+    return Response(
+        content=entry.body,
+        status_code=entry.status,
+        media_type=entry.content_type,
+        headers=headers,
+    )
+
+
+@app.get("/hls")
+async def hls_status(Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    return hls.status()
+
+
+@app.get("/motion")
+async def motion_status(Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    return motion.status()
+
+
+@app.get("/motion/events")
+async def motion_events(
+    since: int = 0,
+    limit: int = 50,
+    Authorization: Optional[str] = Header(None),
+):
+    check_auth(Authorization)
+    return {"events": motion.recent_events(since=since, limit=limit), **motion.status()}
+
+
+@app.get("/clips")
+async def list_clips(Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    return {"dvr": dvr.status(), "clips": dvr.list_clips()}
+
+
+@app.post("/clips", status_code=201)
+async def create_clip(payload: dict, Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    try:
+        if payload.get("seconds") is not None:
+            end = float(payload.get("end") or time.time())
+            start = end - float(payload["seconds"])
+        else:
+            start = float(payload["start"])
+            end = float(payload["end"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="start/end or seconds required")
+    try:
+        return await dvr.export(start, end)
+    except ClipError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+
+
+@app.get("/clips/{name}")
+async def download_clip(name: str, Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    try:
+        path = dvr.clip_path(name)
+    except ClipError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    return FileResponse(path, media_type="video/mp4", filename=name)
+
+
+@app.delete("/clips/{name}")
+async def delete_clip(name: str, Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    try:
+        path = dvr.clip_path(name)
+    except ClipError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    path.unlink(missing_ok=True)
+    return {"ok": True, "deleted": name}
+
+
 @app.get("/openapi.yaml")
 def openapi_spec():
     """Serve OpenAPI specification for API documentation and testing."""
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import os
+import re
+from typing import List, Optional
+
+
+CAMERA_HLS_URL = os.environ.get(
+    "CAMERA_HLS_URL", "http://127.0.0.1:8888/camera/index.m3u8"
+)
+CAMERA_RTSP_URL = os.environ.get(
+    "CAMERA_RTSP_URL", "rtsp://127.0.0.1:8554/camera"
+)
+EXPECTED_FPS = float(os.environ.get("CAMERA_FRAMERATE", "20"))
+EXPECTED_BITRATE = float(os.environ.get("CAMERA_BITRATE", "6000000"))
+# JSON list of cameras, inline or in a file; unset means the single camera above.
+CAMERAS = os.environ.get("CAMERAS", "")
+CAMERA_CONFIG = os.environ.get("CAMERA_CONFIG", "")
+DEFAULT_ID = os.environ.get("CAMERA_ID", "camera")
+
+_ID_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+
+class Camera:
+    """One configured stream and the probe state kept for it."""
+
+    def __init__(
+        self,
+        camera_id: str,
+        hls_url: str,
+        rtsp_url: str,
+        framerate: float = EXPECTED_FPS,
+        bitrate: float = EXPECTED_BITRATE,
+    ):
+        self.id = camera_id
+        self.hls_url = hls_url
+        self.rtsp_url = rtsp_url
+        self.framerate = framerate
+        self.bitrate = bitrate
+        self.last_probe: Optional[dict] = None
+        self.last_probe_ts = 0.0
+        self.last_success_ts = 0.0
+        self.generation = 0
+        self.lock = asyncio.Lock()
+
+    def describe(self) -> dict:
+        return {
+            "id": self.id,
+            "hls_url": self.hls_url,
+            "rtsp_url": self.rtsp_url,
+            "framerate": self.framerate,
+            "bitrate": self.bitrate,
+        }
+
+
+def _from_entry(entry: object) -> Camera:
+    if not isinstance(entry, dict):
+        raise ValueError("camera entries must be objects")
+    camera_id = str(entry.get("id", ""))
+    if not _ID_RE.match(camera_id):
+        raise ValueError(f"invalid camera id {camera_id!r} (lowercase letters, digits, - and _)")
+    hls_url = entry.get("hls_url")
+    rtsp_url = entry.get("rtsp_url")
+    if not hls_url or not rtsp_url:
+        raise ValueError(f"camera {camera_id}: hls_url and rtsp_url are required")
+    return Camera(
+        camera_id,
+        str(hls_url),
+        str(rtsp_url),
+        float(entry.get("framerate", EXPECTED_FPS)),
+        float(entry.get("bitrate", EXPECTED_BITRATE)),
+    )
+
+
+def load_cameras(raw: str = CAMERAS, path: str = CAMERA_CONFIG) -> List[Camera]:
+    """Build the camera registry from ``CAMERAS`` / ``CAMERA_CONFIG``.
+
+    Either holds a JSON list (or ``{"cameras": [...]}``) of objects with
+    ``id``, ``hls_url``, ``rtsp_url`` and optional ``framerate``/``bitrate``.
+    Without either, the registry is the single camera described by
+    ``CAMERA_HLS_URL``/``CAMERA_RTSP_URL``. The first camera is the primary
+    one, which the snapshot, motion, DVR and HLS cache services follow.
+    """
+    if path:
+        with open(path, encoding="utf-8") as handle:
+            raw = handle.read()
+    if not raw.strip():
+        return [Camera(DEFAULT_ID, CAMERA_HLS_URL, CAMERA_RTSP_URL)]
+    data = json.loads(raw)
+    if isinstance(data, dict):
+        data = data.get("cameras")
+    if not isinstance(data, list) or not data:
+        raise ValueError("camera config must be a non-empty list")
+    cameras = [_from_entry(entry) for entry in data]
+    ids = [camera.id for camera in cameras]
+    if len(set(ids)) != len(ids):
+        raise ValueError("camera ids must be unique")
+    return cameras
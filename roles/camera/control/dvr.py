@@ -0,0 +1,428 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+
+logger = logging.getLogger("camera.dvr")
+
+DVR_ENABLED = os.environ.get("CAMERA_DVR_ENABLED", "0") == "1"
+DVR_DIR = Path(os.environ.get("CAMERA_DVR_DIR", "/data/dvr"))
+DVR_SEGMENT_SECONDS = int(os.environ.get("CAMERA_DVR_SEGMENT_SECONDS", "10"))
+DVR_RETENTION_SECONDS = int(os.environ.get("CAMERA_DVR_RETENTION_SECONDS", "3600"))
+DVR_MAX_BYTES = int(float(os.environ.get("CAMERA_DVR_MAX_MB", "2048")) * 1024 * 1024)
+DVR_CLIP_MAX_SECONDS = float(os.environ.get("CAMERA_DVR_CLIP_MAX_SECONDS", "600"))
+DVR_CLIP_KEEP = int(os.environ.get("CAMERA_DVR_CLIP_KEEP", "20"))
+DVR_EXPORT_TIMEOUT = float(os.environ.get("CAMERA_DVR_EXPORT_TIMEOUT", "120"))
+
+# Segment files are written into a fixed ring of slots; a slot is reused once
+# the recorder wraps around, so the directory never grows past this count.
+DVR_SLOTS = max(2, math.ceil(DVR_RETENTION_SECONDS / max(DVR_SEGMENT_SECONDS, 1)) + 2)
+
+_CLIP_NAME_RE = re.compile(r"^clip-[0-9]{8}-[0-9]{6}-[0-9]+s\.mp4$")
+
+
+class ClipError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class Segment:
+    slot: int
+    name: str
+    start: float
+    end: float
+    size: int
+    # Recorded so an export can tell a slot the recorder has since rewritten.
+    mtime: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class DvrRecorder:
+    """Remuxes the RTSP stream into a ring of MPEG-TS segments on disk.
+
+    ffmpeg copies the video packets (no decode) with the segment muxer and
+    reports each finished segment on stdout; the recorder keeps an index of
+    wall-clock ranges, evicts by age and total size, and cuts clips by
+    concatenating whole segments into an MP4, again without transcoding.
+    """
+
+    def __init__(self, rtsp_url: str, registry: CollectorRegistry):
+        self.rtsp_url = os.environ.get("CAMERA_DVR_RTSP_URL") or rtsp_url
+        self.enabled = DVR_ENABLED
+        self.segment_dir = DVR_DIR / "segments"
+        self.clip_dir = DVR_DIR / "clips"
+        self.index_path = DVR_DIR / "index.json"
+        self.segments: List[Segment] = []
+        self.error: Optional[str] = None
+        self._next_slot = 0
+        self._task: Optional[asyncio.Task] = None
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._export_lock = asyncio.Lock()
+
+        self.g_recording = Gauge(
+            "camera_dvr_recording", "DVR recorder process running (1=yes)", registry=registry
+        )
+        self.g_segments = Gauge(
+            "camera_dvr_segments", "Segments held in the DVR ring", registry=registry
+        )
+        self.g_bytes = Gauge(
+            "camera_dvr_bytes", "Bytes of footage held in the DVR ring", registry=registry
+        )
+        self.g_window = Gauge(
+            "camera_dvr_window_seconds",
+            "Seconds of footage available for export",
+            registry=registry,
+        )
+        self.c_evicted = Counter(
+            "camera_dvr_segments_evicted",
+            "Segments dropped from the ring by reason",
+            ["reason"],
+            registry=registry,
+        )
+        self.c_exports = Counter(
+            "camera_dvr_clip_exports",
+            "Clip exports by result",
+            ["result"],
+            registry=registry,
+        )
+        self.h_export = Histogram(
+            "camera_dvr_clip_export_seconds",
+            "Time to export a clip",
+            buckets=(0.5, 1, 2, 5, 10, 30, 60, 120),
+            registry=registry,
+        )
+
+    # -- lifecycle -----------------------------------------------------------
+
+    async def start(self) -> None:
+        if not self.enabled:
+            return
+        self.segment_dir.mkdir(parents=True, exist_ok=True)
+        self.clip_dir.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        proc, self._proc = self._proc, None
+        if proc is not None and proc.returncode is None:
+            proc.terminate()
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+        self.g_recording.set(0.0)
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "recording": self._proc is not None and self._proc.returncode is None,
+            "segments": len(self.segments),
+            "bytes": sum(s.size for s in self.segments),
+            "oldest": self.segments[0].start if self.segments else None,
+            "newest": self.segments[-1].end if self.segments else None,
+            "segment_seconds": DVR_SEGMENT_SECONDS,
+            "retention_seconds": DVR_RETENTION_SECONDS,
+            "max_bytes": DVR_MAX_BYTES,
+            "error": self.error,
+        }
+
+    # -- index ---------------------------------------------------------------
+
+    def _load_index(self) -> None:
+        try:
+            raw = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            raw = {}
+        segments = []
+        for item in raw.get("segments", []):
+            try:
+                seg = Segment(**item)
+            except TypeError:
+                continue
+            path = self.segment_dir / seg.name
+            # Drop entries whose slot was rewritten or removed while we were down.
+            if seg.slot < DVR_SLOTS and path.is_file() and path.stat().st_size == seg.size:
+                segments.append(seg)
+        self.segments = sorted(segments, key=lambda s: s.start)
+        if self.segments:
+            self._next_slot = (self.segments[-1].slot + 1) % DVR_SLOTS
+        self._enforce_retention()
+
+    def _save_index(self) -> None:
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"segments": [asdict(s) for s in self.segments]}))
+        os.replace(tmp, self.index_path)
+
+    def _publish(self) -> None:
+        self.g_segments.set(len(self.segments))
+        self.g_bytes.set(sum(s.size for s in self.segments))
+        self.g_window.set(self.segments[-1].end - self.segments[0].start if self.segments else 0.0)
+
+    def _evict(self, seg: Segment, reason: str) -> None:
+        self.segments.remove(seg)
+        try:
+            (self.segment_dir / seg.name).unlink()
+        except FileNotFoundError:
+            pass
+        self.c_evicted.labels(reason=reason).inc()
+
+    def _enforce_retention(self) -> None:
+        cutoff = time.time() - DVR_RETENTION_SECONDS
+        while self.segments and self.segments[0].end < cutoff:
+            self._evict(self.segments[0], "age")
+        while len(self.segments) > 1 and sum(s.size for s in self.segments) > DVR_MAX_BYTES:
+            self._evict(self.segments[0], "size")
+        self._publish()
+
+    def _add_segment(self, name: str, duration: float) -> None:
+        path = self.segment_dir / name
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return
+        size, mtime = st.st_size, st.st_mtime
+        slot = int(name[3:8])
+        # The slot was just overwritten; whatever it held before is gone.
+        self.segments = [s for s in self.segments if s.slot != slot]
+        end = time.time()
+        self.segments.append(
+            Segment(slot=slot, name=name, start=end - duration, end=end, size=size, mtime=mtime)
+        )
+        self._next_slot = (slot + 1) % DVR_SLOTS
+        self._enforce_retention()
+        try:
+            self._save_index()
+        except OSError as exc:
+            logger.warning("failed to write DVR index: %s", exc)
+
+    # -- recorder ------------------------------------------------------------
+
+    def command(self) -> List[str]:
+        return [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-rtsp_transport",
+            "tcp",
+            "-i",
+            self.rtsp_url,
+            "-map",
+            "0:v",
+            "-c",
+            "copy",
+            "-f",
+            "segment",
+            "-segment_time",
+            str(DVR_SEGMENT_SECONDS),
+            "-segment_format",
+            "mpegts",
+            "-segment_wrap",
+            str(DVR_SLOTS),
+            "-segment_start_number",
+            str(self._next_slot),
+            "-reset_timestamps",
+            "1",
+            "-segment_list",
+            "pipe:1",
+            "-segment_list_type",
+            "csv",
+            str(self.segment_dir / "seg%05d.ts"),
+        ]
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                self._proc = await asyncio.create_subprocess_exec(
+                    *self.command(),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+            except FileNotFoundError:
+                self.error = "ffmpeg not found"
+                logger.error("ffmpeg not found on PATH; DVR disabled")
+                return
+            self.g_recording.set(1.0)
+            self.error = None
+            recorded = 0
+            assert self._proc.stdout is not None
+            async for raw in self._proc.stdout:
+                # csv list entries: <filename>,<start>,<end>
+                parts = raw.decode("utf-8", errors="ignore").strip().split(",")
+                if len(parts) < 3:
+                    continue
+                try:
+                    duration = float(parts[2]) - float(parts[1])
+                except ValueError:
+                    continue
+                self._add_segment(os.path.basename(parts[0]), duration)
+                recorded += 1
+            await self._proc.wait()
+            self.g_recording.set(0.0)
+            self.error = f"recorder exited (rc={self._proc.returncode})"
+            backoff = 1.0 if recorded else min(backoff * 2, 60.0)
+            logger.warning("%s; restarting in %.0fs", self.error, backoff)
+            await asyncio.sleep(backoff)
+
+    # -- clips ---------------------------------------------------------------
+
+    def list_clips(self) -> List[dict]:
+        if not self.clip_dir.is_dir():
+            return []
+        clips = []
+        for path in sorted(self.clip_dir.glob("clip-*.mp4")):
+            st = path.stat()
+            clips.append({"name": path.name, "size": st.st_size, "created": st.st_mtime})
+        return clips
+
+    def clip_path(self, name: str) -> Path:
+        if not _CLIP_NAME_RE.match(name):
+            raise ClipError(400, "invalid clip name")
+        path = self.clip_dir / name
+        if not path.is_file():
+            raise ClipError(404, "clip not found")
+        return path
+
+    def _unchanged(self, seg: Segment, path: Path) -> bool:
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return False
+        return st.st_size == seg.size and (not seg.mtime or st.st_mtime == seg.mtime)
+
+    def _intact(self, selected: List[Segment]) -> List[Segment]:
+        """The segments of ``selected`` whose slot files still match the index.
+
+        The recorder reuses slot files in place once it wraps around. Only
+        the oldest segments can have been recycled, so those are dropped
+        and the clip just starts later; a changed segment after an intact
+        one means the range itself was overwritten.
+        """
+        kept: List[Segment] = []
+        for seg in selected:
+            if self._unchanged(seg, self.segment_dir / seg.name):
+                kept.append(seg)
+            elif kept:
+                raise ClipError(409, "footage was overwritten during export; retry")
+        return kept
+
+    def _prune_clips(self) -> None:
+        clips = sorted(self.clip_dir.glob("clip-*.mp4"), key=lambda p: p.stat().st_mtime)
+        for path in clips[: max(0, len(clips) - DVR_CLIP_KEEP)]:
+            path.unlink(missing_ok=True)
+
+    async def export(self, start: float, end: float) -> dict:
+        """Concatenate the segments covering [start, end] into one MP4."""
+        if not self.enabled:
+            raise ClipError(503, "dvr_disabled")
+        if end <= start:
+            raise ClipError(400, "end must be after start")
+        if end - start > DVR_CLIP_MAX_SECONDS:
+            raise ClipError(400, f"clip longer than {DVR_CLIP_MAX_SECONDS:.0f}s")
+
+        async with self._export_lock:
+            # Selected only once the lock is held: a queued export may have
+            # waited long enough for the ring to move on.
+            selected = [s for s in self.segments if s.end > start and s.start < end]
+            if not selected:
+                raise ClipError(404, "no footage in range")
+            started = time.monotonic()
+            # Concatenated in place (no second copy on the SD card): checked
+            # against the index before ffmpeg runs and again once it is done.
+            selected = self._intact(selected)
+            if not selected:
+                raise ClipError(404, "no footage in range")
+            clip_start = max(start, selected[0].start)
+            clip_end = min(end, selected[-1].end)
+            name = "clip-{}-{}s.mp4".format(
+                time.strftime("%Y%m%d-%H%M%S", time.gmtime(clip_start)),
+                max(1, int(round(clip_end - clip_start))),
+            )
+            out = self.clip_dir / name
+            tmp = self.clip_dir / f".{name}.part"
+            concat = self.clip_dir / f".{name}.txt"
+            concat.write_text(
+                "".join(f"file '{self.segment_dir / s.name}'\n" for s in selected)
+            )
+            cmd = [
+                "ffmpeg",
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-y",
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-ss",
+                f"{clip_start - selected[0].start:.3f}",
+                "-i",
+                str(concat),
+                "-t",
+                f"{clip_end - clip_start:.3f}",
+                "-map",
+                "0:v",
+                "-c",
+                "copy",
+                "-movflags",
+                "+faststart",
+                "-f",
+                "mp4",
+                str(tmp),
+            ]
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+                )
+                try:
+                    _, stderr = await asyncio.wait_for(proc.communicate(), timeout=DVR_EXPORT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    proc.kill()
+                    await proc.wait()
+                    self.c_exports.labels(result="timeout").inc()
+                    raise ClipError(504, "export timed out")
+                if proc.returncode != 0:
+                    text = stderr.decode("utf-8", errors="ignore").strip()
+                    logger.error("clip export failed (rc=%s): %s", proc.returncode, text)
+                    self.c_exports.labels(result="error").inc()
+                    raise ClipError(500, "export failed")
+                if not all(self._unchanged(s, self.segment_dir / s.name) for s in selected):
+                    self.c_exports.labels(result="overwritten").inc()
+                    raise ClipError(409, "footage was overwritten during export; retry")
+                os.replace(tmp, out)
+            finally:
+                concat.unlink(missing_ok=True)
+                tmp.unlink(missing_ok=True)
+            self._prune_clips()
+            elapsed = time.monotonic() - started
+            self.h_export.observe(elapsed)
+            self.c_exports.labels(result="ok").inc()
+        return {
+            "name": name,
+            "start": clip_start,
+            "end": clip_end,
+            "segments": len(selected),
+            "size": out.stat().st_size,
+            "export_seconds": round(elapsed, 3),
+        }
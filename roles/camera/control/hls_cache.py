@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+import posixpath
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+
+logger = logging.getLogger("camera.hls")
+
+HLS_CACHE_MB = float(os.environ.get("CAMERA_HLS_CACHE_MB", "32"))
+# Playlists change every part/segment; this only folds together viewers that
+# poll within the same instant.
+HLS_PLAYLIST_TTL = float(os.environ.get("CAMERA_HLS_PLAYLIST_TTL", "0.5"))
+# Browser cache lifetime for segments (their names are never reused).
+HLS_SEGMENT_MAX_AGE = int(os.environ.get("CAMERA_HLS_SEGMENT_MAX_AGE", "3600"))
+# Generous enough for LL-HLS blocking playlist reloads (_HLS_msn/_HLS_part).
+HLS_UPSTREAM_TIMEOUT = float(os.environ.get("CAMERA_HLS_UPSTREAM_TIMEOUT", "10"))
+PLAYLIST_KEYS = 64
+
+
+class HlsError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class Entry:
+    __slots__ = ("status", "body", "content_type", "fetched")
+
+    def __init__(self, status: int, body: bytes, content_type: str, fetched: float):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.fetched = fetched
+
+
+class HlsCache:
+    """Caching, request-coalescing proxy in front of MediaMTX's HLS server.
+
+    Concurrent requests for the same URL (path plus query, so LL-HLS blocking
+    reloads are shared too) wait on one upstream fetch. Segments are immutable
+    and kept in a byte-bounded LRU; playlists are reused for
+    ``CAMERA_HLS_PLAYLIST_TTL`` seconds. Only paths under the directory of
+    ``CAMERA_HLS_URL`` are proxied.
+    """
+
+    def __init__(self, hls_url: str, registry: CollectorRegistry):
+        parts = urlsplit(hls_url)
+        self.origin = f"{parts.scheme}://{parts.netloc}"
+        self.prefix = posixpath.dirname(parts.path).strip("/") + "/"
+        self.capacity = int(HLS_CACHE_MB * 1024 * 1024)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._segments: "OrderedDict[str, Entry]" = OrderedDict()
+        self._playlists: Dict[str, Entry] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._bytes = 0
+        self._requests = 0
+        self._served_locally = 0
+
+        self.c_requests = Counter(
+            "camera_hls_requests",
+            "HLS proxy requests by kind and result (hit, coalesced, miss, error)",
+            ["kind", "result"],
+            registry=registry,
+        )
+        self.c_upstream_bytes = Counter(
+            "camera_hls_upstream_bytes",
+            "Bytes fetched from MediaMTX by the HLS proxy",
+            registry=registry,
+        )
+        self.c_served_bytes = Counter(
+            "camera_hls_served_bytes",
+            "Bytes sent to HLS viewers",
+            registry=registry,
+        )
+        self.c_saved_bytes = Counter(
+            "camera_hls_saved_bytes",
+            "Bytes sent to viewers without an upstream fetch of their own",
+            registry=registry,
+        )
+        self.c_evictions = Counter(
+            "camera_hls_cache_evictions",
+            "Segments evicted from the HLS cache to stay within CAMERA_HLS_CACHE_MB",
+            registry=registry,
+        )
+        self.g_bytes = Gauge(
+            "camera_hls_cache_bytes",
+            "Segment bytes held in the HLS cache",
+            registry=registry,
+        )
+        self.g_bytes.set_function(lambda: self._bytes)
+        self.g_entries = Gauge(
+            "camera_hls_cache_segments",
+            "Segments held in the HLS cache",
+            registry=registry,
+        )
+        self.g_entries.set_function(lambda: len(self._segments))
+        self.g_hit_ratio = Gauge(
+            "camera_hls_cache_hit_ratio",
+            "Share of HLS proxy requests served without their own upstream fetch",
+            registry=registry,
+        )
+        self.g_hit_ratio.set_function(self.hit_ratio)
+
+    def hit_ratio(self) -> float:
+        return self._served_locally / self._requests if self._requests else 0.0
+
+    async def start(self) -> None:
+        self._client = httpx.AsyncClient(
+            timeout=HLS_UPSTREAM_TIMEOUT,
+            headers={"User-Agent": "camera-control/1.0"},
+        )
+
+    async def stop(self) -> None:
+        for task in list(self._inflight.values()):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def status(self) -> dict:
+        return {
+            "cache_bytes": self._bytes,
+            "cache_capacity_bytes": self.capacity,
+            "segments": len(self._segments),
+            "playlists": len(self._playlists),
+            "inflight": len(self._inflight),
+            "hit_ratio": round(self.hit_ratio(), 4),
+        }
+
+    @staticmethod
+    def kind(path: str) -> str:
+        return "playlist" if path.endswith(".m3u8") else "segment"
+
+    def headers(self, path: str, result: str) -> Dict[str, str]:
+        if self.kind(path) == "segment":
+            cache_control = f"public, max-age={HLS_SEGMENT_MAX_AGE}, immutable"
+        else:
+            cache_control = f"public, max-age={int(HLS_PLAYLIST_TTL)}"
+        return {"Cache-Control": cache_control, "X-Cache": result.upper()}
+
+    async def get(self, path: str, query: str = "") -> Tuple[Entry, str]:
+        """Return the upstream response for ``path`` and how it was served."""
+        if not path.startswith(self.prefix) or ".." in path.split("/"):
+            raise HlsError(404, "not_found")
+        kind = self.kind(path)
+        key = f"{path}?{query}" if query else path
+        entry = self._lookup(kind, key)
+        if entry is not None:
+            return self._count(kind, "hit", entry), "hit"
+        task = self._inflight.get(key)
+        result = "coalesced"
+        if task is None:
+            result = "miss"
+            task = asyncio.ensure_future(self._fetch(kind, key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        try:
+            # Shielded: one viewer going away must not cancel the others' fetch.
+            entry = await asyncio.shield(task)
+        except HlsError:
+            self.c_requests.labels(kind=kind, result="error").inc()
+            self._requests += 1
+            raise
+        return self._count(kind, result, entry), result
+
+    def _lookup(self, kind: str, key: str) -> Optional[Entry]:
+        if kind == "segment":
+            entry = self._segments.get(key)
+            if entry is not None:
+                self._segments.move_to_end(key)
+            return entry
+        entry = self._playlists.get(key)
+        if entry is not None and time.monotonic() - entry.fetched < HLS_PLAYLIST_TTL:
+            return entry
+        return None
+
+    def _count(self, kind: str, result: str, entry: Entry) -> Entry:
+        size = len(entry.body)
+        self._requests += 1
+        self.c_requests.labels(kind=kind, result=result).inc()
+        self.c_served_bytes.inc(size)
+        if result != "miss":
+            self._served_locally += 1
+            self.c_saved_bytes.inc(size)
+        return entry
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here when every waiter has gone away
+
+    async def _fetch(self, kind: str, key: str) -> Entry:
+        if self._client is None:
+            raise HlsError(503, "hls_proxy_not_started")
+        try:
+            resp = await self._client.get(f"{self.origin}/{key}")
+        except httpx.HTTPError as exc:
+            logger.warning("HLS upstream fetch of %s failed: %s", key, exc)
+            raise HlsError(502, "upstream_unavailable") from exc
+        entry = Entry(
+            resp.status_code,
+            resp.content,
+            resp.headers.get("content-type", "application/octet-stream"),
+            time.monotonic(),
+        )
+        self.c_upstream_bytes.inc(len(entry.body))
+        if kind == "playlist":
+            self._store_playlist(key, entry)
+        elif entry.status == 200:
+            self._store_segment(key, entry)
+        return entry
+
+    def _store_playlist(self, key: str, entry: Entry) -> None:
+        self._playlists[key] = entry
+        if len(self._playlists) > PLAYLIST_KEYS:
+            cutoff = time.monotonic() - HLS_PLAYLIST_TTL
+            for stale in [k for k, e in self._playlists.items() if e.fetched < cutoff]:
+                del self._playlists[stale]
+
+    def _store_segment(self, key: str, entry: Entry) -> None:
+        size = len(entry.body)
+        # A single oversized object would flush everything else.
+        if size > self.capacity // 4:
+            return
+        self._segments[key] = entry
+        self._bytes += size
+        while self._bytes > self.capacity and self._segments:
+            _, evicted = self._segments.popitem(last=False)
+            self._bytes -= len(evicted.body)
+            self.c_evictions.inc()
@@ -0,0 +1,319 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+try:
+    import numpy as np
+except ImportError:  # only needed when motion detection is enabled
+    np = None
+
+
+logger = logging.getLogger("camera.motion")
+
+MOTION_ENABLED = os.environ.get("CAMERA_MOTION_ENABLED", "0") == "1"
+MOTION_WIDTH = int(os.environ.get("CAMERA_MOTION_WIDTH", "160"))
+MOTION_HEIGHT = int(os.environ.get("CAMERA_MOTION_HEIGHT", "90"))
+MOTION_FPS = float(os.environ.get("CAMERA_MOTION_FPS", "2"))
+# Per-pixel luma change (0-255) that counts a pixel as changed.
+MOTION_PIXEL_THRESHOLD = int(os.environ.get("CAMERA_MOTION_PIXEL_THRESHOLD", "25"))
+# Fraction of the masked area that must change for a frame to count as motion.
+MOTION_AREA_THRESHOLD = float(os.environ.get("CAMERA_MOTION_AREA_THRESHOLD", "0.02"))
+MOTION_MIN_FRAMES = int(os.environ.get("CAMERA_MOTION_MIN_FRAMES", "2"))
+MOTION_COOLDOWN_SECONDS = float(os.environ.get("CAMERA_MOTION_COOLDOWN_SECONDS", "5"))
+MOTION_BACKGROUND_ALPHA = float(os.environ.get("CAMERA_MOTION_BACKGROUND_ALPHA", "0.1"))
+MOTION_EVENT_LOG_SIZE = int(os.environ.get("CAMERA_MOTION_EVENT_LOG_SIZE", "200"))
+MOTION_REGIONS = os.environ.get("CAMERA_MOTION_REGIONS", "")
+MOTION_EXCLUDE = os.environ.get("CAMERA_MOTION_EXCLUDE", "")
+MOTION_NICE = int(os.environ.get("CAMERA_MOTION_NICE", "19"))
+# Low-resolution sub-stream to analyse. Without one, the main stream is used
+# with only its keyframes decoded, so analysis runs at the keyframe rate.
+MOTION_RTSP_URL = os.environ.get("CAMERA_MOTION_RTSP_URL", "")
+# Restart the decoder when no frame arrives for this long (also ffmpeg's RTSP socket timeout).
+MOTION_STALL_SECONDS = float(os.environ.get("CAMERA_MOTION_STALL_SECONDS", "30"))
+
+Rect = Tuple[float, float, float, float]
+
+
+def parse_regions(spec: str) -> List[Rect]:
+    """Parse ``x0,y0,x1,y1;...`` rectangles in 0-1 frame coordinates."""
+    regions: List[Rect] = []
+    for part in spec.split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        values = [float(v) for v in part.split(",")]
+        if len(values) != 4:
+            raise ValueError(f"region needs 4 values: {part!r}")
+        x0, y0, x1, y1 = (min(max(v, 0.0), 1.0) for v in values)
+        regions.append((min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)))
+    return regions
+
+
+def build_mask(width: int, height: int, include: List[Rect], exclude: List[Rect]):
+    """Boolean mask of pixels to analyse: included regions minus excluded ones."""
+    mask = np.zeros((height, width), dtype=bool) if include else np.ones((height, width), dtype=bool)
+
+    def span(rect: Rect):
+        x0, y0, x1, y1 = rect
+        return (
+            slice(int(round(y0 * height)), int(round(y1 * height))),
+            slice(int(round(x0 * width)), int(round(x1 * width))),
+        )
+
+    for rect in include:
+        mask[span(rect)] = True
+    for rect in exclude:
+        mask[span(rect)] = False
+    return mask
+
+
+class MotionDetector:
+    """Frame differencing against a running-average background."""
+
+    def __init__(self, width: int, height: int, mask=None):
+        self.width = width
+        self.height = height
+        self.mask = mask if mask is not None else np.ones((height, width), dtype=bool)
+        self.mask_pixels = max(int(self.mask.sum()), 1)
+        self.background = None
+
+    def score(self, frame) -> float:
+        """Return the fraction of masked pixels that differ from the background."""
+        current = frame.astype(np.float32)
+        if self.background is None:
+            self.background = current
+            return 0.0
+        diff = np.abs(current - self.background)
+        changed = (diff > MOTION_PIXEL_THRESHOLD) & self.mask
+        # Blend the frame into the background so lighting drift is absorbed.
+        self.background += MOTION_BACKGROUND_ALPHA * (current - self.background)
+        return float(np.count_nonzero(changed)) / self.mask_pixels
+
+
+class MotionMonitor:
+    """Runs a low-rate, low-priority decoder and turns motion scores into events."""
+
+    def __init__(self, rtsp_url: str, registry: CollectorRegistry):
+        self.rtsp_url = MOTION_RTSP_URL or rtsp_url
+        self.keyframes_only = not MOTION_RTSP_URL
+        self.enabled = MOTION_ENABLED
+        self.events: deque = deque(maxlen=MOTION_EVENT_LOG_SIZE)
+        self.active_event: Optional[dict] = None
+        self.level = 0.0
+        self.last_frame_ts: Optional[float] = None
+        self.error: Optional[str] = None
+        self._next_id = 1
+        self._streak = 0
+        self._last_motion = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._detector: Optional[MotionDetector] = None
+
+        self.g_active = Gauge(
+            "camera_motion_active", "Motion event in progress (1=yes)", registry=registry
+        )
+        self.g_level = Gauge(
+            "camera_motion_level",
+            "Fraction of the masked frame area changed in the last analysed frame",
+            registry=registry,
+        )
+        self.c_events = Counter(
+            "camera_motion_events", "Motion events detected", registry=registry
+        )
+        self.c_frames = Counter(
+            "camera_motion_frames", "Frames analysed for motion", registry=registry
+        )
+        self.h_analysis = Histogram(
+            "camera_motion_analysis_seconds",
+            "Time spent analysing one frame",
+            buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05),
+            registry=registry,
+        )
+
+    def command(self) -> List[str]:
+        cmd = [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-threads",
+            "1",
+            "-skip_loop_filter",
+            "all",
+            "-rtsp_transport",
+            "tcp",
+            "-timeout",
+            str(int(MOTION_STALL_SECONDS * 1_000_000)),
+        ]
+        vf = f"scale={MOTION_WIDTH}:{MOTION_HEIGHT},format=gray"
+        if self.keyframes_only:
+            # Full-resolution main stream: decoding every frame would pin a
+            # core. Keyframes arrive slower than MOTION_FPS, and an fps filter
+            # would only pad them with duplicates.
+            cmd += ["-skip_frame", "nokey"]
+        else:
+            vf = f"fps={MOTION_FPS}," + vf
+        cmd += [
+            "-i",
+            self.rtsp_url,
+            "-an",
+            "-vf",
+            vf,
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "gray",
+            "-",
+        ]
+        if MOTION_NICE:
+            cmd = ["nice", "-n", str(MOTION_NICE), *cmd]
+        return cmd
+
+    async def start(self) -> None:
+        if not self.enabled:
+            return
+        if np is None:
+            self.error = "numpy not installed"
+            logger.error("CAMERA_MOTION_ENABLED=1 but numpy is not installed; motion detection disabled")
+            return
+        try:
+            mask = build_mask(
+                MOTION_WIDTH,
+                MOTION_HEIGHT,
+                parse_regions(MOTION_REGIONS),
+                parse_regions(MOTION_EXCLUDE),
+            )
+        except ValueError as exc:
+            self.error = f"invalid motion region: {exc}"
+            logger.error("%s; motion detection disabled", self.error)
+            return
+        self._detector = MotionDetector(MOTION_WIDTH, MOTION_HEIGHT, mask)
+        if self.keyframes_only:
+            logger.warning(
+                "CAMERA_MOTION_RTSP_URL not set; analysing main-stream keyframes only"
+            )
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.kill()
+            await self._proc.wait()
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None and not self._task.done(),
+            "active": self.active_event is not None,
+            "level": self.level,
+            "last_frame": self.last_frame_ts,
+            "error": self.error,
+            "thresholds": {
+                "pixel": MOTION_PIXEL_THRESHOLD,
+                "area": MOTION_AREA_THRESHOLD,
+                "min_frames": MOTION_MIN_FRAMES,
+                "cooldown_seconds": MOTION_COOLDOWN_SECONDS,
+            },
+            "analysis": {
+                "width": MOTION_WIDTH,
+                "height": MOTION_HEIGHT,
+                "fps": MOTION_FPS,
+                "source": "main-keyframes" if self.keyframes_only else "substream",
+            },
+        }
+
+    def recent_events(self, since: int = 0, limit: int = 50) -> List[dict]:
+        events = [dict(e) for e in self.events if e["id"] > since]
+        if self.active_event is not None and self.active_event["id"] > since:
+            events.append(dict(self.active_event))
+        return events[-limit:] if limit > 0 else events
+
+    def observe(self, score: float, now: float) -> None:
+        """Advance the event state machine with one frame score."""
+        self.level = score
+        self.last_frame_ts = now
+        self.g_level.set(score)
+        if score >= MOTION_AREA_THRESHOLD:
+            self._streak += 1
+            self._last_motion = now
+            if self.active_event is None and self._streak >= MOTION_MIN_FRAMES:
+                self.active_event = {
+                    "id": self._next_id,
+                    "start": now,
+                    "end": None,
+                    "peak_level": score,
+                    "frames": self._streak,
+                }
+                self._next_id += 1
+                self.c_events.inc()
+                self.g_active.set(1.0)
+                logger.info("motion started (event %s, level %.3f)", self.active_event["id"], score)
+            elif self.active_event is not None:
+                self.active_event["frames"] += 1
+                self.active_event["peak_level"] = max(self.active_event["peak_level"], score)
+            return
+        self._streak = 0
+        if self.active_event is not None and now - self._last_motion >= MOTION_COOLDOWN_SECONDS:
+            self._close_event()
+
+    def _close_event(self) -> None:
+        if self.active_event is None:
+            return
+        self.active_event["end"] = self._last_motion
+        self.events.append(self.active_event)
+        logger.info("motion ended (event %s)", self.active_event["id"])
+        self.active_event = None
+        self.g_active.set(0.0)
+
+    async def _run(self) -> None:
+        frame_size = MOTION_WIDTH * MOTION_HEIGHT
+        backoff = 1.0
+        while True:
+            try:
+                self._proc = await asyncio.create_subprocess_exec(
+                    *self.command(),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+            except FileNotFoundError:
+                self.error = "ffmpeg not found"
+                logger.error("ffmpeg not found on PATH; motion detection disabled")
+                return
+            assert self._proc.stdout is not None
+            frames = 0
+            try:
+                while True:
+                    data = await asyncio.wait_for(
+                        self._proc.stdout.readexactly(frame_size), timeout=MOTION_STALL_SECONDS
+                    )
+                    started = time.perf_counter()
+                    frame = np.frombuffer(data, dtype=np.uint8).reshape(MOTION_HEIGHT, MOTION_WIDTH)
+                    score = self._detector.score(frame)
+                    self.observe(score, time.time())
+                    self.h_analysis.observe(time.perf_counter() - started)
+                    self.c_frames.inc()
+                    frames += 1
+                    self.error = None
+            except asyncio.IncompleteReadError:
+                pass
+            except asyncio.TimeoutError:
+                logger.warning("motion decoder produced no frame for %.0fs; restarting", MOTION_STALL_SECONDS)
+            if self._proc.returncode is None:
+                self._proc.kill()
+            await self._proc.wait()
+            self.error = f"decoder exited (rc={self._proc.returncode})"
+            self._streak = 0
+            self._close_event()
+            # Restart from a fresh background; the scene may have changed meanwhile.
+            self._detector.background = None
+            backoff = 1.0 if frames else min(backoff * 2, 30.0)
+            logger.warning("motion decoder exited; restarting in %.0fs", backoff)
+            await asyncio.sleep(backoff)
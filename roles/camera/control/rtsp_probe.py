@@ -0,0 +1,292 @@
+import asyncio
+import base64
+import struct
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+from urllib.parse import unquote, urljoin, urlparse
+
+
+USER_AGENT = "camera-control/1.0"
+
+
+class RtspError(Exception):
+    pass
+
+
+@dataclass
+class RtspResponse:
+    status: int
+    reason: str
+    headers: dict[str, str]
+    body: bytes = b""
+
+
+@dataclass
+class SdpMedia:
+    kind: str
+    payload_type: Optional[int] = None
+    codec: Optional[str] = None
+    clock_rate: Optional[int] = None
+    control: Optional[str] = None
+    fmtp: Optional[str] = None
+
+
+@dataclass
+class RtspProbeResult:
+    reachable: bool = False
+    stream_ready: bool = False
+    options_latency: Optional[float] = None
+    describe_latency: Optional[float] = None
+    status_code: Optional[int] = None
+    media: list[SdpMedia] = field(default_factory=list)
+    rtp_packets: int = 0
+    rtp_frames: int = 0
+    rtp_bytes: int = 0
+    fps: Optional[float] = None
+    bitrate: Optional[float] = None
+    error: Optional[str] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "reachable": self.reachable,
+            "stream_ready": self.stream_ready,
+            "status_code": self.status_code,
+            "options_latency": self.options_latency,
+            "describe_latency": self.describe_latency,
+            "media": [m.__dict__ for m in self.media],
+            "rtp_packets": self.rtp_packets,
+            "rtp_frames": self.rtp_frames,
+            "rtp_bytes": self.rtp_bytes,
+            "fps": self.fps,
+            "bitrate": self.bitrate,
+            "error": self.error,
+        }
+
+
+def parse_sdp(text: str) -> list[SdpMedia]:
+    media: list[SdpMedia] = []
+    current: Optional[SdpMedia] = None
+    for raw in text.splitlines():
+        line = raw.strip()
+        if line.startswith("m="):
+            parts = line[2:].split()
+            current = SdpMedia(kind=parts[0] if parts else "")
+            if len(parts) >= 4 and parts[3].isdigit():
+                current.payload_type = int(parts[3])
+            media.append(current)
+        elif current is None:
+            continue
+        elif line.startswith("a=rtpmap:"):
+            pt, _, encoding = line[len("a=rtpmap:"):].partition(" ")
+            if pt.isdigit() and int(pt) == current.payload_type:
+                name, _, rest = encoding.partition("/")
+                current.codec = name
+                rate = rest.split("/", 1)[0]
+                if rate.isdigit():
+                    current.clock_rate = int(rate)
+        elif line.startswith("a=control:"):
+            current.control = line[len("a=control:"):]
+        elif line.startswith("a=fmtp:"):
+            current.fmtp = line[len("a=fmtp:"):].partition(" ")[2]
+    return media
+
+
+class RtspClient:
+    """Minimal RTSP/1.0 client speaking TCP-interleaved RTP."""
+
+    def __init__(self, url: str, timeout: float):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 554
+        self.timeout = timeout
+        netloc = self.host if parsed.port is None else f"{self.host}:{parsed.port}"
+        self.url = parsed._replace(netloc=netloc).geturl()
+        self.auth: Optional[str] = None
+        if parsed.username:
+            creds = f"{unquote(parsed.username)}:{unquote(parsed.password or '')}"
+            self.auth = "Basic " + base64.b64encode(creds.encode("utf-8")).decode("ascii")
+        self.session: Optional[str] = None
+        self._cseq = 0
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self) -> None:
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout=self.timeout
+        )
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+            self._writer = None
+
+    async def request(
+        self, method: str, url: Optional[str] = None, headers: Optional[dict[str, str]] = None
+    ) -> RtspResponse:
+        assert self._writer is not None
+        self._cseq += 1
+        lines = [f"{method} {url or self.url} RTSP/1.0", f"CSeq: {self._cseq}", f"User-Agent: {USER_AGENT}"]
+        if self.auth:
+            lines.append(f"Authorization: {self.auth}")
+        if self.session:
+            lines.append(f"Session: {self.session}")
+        for key, value in (headers or {}).items():
+            lines.append(f"{key}: {value}")
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("utf-8"))
+        await self._writer.drain()
+        while True:
+            response = await asyncio.wait_for(self._read_message(), timeout=self.timeout)
+            if response is not None:
+                return response
+
+    async def _read_message(self) -> Optional[RtspResponse]:
+        """Read one RTSP response, skipping any interleaved packets before it."""
+        assert self._reader is not None
+        first = await self._reader.readexactly(1)
+        if first == b"$":
+            _, length = struct.unpack("!BH", await self._reader.readexactly(3))
+            await self._reader.readexactly(length)
+            return None
+        start_line, headers, body = await self._read_rest(first)
+        parts = start_line.split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("RTSP/") or not parts[1].isdigit():
+            raise RtspError(f"unexpected RTSP reply: {start_line[:80]}")
+        return RtspResponse(int(parts[1]), parts[2] if len(parts) > 2 else "", headers, body)
+
+    async def _read_rest(self, first: bytes) -> tuple[str, dict[str, str], bytes]:
+        """Read the start line, headers and body of a message whose first byte is ``first``."""
+        assert self._reader is not None
+        start_line = (first + await self._reader.readline()).decode("utf-8", errors="replace").strip()
+        headers: dict[str, str] = {}
+        while True:
+            line = (await self._reader.readline()).decode("utf-8", errors="replace").strip()
+            if not line:
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise RtspError(f"invalid Content-Length: {headers['content-length'][:40]}") from None
+        if length < 0:
+            raise RtspError(f"invalid Content-Length: {length}")
+        body = await self._reader.readexactly(length) if length else b""
+        return start_line, headers, body
+
+    async def read_rtp(self, duration: float, max_packets: int) -> list[tuple[int, bytes]]:
+        """Collect interleaved (channel, packet) pairs for up to ``duration`` seconds."""
+        assert self._reader is not None
+        packets: list[tuple[int, bytes]] = []
+        deadline = time.monotonic() + duration
+        while len(packets) < max_packets:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                marker = await asyncio.wait_for(self._reader.readexactly(1), timeout=remaining)
+                if marker != b"$":
+                    # Server-initiated RTSP message (e.g. keep-alive); skip it with its body.
+                    await asyncio.wait_for(self._read_rest(marker), timeout=self.timeout)
+                    continue
+                channel, length = struct.unpack("!BH", await self._reader.readexactly(3))
+                packets.append((channel, await self._reader.readexactly(length)))
+            except asyncio.TimeoutError:
+                break
+        return packets
+
+
+def summarize_rtp(packets: list[bytes], clock_rate: Optional[int], wall_seconds: float) -> tuple[int, int, Optional[float], Optional[float]]:
+    """Return (frames, payload bytes, fps, bitrate) for one RTP stream."""
+    timestamps: list[int] = []
+    payload_bytes = 0
+    for pkt in packets:
+        if len(pkt) < 12 or pkt[0] >> 6 != 2:
+            continue
+        csrc = pkt[0] & 0x0F
+        payload_bytes += max(0, len(pkt) - 12 - 4 * csrc)
+        ts = struct.unpack("!I", pkt[4:8])[0]
+        if not timestamps or timestamps[-1] != ts:
+            timestamps.append(ts)
+    frames = len(timestamps)
+    fps: Optional[float] = None
+    if frames >= 2 and clock_rate:
+        span = ((timestamps[-1] - timestamps[0]) & 0xFFFFFFFF) / clock_rate
+        if span > 0:
+            fps = (frames - 1) / span
+    elif frames >= 2 and wall_seconds > 0:
+        fps = frames / wall_seconds
+    bitrate = payload_bytes * 8 / wall_seconds if wall_seconds > 0 and payload_bytes else None
+    return frames, payload_bytes, fps, bitrate
+
+
+async def probe_stream(url: str, timeout: float, sample_seconds: float = 0.0, max_packets: int = 2000) -> RtspProbeResult:
+    """OPTIONS + DESCRIBE the stream and optionally sample its video RTP."""
+    result = RtspProbeResult()
+    client = RtspClient(url, timeout)
+    try:
+        async with asyncio.timeout(timeout + sample_seconds):
+            await _probe(client, result, sample_seconds, max_packets)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, RtspError) as exc:
+        result.error = str(exc) or exc.__class__.__name__
+    finally:
+        await client.close()
+    return result
+
+
+async def _probe(client: RtspClient, result: RtspProbeResult, sample_seconds: float, max_packets: int) -> None:
+    await client.connect()
+    started = time.monotonic()
+    await client.request("OPTIONS")
+    result.options_latency = time.monotonic() - started
+    result.reachable = True
+
+    started = time.monotonic()
+    resp = await client.request("DESCRIBE", headers={"Accept": "application/sdp"})
+    result.describe_latency = time.monotonic() - started
+    result.status_code = resp.status
+    if resp.status != 200:
+        result.error = f"DESCRIBE returned {resp.status} {resp.reason}".strip()
+        return
+    result.media = parse_sdp(resp.body.decode("utf-8", errors="replace"))
+    video = next((m for m in result.media if m.kind == "video"), None)
+    result.stream_ready = video is not None
+    if video is None:
+        result.error = "SDP has no video media"
+        return
+    if sample_seconds <= 0:
+        return
+
+    base = resp.headers.get("content-base") or resp.headers.get("content-location") or client.url
+    if not base.endswith("/"):
+        base += "/"
+    control = video.control or ""
+    track_url = control if "://" in control else (client.url if control in ("", "*") else urljoin(base, control))
+    resp = await client.request("SETUP", track_url, {"Transport": "RTP/AVP/TCP;unicast;interleaved=0-1"})
+    if resp.status != 200:
+        result.error = f"SETUP returned {resp.status} {resp.reason}".strip()
+        return
+    client.session = resp.headers.get("session", "").split(";", 1)[0] or None
+    resp = await client.request("PLAY", headers={"Range": "npt=0.000-"})
+    if resp.status != 200:
+        result.error = f"PLAY returned {resp.status} {resp.reason}".strip()
+        return
+
+    started = time.monotonic()
+    packets = await client.read_rtp(sample_seconds, max_packets)
+    elapsed = time.monotonic() - started
+    rtp = [pkt for channel, pkt in packets if channel == 0]
+    result.rtp_packets = len(rtp)
+    result.rtp_frames, result.rtp_bytes, result.fps, result.bitrate = summarize_rtp(
+        rtp, video.clock_rate, elapsed
+    )
+    if not rtp:
+        result.error = "no RTP packets received"
+    try:
+        await client.request("TEARDOWN")
+    except Exception:
+        pass
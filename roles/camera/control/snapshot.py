@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+
+logger = logging.getLogger("camera.snapshot")
+
+SNAPSHOT_FPS = float(os.environ.get("CAMERA_SNAPSHOT_FPS", "1"))
+SNAPSHOT_WIDTH = int(os.environ.get("CAMERA_SNAPSHOT_WIDTH", "640"))
+SNAPSHOT_QUALITY = int(os.environ.get("CAMERA_SNAPSHOT_QUALITY", "5"))
+# Stop the decoder after this many seconds without snapshot requests (0 = run always).
+SNAPSHOT_IDLE_SECONDS = float(os.environ.get("CAMERA_SNAPSHOT_IDLE_SECONDS", "300"))
+SNAPSHOT_WAIT_SECONDS = float(os.environ.get("CAMERA_SNAPSHOT_WAIT_SECONDS", "5"))
+# Cached frames older than this make a request wait for a fresh keyframe.
+SNAPSHOT_MAX_AGE = float(os.environ.get("CAMERA_SNAPSHOT_MAX_AGE", "10"))
+# Restart the decoder when it has produced no frame for this long; also
+# ffmpeg's RTSP socket timeout, so a silent source makes it exit by itself.
+SNAPSHOT_STALL_SECONDS = float(os.environ.get("CAMERA_SNAPSHOT_STALL_SECONDS", "30"))
+READ_TIMEOUT = 10.0
+
+_SOI = b"\xff\xd8"
+_EOI = b"\xff\xd9"
+
+
+class Frame:
+    __slots__ = ("data", "seq", "ts", "etag")
+
+    def __init__(self, data: bytes, seq: int, ts: float, epoch: int):
+        self.data = data
+        self.seq = seq
+        self.ts = ts
+        self.etag = f'"{epoch:x}-{seq:x}"'
+
+
+class SnapshotSource:
+    """Keeps the latest JPEG keyframe from a single long-lived ffmpeg decoder.
+
+    ffmpeg only decodes keyframes (``-skip_frame nokey``) and emits them as
+    MJPEG at most ``CAMERA_SNAPSHOT_FPS`` times a second, so any number of
+    concurrent requests are served from the same cached frame.
+    """
+
+    def __init__(self, rtsp_url: str, registry: CollectorRegistry):
+        self.rtsp_url = rtsp_url
+        self.frame: Optional[Frame] = None
+        self._epoch = int(time.time())
+        self._seq = 0
+        self._new_frame = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._last_request = 0.0
+
+        self.g_running = Gauge(
+            "camera_snapshot_decoder_running",
+            "Snapshot decoder process running (1=yes)",
+            registry=registry,
+        )
+        self.g_age = Gauge(
+            "camera_snapshot_age_seconds",
+            "Age of the cached snapshot frame",
+            registry=registry,
+        )
+        self.g_age.set_function(self.frame_age)
+        self.c_frames = Counter(
+            "camera_snapshot_frames",
+            "Frames received from the snapshot decoder",
+            registry=registry,
+        )
+        self.c_stalls = Counter(
+            "camera_snapshot_stalls",
+            "Snapshot decoder restarts after producing no frame for CAMERA_SNAPSHOT_STALL_SECONDS",
+            registry=registry,
+        )
+        self.c_requests = Counter(
+            "camera_snapshot_requests",
+            "Snapshot requests by response status",
+            ["status"],
+            registry=registry,
+        )
+
+    def frame_age(self) -> float:
+        return time.time() - self.frame.ts if self.frame else -1.0
+
+    def is_stale(self, frame: Frame) -> bool:
+        return time.time() - frame.ts > SNAPSHOT_MAX_AGE
+
+    def command(self) -> List[str]:
+        vf = f"fps={SNAPSHOT_FPS}"
+        if SNAPSHOT_WIDTH > 0:
+            vf += f",scale={SNAPSHOT_WIDTH}:-2"
+        return [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-rtsp_transport",
+            "tcp",
+            "-timeout",
+            str(int(SNAPSHOT_STALL_SECONDS * 1_000_000)),
+            "-skip_frame",
+            "nokey",
+            "-i",
+            self.rtsp_url,
+            "-an",
+            "-vf",
+            vf,
+            "-c:v",
+            "mjpeg",
+            "-q:v",
+            str(SNAPSHOT_QUALITY),
+            "-f",
+            "image2pipe",
+            "-",
+        ]
+
+    async def start(self) -> None:
+        if SNAPSHOT_IDLE_SECONDS <= 0:
+            self._ensure_running()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._kill()
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def get(self) -> Optional[Frame]:
+        """Return the cached frame, waiting briefly for the decoder if it is stale."""
+        self._last_request = time.monotonic()
+        self._ensure_running()
+        frame = self.frame
+        if frame is not None and time.time() - frame.ts <= SNAPSHOT_MAX_AGE:
+            return frame
+        try:
+            async with self._new_frame:
+                await asyncio.wait_for(self._new_frame.wait(), timeout=SNAPSHOT_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        return self.frame
+
+    async def _publish(self, data: bytes) -> None:
+        self._seq += 1
+        self.frame = Frame(data, self._seq, time.time(), self._epoch)
+        self.c_frames.inc()
+        async with self._new_frame:
+            self._new_frame.notify_all()
+
+    def _idle(self) -> bool:
+        return (
+            SNAPSHOT_IDLE_SECONDS > 0
+            and time.monotonic() - self._last_request > SNAPSHOT_IDLE_SECONDS
+        )
+
+    async def _kill(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is not None and proc.returncode is None:
+            proc.terminate()
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=2)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+        self.g_running.set(0.0)
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while not self._idle():
+            try:
+                self._proc = await asyncio.create_subprocess_exec(
+                    *self.command(),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+            except FileNotFoundError:
+                logger.error("ffmpeg not found on PATH; snapshots disabled")
+                return
+            self.g_running.set(1.0)
+            got_frame = await self._read_frames(self._proc)
+            await self._kill()
+            if self._idle():
+                break
+            backoff = 1.0 if got_frame else min(backoff * 2, 30.0)
+            logger.warning("snapshot decoder exited; restarting in %.0fs", backoff)
+            await asyncio.sleep(backoff)
+        logger.info("snapshot decoder idle; stopped")
+
+    async def _read_frames(self, proc: asyncio.subprocess.Process) -> bool:
+        assert proc.stdout is not None
+        buf = bytearray()
+        got_frame = False
+        last_frame = time.monotonic()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(proc.stdout.read(65536), timeout=READ_TIMEOUT)
+            except asyncio.TimeoutError:
+                chunk = None
+            if chunk == b"":
+                return got_frame
+            if chunk:
+                buf += chunk
+                while True:
+                    start = buf.find(_SOI)
+                    if start < 0:
+                        del buf[:-1]
+                        break
+                    end = buf.find(_EOI, start + 2)
+                    if end < 0:
+                        if start:
+                            del buf[:start]
+                        break
+                    await self._publish(bytes(buf[start:end + 2]))
+                    got_frame = True
+                    last_frame = time.monotonic()
+                    del buf[:end + 2]
+            if self._idle():
+                return got_frame
+            if time.monotonic() - last_frame > SNAPSHOT_STALL_SECONDS:
+                # ffmpeg is alive but silent: the source stalled without closing.
+                logger.warning("snapshot decoder produced no frame for %.0fs; restarting", SNAPSHOT_STALL_SECONDS)
+                self.c_stalls.inc()
+                return got_frame
@@ -1,27 +1,73 @@
+import asyncio
 import os
 import json
-import socket
-import subprocess
 import logging
+import shutil
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, List, Optional
 
 from fastapi import FastAPI, Header, HTTPException, UploadFile, File
 from fastapi.responses import PlainTextResponse, JSONResponse
-from prometheus_client import Gauge, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+
+from cec_manager import CEC_WAIT_TIMEOUT, CecManager
+from loudness import LOUDNESS_ENABLED, LoudnessIndex, audio_filter
+from playback_stats import PlaybackTelemetry
+from prefetch import PREFETCH_ENABLED, PREFETCH_ON_PLAY, PrefetchCache, PrefetchError
+from transcoder import TRANSCODE_ENABLED, Transcoder
 
 
 MEDIA_CONTROL_TOKEN = os.environ.get("MEDIA_CONTROL_TOKEN", "")
 MPV_SOCKET = os.environ.get("MPV_SOCKET", "/run/mpv.sock")
 VIDEO_DATA_DIR = os.environ.get("VIDEO_DATA_DIR", "/data")
 VIDEO_LIBRARY_DIR = Path(VIDEO_DATA_DIR) / "library"
+LOUDNESS_INDEX_PATH = Path(VIDEO_DATA_DIR) / "loudness.json"
+PREFETCH_DIR = Path(VIDEO_DATA_DIR) / "cache"
 
 logger = logging.getLogger("hdmi-media.control")
 
-app = FastAPI(title="HDMI Media Control")
-
 reg = CollectorRegistry()
-g_playing = Gauge("media_playing", "MPV playing state (1=playing,0=paused/stopped)", registry=reg)
+
+cec_manager = CecManager(reg)
+loudness_index = LoudnessIndex(LOUDNESS_INDEX_PATH)
+_analysis_tasks: set = set()
+
+
+def analyse_loudness(path: Path) -> None:
+    if LOUDNESS_ENABLED:
+        task = asyncio.create_task(asyncio.to_thread(loudness_index.analyse, path))
+        _analysis_tasks.add(task)
+        task.add_done_callback(_analysis_tasks.discard)
+
+
+async def on_transcoded(original: Path, optimized: Path) -> None:
+    # The optimized file replaces the original, so its measurement is redone.
+    if original != optimized:
+        await asyncio.to_thread(loudness_index.forget, original)
+    analyse_loudness(optimized)
+
+
+transcoder = Transcoder(VIDEO_LIBRARY_DIR, reg, on_replaced=on_transcoded)
+prefetch = PrefetchCache(PREFETCH_DIR, reg)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await cec_manager.start()
+    await telemetry.start()
+    await transcoder.start()
+    await prefetch.start()
+    try:
+        yield
+    finally:
+        await prefetch.stop()
+        await transcoder.stop()
+        await telemetry.stop()
+        await cec_manager.stop()
+
+
+app = FastAPI(title="HDMI Media Control", lifespan=lifespan)
 
 
 def check_auth(authorization: Optional[str]):
@@ -34,64 +80,68 @@ def check_auth(authorization: Optional[str]):
         raise HTTPException(status_code=401, detail="unauthorized")
 
 
-def mpv_command(cmd: dict):
-    data = (json.dumps(cmd) + "\n").encode("utf-8")
-    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
-        s.settimeout(2)
-        s.connect(MPV_SOCKET)
-        s.sendall(data)
-        try:
-            resp = s.recv(4096)
-        except socket.timeout:
-            resp = b""
-    return resp
+MPV_TIMEOUT = float(os.environ.get("MPV_IPC_TIMEOUT", "2"))
 
 
-def mpv_set(property_name: str, value):
-    return mpv_command({"command": ["set_property", property_name, value]})
+async def mpv_request(*cmds: dict) -> List[dict]:
+    """Send commands over one IPC connection and return replies in order.
 
+    Each command is tagged with a request_id so replies can be matched even
+    when mpv interleaves event lines on the same socket.
+    """
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_unix_connection(MPV_SOCKET), timeout=MPV_TIMEOUT
+    )
+    replies: Dict[int, dict] = {}
+    try:
+        payload = b"".join(
+            (json.dumps({**cmd, "request_id": i}) + "\n").encode("utf-8")
+            for i, cmd in enumerate(cmds, start=1)
+        )
+        writer.write(payload)
+        await writer.drain()
+        deadline = asyncio.get_running_loop().time() + MPV_TIMEOUT
+        while len(replies) < len(cmds):
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                line = await asyncio.wait_for(reader.readline(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                break
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            if "request_id" in msg:
+                replies[msg["request_id"]] = msg
+    finally:
+        writer.close()
+    return [replies.get(i, {}) for i in range(1, len(cmds) + 1)]
 
-def mpv_get(property_name: str):
-    return mpv_command({"command": ["get_property", property_name]})
 
+async def mpv_command(cmd: dict) -> dict:
+    return (await mpv_request(cmd))[0]
 
-def resolve_cec_device() -> Tuple[str, Path]:
-    idx = "1" if str(os.environ.get("CEC_DEVICE_INDEX", "0")) == "1" else "0"
-    primary_path = Path(f"/dev/cec{idx}")
-    if primary_path.exists():
-        return idx, primary_path
-    fallback_idx = "0" if idx == "1" else "1"
-    fallback_path = Path(f"/dev/cec{fallback_idx}")
-    if fallback_path.exists():
-        logger.warning(
-            "Configured CEC device /dev/cec%s missing; falling back to /dev/cec%s",
-            idx,
-            fallback_idx,
-        )
-        return fallback_idx, fallback_path
-    return idx, primary_path
 
+async def mpv_set(property_name: str, value) -> dict:
+    return await mpv_command({"command": ["set_property", property_name, value]})
+
+
+async def mpv_get(property_name: str) -> dict:
+    return await mpv_command({"command": ["get_property", property_name]})
 
-def cec(*args: str) -> int:
-    idx, device_path = resolve_cec_device()
-    cmd = ["cec-ctl", f"-d{idx}", *args]
-    cmd_str = " ".join(cmd)
-    if not device_path.exists():
-        logger.error("CEC device %s not present; command skipped: %s", device_path, cmd_str)
-        return 1
-    try:
-        subprocess.run(cmd, check=True, capture_output=True)
-        return 0
-    except FileNotFoundError:
-        logger.error("cec-ctl binary not found on PATH")
-        return 127
-    except subprocess.CalledProcessError as exc:
-        stderr = exc.stderr.decode("utf-8", errors="ignore") if exc.stderr else ""
-        if stderr:
-            logger.error("cec-ctl failed (rc=%s): %s", exc.returncode, stderr.strip())
-        else:
-            logger.error("cec-ctl failed (rc=%s)", exc.returncode)
-        return exc.returncode
+
+async def mpv_get_many(*property_names: str) -> Dict[str, object]:
+    replies = await mpv_request(
+        *({"command": ["get_property", name]} for name in property_names)
+    )
+    return {name: reply.get("data") for name, reply in zip(property_names, replies)}
+
+
+telemetry = PlaybackTelemetry(reg, mpv_request)
 
 
 @app.get("/healthz", response_class=PlainTextResponse)
@@ -100,102 +150,149 @@ def healthz():
 
 
 @app.get("/metrics")
-def metrics():
+async def metrics():
     try:
-        state = json.loads(mpv_get("pause").decode("utf-8"))
-        paused = state.get("data", False)
-        g_playing.set(0.0 if paused else 1.0)
+        await telemetry.sample()
     except Exception:
-        g_playing.set(0.0)
+        telemetry.g_playing.set(0.0)
     output = generate_latest(reg)
     return PlainTextResponse(content=output, media_type=CONTENT_TYPE_LATEST)
 
 
 @app.get("/status")
-def status(Authorization: Optional[str] = Header(None)):
+async def status(Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
     out = {}
     try:
-        out["pause"] = json.loads(mpv_get("pause").decode("utf-8")).get("data")
-        out["time_pos"] = json.loads(mpv_get("time-pos").decode("utf-8")).get("data")
-        out["duration"] = json.loads(mpv_get("duration").decode("utf-8")).get("data")
-        out["volume"] = json.loads(mpv_get("volume").decode("utf-8")).get("data")
-        out["path"] = json.loads(mpv_get("path").decode("utf-8")).get("data")
+        props = await mpv_get_many("pause", "time-pos", "duration", "volume", "path")
+        out["pause"] = props["pause"]
+        out["time_pos"] = props["time-pos"]
+        out["duration"] = props["duration"]
+        out["volume"] = props["volume"]
+        out["path"] = props["path"]
     except Exception:
         pass
+    # Last telemetry sample (MEDIA_TELEMETRY_SECONDS old at most).
+    out["playback"] = telemetry.latest
     return out
 
 
 @app.post("/play")
-def play(payload: dict, Authorization: Optional[str] = Header(None)):
+async def play(payload: dict, Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
     url = payload.get("url")
     start = payload.get("start")
     if not url:
         raise HTTPException(400, "missing url")
-    mpv_command({"command": ["loadfile", url, "replace"]})
+    media = library_file(url)
+    gain_db = loudness_index.gain_db(media) if media is not None else 0.0
+    # Remote files play from the prefetch cache once fully downloaded; until
+    # then they stream as before while the download runs in the background.
+    cached = prefetch.lookup(url) if media is None else None
+    if cached is None and media is None and PREFETCH_ON_PLAY:
+        try:
+            prefetch.fetch(url)
+        except PrefetchError:
+            pass
+    # The measured gain replaces the filter chain for every load, so it
+    # never carries over to the next file. mpv runs on the host, so library
+    # files keep the caller's path; ``media`` is the container view, only
+    # used for the gain lookup.
+    cmds = [
+        {"command": ["set_property", "af", audio_filter(gain_db)]},
+        {"command": ["loadfile", str(cached) if cached else url, "replace"]},
+    ]
     if start is not None:
-        mpv_command({"command": ["seek", float(start), "absolute"]})
-    mpv_set("pause", False)
-    return {"ok": True}
+        cmds.append({"command": ["seek", float(start), "absolute"]})
+    cmds.append({"command": ["set_property", "pause", False]})
+    await mpv_request(*cmds)
+    return {"ok": True, "gain_db": gain_db, "cached": cached is not None}
+
+
+def library_file(url: str) -> Optional[Path]:
+    """Library file that ``url`` (a path or a bare library file name) refers to."""
+    if "://" in url:
+        return None
+    candidate = Path(url) if "/" in url else VIDEO_LIBRARY_DIR / url
+    try:
+        candidate = candidate.resolve()
+    except OSError:
+        return None
+    if candidate.is_relative_to(VIDEO_LIBRARY_DIR.resolve()) and candidate.is_file():
+        return candidate
+    return None
 
 
 @app.post("/pause")
-def pause(Authorization: Optional[str] = Header(None)):
+async def pause(Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
-    mpv_set("pause", True)
+    await mpv_set("pause", True)
     return {"ok": True}
 
 
 @app.post("/resume")
-def resume(Authorization: Optional[str] = Header(None)):
+async def resume(Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
-    mpv_set("pause", False)
+    await mpv_set("pause", False)
     return {"ok": True}
 
 
 @app.post("/stop")
-def stop(Authorization: Optional[str] = Header(None)):
+async def stop(Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
-    mpv_command({"command": ["stop"]})
+    await mpv_command({"command": ["stop"]})
     return {"ok": True}
 
 
 @app.post("/seek")
-def seek(payload: dict, Authorization: Optional[str] = Header(None)):
+async def seek(payload: dict, Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
     seconds = float(payload.get("seconds", 0))
-    mpv_command({"command": ["seek", seconds, "relative"]})
+    await mpv_command({"command": ["seek", seconds, "relative"]})
     return {"ok": True}
 
 
 @app.post("/volume")
-def volume(payload: dict, Authorization: Optional[str] = Header(None)):
+async def volume(payload: dict, Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
     v = max(0, min(100, int(payload.get("volume", 100))))
-    mpv_set("volume", v)
+    await mpv_set("volume", v)
     return {"ok": True, "volume": v}
 
 
+async def tv_command(name: str, wait: bool) -> dict:
+    future = cec_manager.submit(name)
+    if not wait:
+        return {"ok": True, "queued": True, "tv": cec_manager.status()}
+    try:
+        rc = await asyncio.wait_for(asyncio.shield(future), timeout=CEC_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(504, f"CEC command {name} still queued after {CEC_WAIT_TIMEOUT:.0f}s")
+    return {"ok": rc == 0, "queued": False, "tv": cec_manager.status()}
+
+
+@app.get("/tv/status")
+async def tv_status(Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    return cec_manager.status()
+
+
 @app.post("/tv/power_on")
-def tv_power_on(Authorization: Optional[str] = Header(None)):
+async def tv_power_on(wait: bool = False, Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
-    rc = cec("--to", "0", "--image-view-on")
-    return {"ok": rc == 0}
+    return await tv_command("power_on", wait)
 
 
 @app.post("/tv/power_off")
-def tv_power_off(Authorization: Optional[str] = Header(None)):
+async def tv_power_off(wait: bool = False, Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
-    rc = cec("--to", "0", "--standby")
-    return {"ok": rc == 0}
+    return await tv_command("power_off", wait)
 
 
 @app.post("/tv/input")
-def tv_input(payload: dict = None, Authorization: Optional[str] = Header(None)):
+async def tv_input(payload: dict = None, wait: bool = False, Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
-    rc = cec("--to", "0", "--active-source", "phys-addr=0.0.0.0")
-    return {"ok": rc == 0}
+    return await tv_command("input", wait)
 
 
 @app.get("/library")
@@ -204,17 +301,25 @@ def list_library(Authorization: Optional[str] = Header(None)):
     VIDEO_LIBRARY_DIR.mkdir(parents=True, exist_ok=True)
 
     videos = []
+    index = loudness_index.load()
     for video_file in VIDEO_LIBRARY_DIR.glob("*"):
         if video_file.is_file() and video_file.suffix.lower() in ['.mp4', '.mkv', '.avi', '.mov', '.webm']:
             videos.append({
                 "filename": video_file.name,
                 "path": str(video_file),
                 "size": video_file.stat().st_size,
+                "loudness": loudness_index.entry(video_file, index),
+                "transcode": transcoder.latest_for(video_file.name),
             })
 
     return {"videos": videos}
 
 
+def save_upload(src, dest: Path) -> None:
+    with open(dest, "wb") as f:
+        shutil.copyfileobj(src, f, 1024 * 1024)
+
+
 @app.post("/library/upload")
 async def upload_video(file: UploadFile = File(...), Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
@@ -233,23 +338,42 @@ async def upload_video(file: UploadFile = File(...), Authorization: Optional[str
     # Save file
     file_path = VIDEO_LIBRARY_DIR / file.filename
     try:
-        with open(file_path, "wb") as f:
-            while chunk := await file.read(8192):
-                f.write(chunk)
+        await asyncio.to_thread(save_upload, file.file, file_path)
+        await asyncio.to_thread(loudness_index.forget, file_path)
+        # Measured once here so playback only needs a fixed gain.
+        analyse_loudness(file_path)
+        job = transcoder.submit(file_path)
 
         return {
             "ok": True,
             "filename": file.filename,
             "path": str(file_path),
             "size": file_path.stat().st_size,
+            "loudness": "analysing" if LOUDNESS_ENABLED else "disabled",
+            "transcode_job": job.id if job else None,
         }
     except Exception as e:
         logger.error(f"Failed to upload video: {e}")
         raise HTTPException(500, f"upload failed: {str(e)}")
 
 
+@app.get("/library/jobs")
+def list_transcode_jobs(Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    return {"enabled": TRANSCODE_ENABLED, "jobs": transcoder.jobs()}
+
+
+@app.get("/library/jobs/{job_id}")
+def get_transcode_job(job_id: int, Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    job = transcoder.job(job_id)
+    if job is None:
+        raise HTTPException(404, "job not found")
+    return job
+
+
 @app.delete("/library/{filename}")
-def delete_video(filename: str, Authorization: Optional[str] = Header(None)):
+async def delete_video(filename: str, Authorization: Optional[str] = Header(None)):
     check_auth(Authorization)
 
     file_path = VIDEO_LIBRARY_DIR / filename
@@ -261,13 +385,48 @@ def delete_video(filename: str, Authorization: Optional[str] = Header(None)):
         raise HTTPException(400, "invalid filename")
 
     try:
+        # On the event loop: cancel() touches the job table and the asyncio
+        # subprocess, neither of which is safe from a threadpool thread.
+        transcoder.cancel(file_path)
         file_path.unlink()
+        loudness_index.forget(file_path)
         return {"ok": True, "deleted": filename}
     except Exception as e:
         logger.error(f"Failed to delete video: {e}")
         raise HTTPException(500, f"delete failed: {str(e)}")
 
 
+@app.get("/prefetch")
+def list_prefetch(Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    return {
+        "enabled": PREFETCH_ENABLED,
+        "used_bytes": prefetch.usage(),
+        "max_bytes": prefetch.max_bytes,
+        "entries": prefetch.entries(),
+    }
+
+
+@app.post("/prefetch")
+async def start_prefetch(payload: dict, Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    url = payload.get("url")
+    if not url:
+        raise HTTPException(400, "missing url")
+    try:
+        return prefetch.fetch(url)
+    except PrefetchError as exc:
+        raise HTTPException(400, str(exc))
+
+
+@app.delete("/prefetch")
+async def delete_prefetch(url: str, Authorization: Optional[str] = Header(None)):
+    check_auth(Authorization)
+    if not prefetch.remove(url):
+        raise HTTPException(404, "url not cached")
+    return {"ok": True, "deleted": url}
+
+
 @app.get("/openapi.yaml")
 def openapi_spec():
     """Serve OpenAPI specification for API documentation and testing."""
@@ -0,0 +1,299 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+
+logger = logging.getLogger("hdmi-media.cec")
+
+CEC_COMMAND_TIMEOUT = float(os.environ.get("CEC_COMMAND_TIMEOUT", "10"))
+# A waiting request can sit behind one queued command per group.
+CEC_WAIT_TIMEOUT = CEC_COMMAND_TIMEOUT * 4 + 5
+CEC_MONITOR_ENABLED = os.environ.get("CEC_MONITOR", "1") != "0"
+# Seconds after a power command before the TV is asked to report its state.
+CEC_POWER_REFRESH_DELAY = float(os.environ.get("CEC_POWER_REFRESH_DELAY", "5"))
+# Where cecN device nodes live; benchmarks point this at a directory of stand-ins.
+CEC_DEVICE_DIR = Path(os.environ.get("CEC_DEVICE_DIR", "/dev"))
+
+# name -> (dedup group, cec-ctl arguments). Commands in the same group
+# collapse while queued: the newest request replaces the pending one.
+CEC_COMMANDS: Dict[str, Tuple[str, List[str]]] = {
+    "power_on": ("power", ["--to", "0", "--image-view-on"]),
+    "power_off": ("power", ["--to", "0", "--standby"]),
+    "input": ("input", ["--to", "0", "--active-source", "phys-addr=0.0.0.0"]),
+    "power_status": ("power_status", ["--to", "0", "--give-device-power-status"]),
+}
+
+POWER_STATES = ("on", "standby", "to-on", "to-standby", "unknown")
+
+_MSG_RE = re.compile(
+    r"(?P<dir>Received|Transmitted)\b.*\((?P<src>\d+) to (?P<dst>\d+)\):\s*(?P<op>[A-Z_]+)"
+)
+_PWR_RE = re.compile(r"pwr-state:\s*(?P<state>[a-z-]+)")
+
+
+def resolve_cec_device() -> Tuple[str, Path]:
+    idx = "1" if str(os.environ.get("CEC_DEVICE_INDEX", "0")) == "1" else "0"
+    primary_path = CEC_DEVICE_DIR / f"cec{idx}"
+    if primary_path.exists():
+        return idx, primary_path
+    fallback_idx = "0" if idx == "1" else "1"
+    fallback_path = CEC_DEVICE_DIR / f"cec{fallback_idx}"
+    if fallback_path.exists():
+        logger.warning(
+            "Configured CEC device %s missing; falling back to %s",
+            primary_path,
+            fallback_path,
+        )
+        return fallback_idx, fallback_path
+    return idx, primary_path
+
+
+@dataclass
+class CecCommand:
+    name: str
+    group: str
+    args: List[str]
+    future: asyncio.Future
+    submitted: float = field(default_factory=time.monotonic)
+
+
+class CecManager:
+    """Owns the CEC adapter for the lifetime of the control service.
+
+    Commands are serialized through a single worker so concurrent API calls
+    never race for the bus, and a long-running ``cec-ctl --monitor`` keeps
+    the TV power state current from bus traffic.
+    """
+
+    def __init__(self, registry: CollectorRegistry):
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._pending: Dict[str, CecCommand] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._monitor_proc: Optional[asyncio.subprocess.Process] = None
+        self._idx, self._device_path = resolve_cec_device()
+        self.power = "unknown"
+        self.power_source: Optional[str] = None
+        self.power_updated: Optional[float] = None
+        self.last_command: Optional[str] = None
+        self.last_rc: Optional[int] = None
+        self.monitor_running = False
+
+        self.g_queue_depth = Gauge(
+            "media_cec_queue_depth", "CEC commands waiting to be sent", registry=registry
+        )
+        self.g_power = Gauge(
+            "media_tv_power_state",
+            "TV power state as last seen on the CEC bus",
+            ["state"],
+            registry=registry,
+        )
+        self.c_commands = Counter(
+            "media_cec_commands",
+            "CEC commands processed by result",
+            ["command", "result"],
+            registry=registry,
+        )
+        self._publish_power()
+
+    @property
+    def device(self) -> str:
+        return str(self._device_path)
+
+    async def start(self) -> None:
+        self._tasks.append(asyncio.create_task(self._worker()))
+        if CEC_MONITOR_ENABLED:
+            self._tasks.append(asyncio.create_task(self._monitor()))
+        self.submit("power_status")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        if self._monitor_proc and self._monitor_proc.returncode is None:
+            self._monitor_proc.terminate()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def submit(self, name: str) -> asyncio.Future:
+        """Queue a named command; returns a future resolving to the exit code."""
+        group, args = CEC_COMMANDS[name]
+        pending = self._pending.get(group)
+        if pending is not None:
+            if pending.name != name:
+                logger.info("CEC %s supersedes queued %s", name, pending.name)
+                pending.name = name
+                pending.args = list(args)
+            self.c_commands.labels(command=name, result="deduplicated").inc()
+            return pending.future
+        loop = asyncio.get_running_loop()
+        cmd = CecCommand(name=name, group=group, args=list(args), future=loop.create_future())
+        self._pending[group] = cmd
+        self._queue.put_nowait(group)
+        self.g_queue_depth.set(len(self._pending))
+        return cmd.future
+
+    def status(self) -> dict:
+        return {
+            "device": self.device,
+            "power": self.power,
+            "power_source": self.power_source,
+            "power_updated": self.power_updated,
+            "queue_depth": len(self._pending),
+            "pending": sorted(cmd.name for cmd in self._pending.values()),
+            "last_command": self.last_command,
+            "last_rc": self.last_rc,
+            "monitor_running": self.monitor_running,
+        }
+
+    def _set_power(self, state: str, source: str) -> None:
+        if state not in POWER_STATES:
+            state = "unknown"
+        if state != self.power:
+            logger.info("TV power %s -> %s (%s)", self.power, state, source)
+        self.power = state
+        self.power_source = source
+        self.power_updated = time.time()
+        self._publish_power()
+
+    def _publish_power(self) -> None:
+        for state in POWER_STATES:
+            self.g_power.labels(state=state).set(1.0 if self.power == state else 0.0)
+
+    def _ensure_device(self) -> bool:
+        if not self._device_path.exists():
+            self._idx, self._device_path = resolve_cec_device()
+        return self._device_path.exists()
+
+    async def _worker(self) -> None:
+        while True:
+            group = await self._queue.get()
+            cmd = self._pending.pop(group, None)
+            self.g_queue_depth.set(len(self._pending))
+            if cmd is None:
+                continue
+            rc = 1
+            try:
+                rc = await self._run(cmd.args)
+                self.last_command = cmd.name
+                self.last_rc = rc
+                self.c_commands.labels(command=cmd.name, result="ok" if rc == 0 else "error").inc()
+                if rc == 0:
+                    if cmd.name == "power_on":
+                        self._set_power("to-on", "command")
+                    elif cmd.name == "power_off":
+                        self._set_power("to-standby", "command")
+                    if cmd.group == "power":
+                        asyncio.get_running_loop().call_later(
+                            CEC_POWER_REFRESH_DELAY, self.submit, "power_status"
+                        )
+            except asyncio.CancelledError:
+                if not cmd.future.done():
+                    cmd.future.cancel()
+                raise
+            except Exception:
+                # Keep serving the queue; the caller sees a failed command.
+                logger.exception("CEC command %s failed", cmd.name)
+                self.last_command, self.last_rc = cmd.name, rc
+                self.c_commands.labels(command=cmd.name, result="error").inc()
+            finally:
+                if not cmd.future.done():
+                    cmd.future.set_result(rc)
+
+    async def _run(self, args: List[str]) -> int:
+        cmd = ["cec-ctl", f"-d{self._idx}", *args]
+        cmd_str = " ".join(cmd)
+        if not self._ensure_device():
+            logger.error("CEC device %s not present; command skipped: %s", self._device_path, cmd_str)
+            return 1
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            logger.error("cec-ctl binary not found on PATH")
+            return 127
+        except OSError as exc:
+            logger.error("cec-ctl could not be started: %s", exc)
+            return 126
+        try:
+            _, stderr = await asyncio.wait_for(proc.communicate(), timeout=CEC_COMMAND_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            logger.error("cec-ctl timed out after %ss: %s", CEC_COMMAND_TIMEOUT, cmd_str)
+            return 124
+        if proc.returncode != 0:
+            text = stderr.decode("utf-8", errors="ignore").strip() if stderr else ""
+            if text:
+                logger.error("cec-ctl failed (rc=%s): %s", proc.returncode, text)
+            else:
+                logger.error("cec-ctl failed (rc=%s)", proc.returncode)
+        return proc.returncode
+
+    def handle_monitor_line(self, line: str, context: dict) -> None:
+        """Update cached TV state from one line of ``cec-ctl --monitor`` output."""
+        msg = _MSG_RE.search(line)
+        if msg:
+            context["op"] = msg.group("op")
+            context["src"] = msg.group("src")
+            context["dst"] = msg.group("dst")
+            op, src, dst = context["op"], context["src"], context["dst"]
+            if op == "STANDBY" and (src == "0" or dst in ("0", "15")):
+                self._set_power("standby", "bus")
+            elif op in ("IMAGE_VIEW_ON", "TEXT_VIEW_ON") and dst == "0":
+                self._set_power("to-on", "bus")
+            elif op in ("ROUTING_CHANGE", "SET_MENU_LANGUAGE") and src == "0":
+                # Only a powered TV originates these.
+                self._set_power("on", "bus")
+            return
+        pwr = _PWR_RE.search(line)
+        if pwr and context.get("op") == "REPORT_POWER_STATUS" and context.get("src") == "0":
+            self._set_power(pwr.group("state"), "bus")
+
+    async def _monitor(self) -> None:
+        backoff = 1.0
+        while True:
+            if not self._ensure_device():
+                await asyncio.sleep(min(backoff, 30.0))
+                backoff = min(backoff * 2, 30.0)
+                continue
+            try:
+                self._monitor_proc = await asyncio.create_subprocess_exec(
+                    "cec-ctl",
+                    f"-d{self._idx}",
+                    "--monitor",
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+            except FileNotFoundError:
+                logger.error("cec-ctl binary not found on PATH; CEC monitor disabled")
+                return
+            except OSError as exc:
+                # EACCES on the device, EMFILE, ...: transient, keep retrying.
+                logger.warning("failed to start cec-ctl monitor: %s; retrying", exc)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            self.monitor_running = True
+            context: dict = {}
+            started = time.monotonic()
+            try:
+                assert self._monitor_proc.stdout is not None
+                async for raw in self._monitor_proc.stdout:
+                    self.handle_monitor_line(raw.decode("utf-8", errors="ignore"), context)
+            finally:
+                self.monitor_running = False
+                if self._monitor_proc.returncode is None:
+                    self._monitor_proc.terminate()
+                await self._monitor_proc.wait()
+            logger.warning("cec-ctl monitor exited (rc=%s); restarting", self._monitor_proc.returncode)
+            if time.monotonic() - started > 60:
+                backoff = 1.0
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
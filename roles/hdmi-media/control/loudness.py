@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+
+LOUDNESS_ENABLED = os.environ.get("LOUDNESS_ANALYSIS", "1") == "1"
+# EBU R128 programme loudness; the TV's own volume sits on top of this.
+TARGET_LUFS = float(os.environ.get("LOUDNESS_TARGET_LUFS", "-23"))
+MAX_TRUE_PEAK_DBTP = float(os.environ.get("LOUDNESS_MAX_TRUE_PEAK_DBTP", "-1"))
+MAX_GAIN_DB = float(os.environ.get("LOUDNESS_MAX_GAIN_DB", "12"))
+ANALYSIS_TIMEOUT_SECONDS = float(os.environ.get("LOUDNESS_ANALYSIS_TIMEOUT_SECONDS", "1800"))
+SILENT_LUFS = -70.0
+
+logger = logging.getLogger("hdmi-media.loudness")
+
+_SUMMARY_RE = {
+    "integrated_lufs": re.compile(r"I:\s+(-?[\d.]+|-inf) LUFS"),
+    "lra_lu": re.compile(r"LRA:\s+(-?[\d.]+) LU"),
+    "true_peak_dbtp": re.compile(r"Peak:\s+(-?[\d.]+|-inf) dBFS"),
+}
+
+
+class LoudnessIndex:
+    """Sidecar JSON of per-file EBU R128 measurements and playback gains.
+
+    Entries are keyed by file name and carry the file's size and mtime, so a
+    file replaced behind the API's back plays without gain until re-analysed.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as handle:
+                data = json.load(handle)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _save(self, data: Dict[str, dict]) -> None:
+        # Same idiom as the audio role's common.save_json: a unique temp file
+        # so concurrent writers never replace each other's half-written file.
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{self.path.name}.", suffix=".tmp", dir=self.path.parent)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as handle:
+                json.dump(data, handle)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def entry(self, media: Path, index: Optional[Dict[str, dict]] = None) -> Optional[dict]:
+        """Entry for ``media``; pass ``index`` (from :meth:`load`) when looking up many files."""
+        entry = (self.load() if index is None else index).get(media.name)
+        try:
+            st = media.stat()
+        except OSError:
+            return None
+        if not isinstance(entry, dict):
+            return None
+        if entry.get("size") != st.st_size or entry.get("mtime") != int(st.st_mtime):
+            return None
+        return entry
+
+    def gain_db(self, media: Path) -> float:
+        entry = self.entry(media)
+        try:
+            return float(entry["gain_db"]) if entry else 0.0
+        except (KeyError, TypeError, ValueError):
+            return 0.0
+
+    def forget(self, media: Path) -> None:
+        with self._lock:
+            data = self.load()
+            if data.pop(media.name, None) is not None:
+                self._save(data)
+
+    def analyse(self, media: Path) -> Optional[dict]:
+        """Measure ``media`` once with ffmpeg's ebur128 filter and store its gain.
+
+        Blocking (decodes the whole audio track); run it off the event loop.
+        """
+        try:
+            st = media.stat()
+        except OSError:
+            return None
+        values = measure(media)
+        if values is None:
+            return None
+        entry = {
+            key: (round(value, 2) if value > float("-inf") else None) for key, value in values.items()
+        }
+        entry.update(
+            size=st.st_size,
+            mtime=int(st.st_mtime),
+            gain_db=gain_for(values),
+            target_lufs=TARGET_LUFS,
+            analysed_at=time.time(),
+        )
+        with self._lock:
+            data = self.load()
+            data[media.name] = entry
+            self._save(data)
+        logger.info("loudness %s: %s LUFS, gain %+.2f dB", media.name, entry["integrated_lufs"], entry["gain_db"])
+        return entry
+
+
+def parse_summary(output: str) -> Optional[Dict[str, float]]:
+    marker = output.rfind("Summary:")
+    if marker < 0:
+        return None
+    values: Dict[str, float] = {}
+    for key, pattern in _SUMMARY_RE.items():
+        match = pattern.search(output, marker)
+        if match is None:
+            return None
+        values[key] = float("-inf") if match.group(1) == "-inf" else float(match.group(1))
+    return values
+
+
+def measure(media: Path) -> Optional[Dict[str, float]]:
+    args = ["ffmpeg", "-hide_banner", "-nostats", "-i", str(media), "-vn", "-sn", "-dn",
+            "-af", "ebur128=peak=true", "-f", "null", "-"]
+    try:
+        proc = subprocess.run(args, capture_output=True, text=True, timeout=ANALYSIS_TIMEOUT_SECONDS)
+    except (OSError, subprocess.TimeoutExpired) as exc:
+        logger.warning("loudness analysis of %s failed: %s", media.name, exc)
+        return None
+    values = parse_summary(proc.stderr)
+    if proc.returncode != 0 or values is None:
+        # Also the case for files without an audio track.
+        logger.warning("loudness analysis of %s failed (exit %s)", media.name, proc.returncode)
+        return None
+    return values
+
+
+def gain_for(values: Dict[str, float]) -> float:
+    integrated = values["integrated_lufs"]
+    if integrated <= SILENT_LUFS:
+        return 0.0
+    gain = TARGET_LUFS - integrated
+    if values["true_peak_dbtp"] > float("-inf"):
+        gain = min(gain, MAX_TRUE_PEAK_DBTP - values["true_peak_dbtp"])
+    return round(max(-MAX_GAIN_DB, min(MAX_GAIN_DB, gain)), 2)
+
+
+def audio_filter(gain_db: float) -> str:
+    """mpv ``af`` value applying ``gain_db`` as a fixed libavfilter volume."""
+    return f"lavfi=[volume={gain_db:.2f}dB]" if gain_db else ""
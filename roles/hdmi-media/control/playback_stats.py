@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+
+logger = logging.getLogger("hdmi-media.playback")
+
+# Poll interval for drop counters between scrapes (0 = sample on scrape only).
+TELEMETRY_SECONDS = float(os.environ.get("MEDIA_TELEMETRY_SECONDS", "5"))
+# Distinct media labels kept; older ones are dropped from the counters.
+TELEMETRY_MAX_MEDIA = int(os.environ.get("MEDIA_TELEMETRY_MAX_MEDIA", "20"))
+
+PROPERTIES = (
+    "pause",
+    "path",
+    "frame-drop-count",
+    "decoder-frame-drop-count",
+    "estimated-vf-fps",
+    "container-fps",
+    "demuxer-cache-duration",
+    "cache-speed",
+    "hwdec-current",
+    "video-params",
+)
+
+MpvRequest = Callable[..., Awaitable[List[dict]]]
+
+
+def media_label(path: Optional[str]) -> str:
+    """Bounded label for what is playing: library file name, or URL scheme and host."""
+    if not path:
+        return "none"
+    if "://" in path:
+        parts = urlsplit(path)
+        return f"{parts.scheme}://{parts.hostname or ''}"
+    return os.path.basename(path) or "none"
+
+
+def _number(value: object) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+class PlaybackTelemetry:
+    """Playback quality counters and gauges read from mpv in batches.
+
+    Each sample fetches all ``PROPERTIES`` over one IPC connection. mpv's drop
+    counts restart with every file, so they are turned into monotonic
+    ``media_frames_dropped_total`` counters per media label. Gauges only carry
+    the label of what is playing now.
+    """
+
+    def __init__(self, registry: CollectorRegistry, request: MpvRequest):
+        self._request = request
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._path: Optional[str] = None
+        self._drops: Dict[str, int] = {}
+        self._media: "OrderedDict[str, None]" = OrderedDict()
+        self.latest: Dict[str, object] = {}
+
+        self.g_playing = Gauge(
+            "media_playing", "MPV playing state (1=playing,0=paused/stopped)", registry=registry
+        )
+        self.c_dropped = Counter(
+            "media_frames_dropped",
+            "Frames dropped by mpv (stage=output: video output, decoder: decoder)",
+            ["media", "stage"],
+            registry=registry,
+        )
+        self.g_fps = Gauge(
+            "media_estimated_vf_fps",
+            "Frame rate mpv estimates at the video filter output",
+            ["media"],
+            registry=registry,
+        )
+        self.g_fps_ratio = Gauge(
+            "media_fps_ratio",
+            "Estimated output fps divided by the container fps",
+            ["media"],
+            registry=registry,
+        )
+        self.g_cache = Gauge(
+            "media_demuxer_cache_seconds",
+            "Seconds of media buffered ahead by the demuxer",
+            ["media"],
+            registry=registry,
+        )
+        self.g_cache_speed = Gauge(
+            "media_cache_speed_bytes",
+            "Bytes per second currently read into the cache",
+            ["media"],
+            registry=registry,
+        )
+        self.g_video = Gauge(
+            "media_video_info",
+            "Video being played (always 1): hardware decoder, pixel format, resolution",
+            ["media", "hwdec", "pixelformat", "resolution"],
+            registry=registry,
+        )
+
+    async def start(self) -> None:
+        if TELEMETRY_SECONDS > 0:
+            self._task = asyncio.create_task(self._poll())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                await self.sample()
+            except Exception as exc:  # mpv restarting, socket missing
+                logger.debug("playback telemetry sample failed: %s", exc)
+            await asyncio.sleep(TELEMETRY_SECONDS)
+
+    async def sample(self) -> Dict[str, object]:
+        """Read all properties in one batch and update the metrics."""
+        async with self._lock:
+            replies = await self._request(
+                *({"command": ["get_property", name]} for name in PROPERTIES)
+            )
+            props = {name: reply.get("data") for name, reply in zip(PROPERTIES, replies)}
+            self._update(props)
+            return self.latest
+
+    def _label(self, path: Optional[str]) -> str:
+        label = media_label(path)
+        if label in self._media:
+            self._media.move_to_end(label)
+            return label
+        self._media[label] = None
+        while len(self._media) > TELEMETRY_MAX_MEDIA:
+            old, _ = self._media.popitem(last=False)
+            for stage in ("output", "decoder"):
+                try:
+                    self.c_dropped.remove(old, stage)
+                except KeyError:
+                    pass
+        return label
+
+    def _update(self, props: Dict[str, object]) -> None:
+        path = props.get("path") if isinstance(props.get("path"), str) else None
+        playing = path is not None and props.get("pause") is False
+        self.g_playing.set(1.0 if playing else 0.0)
+
+        if path != self._path:
+            # New file: mpv's counters restart, and the old file's gauges go.
+            self._path = path
+            self._drops = {}
+            for gauge in (self.g_fps, self.g_fps_ratio, self.g_cache, self.g_cache_speed, self.g_video):
+                gauge.clear()
+        if path is None:
+            self.latest = {"media": None}
+            return
+
+        label = self._label(path)
+        drops = {
+            "output": _number(props.get("frame-drop-count")),
+            "decoder": _number(props.get("decoder-frame-drop-count")),
+        }
+        for stage, value in drops.items():
+            if value is None:
+                continue
+            count = int(value)
+            previous = self._drops.get(stage, 0)
+            # A lower count means mpv reloaded the file (loop, playlist repeat).
+            delta = count - previous if count >= previous else count
+            if delta > 0:
+                self.c_dropped.labels(media=label, stage=stage).inc(delta)
+            self._drops[stage] = count
+
+        fps = _number(props.get("estimated-vf-fps"))
+        container_fps = _number(props.get("container-fps"))
+        cache = _number(props.get("demuxer-cache-duration"))
+        speed = _number(props.get("cache-speed"))
+        if fps is not None:
+            self.g_fps.labels(media=label).set(fps)
+            if container_fps:
+                self.g_fps_ratio.labels(media=label).set(fps / container_fps)
+        if cache is not None:
+            self.g_cache.labels(media=label).set(cache)
+        if speed is not None:
+            self.g_cache_speed.labels(media=label).set(speed)
+
+        params = props.get("video-params") if isinstance(props.get("video-params"), dict) else {}
+        hwdec = props.get("hwdec-current") or "no"
+        pixelformat = params.get("hw-pixelformat") or params.get("pixelformat") or "unknown"
+        resolution = f"{params['w']}x{params['h']}" if params.get("w") and params.get("h") else "unknown"
+        self.g_video.clear()
+        self.g_video.labels(
+            media=label, hwdec=str(hwdec), pixelformat=str(pixelformat), resolution=resolution
+        ).set(1.0)
+
+        self.latest = {
+            "media": label,
+            "frames_dropped": drops["output"],
+            "decoder_frames_dropped": drops["decoder"],
+            "estimated_vf_fps": fps,
+            "container_fps": container_fps,
+            "demuxer_cache_seconds": cache,
+            "cache_speed_bytes": speed,
+            "hwdec": hwdec,
+            "pixelformat": pixelformat,
+            "resolution": resolution,
+        }
@@ -0,0 +1,420 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+
+logger = logging.getLogger("hdmi-media.prefetch")
+
+PREFETCH_ENABLED = os.environ.get("MEDIA_PREFETCH_ENABLED", "0") == "1"
+# Download remote URLs on /play as well as on explicit /prefetch calls.
+PREFETCH_ON_PLAY = os.environ.get("MEDIA_PREFETCH_ON_PLAY", "1") == "1"
+PREFETCH_MAX_MB = int(os.environ.get("MEDIA_PREFETCH_MAX_MB", "4096"))
+# Larger files (and responses without a length, i.e. live streams) stream as before.
+PREFETCH_MAX_FILE_MB = int(os.environ.get("MEDIA_PREFETCH_MAX_FILE_MB", "2048"))
+PREFETCH_CONCURRENCY = int(os.environ.get("MEDIA_PREFETCH_CONCURRENCY", "1"))
+PREFETCH_ATTEMPTS = int(os.environ.get("MEDIA_PREFETCH_ATTEMPTS", "5"))
+PREFETCH_TIMEOUT = float(os.environ.get("MEDIA_PREFETCH_TIMEOUT", "30"))
+# mpv runs on the host, not in this container: the cache directory as the
+# host sees it (the bind mount source). Empty when both share one filesystem.
+PREFETCH_HOST_DIR = os.environ.get("MEDIA_PREFETCH_HOST_DIR", "")
+# URLs found uncacheable (no length, live) or too large are not requested
+# again from the origin until this long after the verdict.
+PREFETCH_RETRY_SECONDS = float(os.environ.get("MEDIA_PREFETCH_RETRY_SECONDS", "3600"))
+# Cache hits only reorder the LRU; their index write is batched.
+INDEX_SAVE_DELAY = 5.0
+FINAL_STATES = ("uncacheable", "too_large")
+CHUNK_BYTES = 256 * 1024
+SCHEMES = ("http", "https")
+# Manifests only list segments; caching them would not help.
+STREAMING_SUFFIXES = (".m3u8", ".mpd")
+STREAMING_TYPES = ("mpegurl", "dash+xml")
+
+_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class PrefetchError(Exception):
+    pass
+
+
+def cache_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def cacheable(url: str) -> bool:
+    parts = urlsplit(url)
+    if parts.scheme not in SCHEMES or not parts.hostname:
+        return False
+    return not parts.path.lower().endswith(STREAMING_SUFFIXES)
+
+
+class Entry:
+    """One cached URL: ``<key><suffix>`` when complete, ``<key>.part`` while downloading."""
+
+    def __init__(self, url: str, key: str, suffix: str):
+        self.url = url
+        self.key = key
+        self.suffix = suffix
+        self.size: Optional[int] = None
+        self.validator: Optional[str] = None
+        self.complete = False
+        self.last_used = time.time()
+        self.state = "queued"
+        self.error: Optional[str] = None
+        # When the last download ended; not persisted.
+        self.finished = 0.0
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Entry":
+        entry = cls(str(data["url"]), str(data["key"]), str(data.get("suffix", "")))
+        entry.size = data.get("size")
+        entry.validator = data.get("validator")
+        entry.complete = bool(data.get("complete"))
+        entry.last_used = float(data.get("last_used", 0))
+        entry.state = "cached" if entry.complete else "partial"
+        return entry
+
+    def as_dict(self) -> dict:
+        return {
+            "url": self.url,
+            "key": self.key,
+            "suffix": self.suffix,
+            "size": self.size,
+            "validator": self.validator,
+            "complete": self.complete,
+            "last_used": self.last_used,
+        }
+
+
+class PrefetchCache:
+    """Size-bounded LRU of remote media copied into ``cache_dir``.
+
+    Downloads run in the background with HTTP range requests, so an
+    interrupted transfer (Wi-Fi drop, restart) resumes from the bytes already
+    on disk; ``If-Range`` restarts it when the server's copy changed. Only
+    complete files are handed to mpv. Least recently played entries are
+    evicted to make room before a download starts.
+    """
+
+    def __init__(self, cache_dir: Path, registry: CollectorRegistry):
+        self.cache_dir = cache_dir
+        self.index_path = cache_dir / "index.json"
+        self.max_bytes = PREFETCH_MAX_MB * 1024 * 1024
+        self.max_file_bytes = PREFETCH_MAX_FILE_MB * 1024 * 1024
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._slots = asyncio.Semaphore(max(1, PREFETCH_CONCURRENCY))
+        self._client: Optional[httpx.AsyncClient] = None
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+
+        self.c_requests = Counter(
+            "media_prefetch_requests",
+            "Remote /play URLs by cache result (hit, miss, bypass)",
+            ["result"],
+            registry=registry,
+        )
+        self.c_downloaded = Counter(
+            "media_prefetch_downloaded_bytes",
+            "Bytes downloaded into the prefetch cache",
+            registry=registry,
+        )
+        self.c_served = Counter(
+            "media_prefetch_served_bytes",
+            "Bytes of cached files handed to mpv instead of streaming them",
+            registry=registry,
+        )
+        self.c_downloads = Counter(
+            "media_prefetch_downloads",
+            "Finished downloads by result (complete, failed, too_large, uncacheable, cancelled)",
+            ["result"],
+            registry=registry,
+        )
+        self.c_evictions = Counter(
+            "media_prefetch_evictions",
+            "Cached files removed to stay under MEDIA_PREFETCH_MAX_MB",
+            registry=registry,
+        )
+        self.g_bytes = Gauge(
+            "media_prefetch_cache_bytes", "Bytes on disk in the prefetch cache", registry=registry
+        )
+        self.g_bytes.set_function(self.usage)
+        self.g_entries = Gauge(
+            "media_prefetch_cache_entries", "Complete files in the prefetch cache", registry=registry
+        )
+        self.g_entries.set_function(lambda: sum(1 for e in self._entries.values() if e.complete))
+        self.g_in_flight = Gauge(
+            "media_prefetch_in_flight", "Downloads queued or running", registry=registry
+        )
+        self.g_in_flight.set_function(lambda: len(self._tasks))
+
+    async def start(self) -> None:
+        if not PREFETCH_ENABLED:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(PREFETCH_TIMEOUT, connect=10.0),
+            follow_redirects=True,
+        )
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._save()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _load(self) -> None:
+        try:
+            data = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            data = []
+        entries = []
+        for item in data if isinstance(data, list) else []:
+            try:
+                entries.append(Entry.from_dict(item))
+            except (KeyError, TypeError, ValueError):
+                continue
+        known = set()
+        for entry in sorted(entries, key=lambda e: e.last_used):
+            path = self._path(entry)
+            if not path.exists():
+                continue
+            if entry.complete and entry.size is not None and path.stat().st_size != entry.size:
+                path.unlink(missing_ok=True)
+                continue
+            self._entries[entry.key] = entry
+            known.add(path.name)
+        # Files the index does not know about (crash before save) are dropped.
+        for stray in self.cache_dir.iterdir():
+            if stray.name not in known and stray != self.index_path:
+                stray.unlink(missing_ok=True)
+
+    def _save(self) -> None:
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        if not PREFETCH_ENABLED:
+            return
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps([entry.as_dict() for entry in self._entries.values()]))
+        os.replace(tmp, self.index_path)
+
+    def _path(self, entry: Entry) -> Path:
+        name = entry.key + entry.suffix if entry.complete else entry.key + ".part"
+        return self.cache_dir / name
+
+    def _on_disk(self, entry: Entry) -> int:
+        try:
+            return self._path(entry).stat().st_size
+        except OSError:
+            return 0
+
+    def usage(self) -> int:
+        return sum(self._on_disk(entry) for entry in self._entries.values())
+
+    def lookup(self, url: str) -> Optional[Path]:
+        """Player-visible path of ``url``'s local copy if it is fully cached; counts the hit or miss."""
+        if not PREFETCH_ENABLED or "://" not in url:
+            return None
+        if not cacheable(url):
+            self.c_requests.labels(result="bypass").inc()
+            return None
+        entry = self._entries.get(cache_key(url))
+        if entry is None or not entry.complete:
+            self.c_requests.labels(result="miss").inc()
+            return None
+        path = self._path(entry)
+        if not path.exists():
+            del self._entries[entry.key]
+            self.c_requests.labels(result="miss").inc()
+            return None
+        entry.last_used = time.time()
+        self._entries.move_to_end(entry.key)
+        self.c_requests.labels(result="hit").inc()
+        self.c_served.inc(entry.size or 0)
+        if self._save_handle is None:
+            self._save_handle = asyncio.get_running_loop().call_later(INDEX_SAVE_DELAY, self._save)
+        return Path(PREFETCH_HOST_DIR) / path.name if PREFETCH_HOST_DIR else path
+
+    def status(self, url: str) -> Optional[dict]:
+        entry = self._entries.get(cache_key(url))
+        return self._describe(entry) if entry else None
+
+    def entries(self) -> List[dict]:
+        return [self._describe(entry) for entry in reversed(self._entries.values())]
+
+    def _describe(self, entry: Entry) -> dict:
+        return {
+            "url": entry.url,
+            "state": entry.state,
+            "size": entry.size,
+            "downloaded": self._on_disk(entry),
+            "last_used": entry.last_used,
+            "error": entry.error,
+        }
+
+    def fetch(self, url: str) -> dict:
+        """Start (or join) a background download of ``url``."""
+        if not PREFETCH_ENABLED:
+            raise PrefetchError("prefetch cache disabled")
+        if not cacheable(url):
+            raise PrefetchError("only http(s) files can be prefetched, not stream manifests")
+        key = cache_key(url)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = Entry(url, key, PurePosixPath(urlsplit(url).path).suffix.lower()[:8])
+            self._entries[key] = entry
+        if entry.state in FINAL_STATES and time.time() - entry.finished < PREFETCH_RETRY_SECONDS:
+            return self._describe(entry)
+        if not entry.complete and key not in self._tasks:
+            entry.state, entry.error = "queued", None
+            task = asyncio.create_task(self._download(entry))
+            self._tasks[key] = task
+            # remove() may cancel this task and a new fetch() store its own
+            # before the callback runs; only drop our own entry.
+            task.add_done_callback(
+                lambda t, k=key: self._tasks.pop(k) if self._tasks.get(k) is t else None
+            )
+        return self._describe(entry)
+
+    def remove(self, url: str) -> bool:
+        key = cache_key(url)
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        for path in (self.cache_dir / (key + entry.suffix), self.cache_dir / (key + ".part")):
+            path.unlink(missing_ok=True)
+        self._save()
+        return True
+
+    def _make_room(self, needed: int, keep: Entry) -> None:
+        used = self.usage()
+        for entry in list(self._entries.values()):
+            if used + needed <= self.max_bytes:
+                break
+            if entry is keep or entry.key in self._tasks:
+                continue
+            freed = self._on_disk(entry)
+            self._path(entry).unlink(missing_ok=True)
+            del self._entries[entry.key]
+            if freed:
+                used -= freed
+                self.c_evictions.inc()
+                logger.info("evicted %s (%d bytes)", entry.url, freed)
+        if used + needed > self.max_bytes:
+            raise PrefetchError("cache full with downloads in progress")
+
+    async def _download(self, entry: Entry) -> None:
+        result = "failed"
+        try:
+            async with self._slots:
+                entry.state = "downloading"
+                for attempt in range(1, PREFETCH_ATTEMPTS + 1):
+                    try:
+                        if await self._transfer(entry):
+                            result = "complete"
+                            break
+                    except (httpx.HTTPError, OSError) as exc:
+                        entry.error = str(exc) or type(exc).__name__
+                    # The next attempt resumes from what reached the disk.
+                    logger.warning("prefetch %s attempt %d: %s", entry.url, attempt, entry.error)
+                    if attempt < PREFETCH_ATTEMPTS:
+                        await asyncio.sleep(min(30, 2 ** attempt))
+        except asyncio.CancelledError:
+            result = "cancelled"
+            raise
+        except PrefetchError as exc:
+            entry.error = str(exc)
+            result = entry.state if entry.state in ("too_large", "uncacheable") else "failed"
+        finally:
+            if result == "complete":
+                entry.state, entry.error = "cached", None
+            elif result != "cancelled":
+                entry.state = result
+            entry.finished = time.time()
+            self.c_downloads.labels(result=result).inc()
+            self._save()
+
+    async def _transfer(self, entry: Entry) -> bool:
+        """One ranged GET continuing ``<key>.part``; True once the file is complete."""
+        if self._client is None:
+            raise PrefetchError("prefetch cache not started")
+        part = self.cache_dir / (entry.key + ".part")
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            if entry.validator:
+                headers["If-Range"] = entry.validator
+        async with self._client.stream("GET", entry.url, headers=headers) as response:
+            if response.status_code == 416 and offset:
+                if offset == entry.size:
+                    return self._finish(entry, part)
+                # The partial file no longer matches the server's; start over.
+                part.unlink(missing_ok=True)
+                entry.error = "range not satisfiable"
+                return False
+            if 400 <= response.status_code < 500:
+                raise PrefetchError(f"HTTP {response.status_code}")
+            response.raise_for_status()
+            content_type = response.headers.get("content-type", "").lower()
+            if any(kind in content_type for kind in STREAMING_TYPES):
+                entry.state = "uncacheable"
+                raise PrefetchError(f"stream manifest ({content_type})")
+            if response.status_code == 206:
+                match = _RANGE_RE.match(response.headers.get("content-range", ""))
+                if match is None or int(match.group(1)) != offset or match.group(3) == "*":
+                    raise PrefetchError("unusable Content-Range in resumed response")
+                total = int(match.group(3))
+                mode = "ab"
+            else:
+                # Full body: first request, no range support, or If-Range mismatch.
+                length = response.headers.get("content-length")
+                if length is None:
+                    entry.state = "uncacheable"
+                    raise PrefetchError("response has no length (live stream?)")
+                total, offset, mode = int(length), 0, "wb"
+            if total > self.max_file_bytes:
+                entry.state = "too_large"
+                raise PrefetchError(f"{total} bytes exceeds MEDIA_PREFETCH_MAX_FILE_MB")
+            entry.size = total
+            entry.validator = response.headers.get("etag") or response.headers.get("last-modified")
+            self._make_room(total - offset, keep=entry)
+            self._save()
+            with open(part, mode) as handle:
+                async for chunk in response.aiter_bytes(CHUNK_BYTES):
+                    await asyncio.to_thread(handle.write, chunk)
+                    self.c_downloaded.inc(len(chunk))
+        received = part.stat().st_size
+        if received < total:
+            entry.error = f"connection closed at {received}/{total} bytes"
+            return False
+        return self._finish(entry, part)
+
+    def _finish(self, entry: Entry, part: Path) -> bool:
+        if part.stat().st_size != entry.size:
+            part.unlink(missing_ok=True)
+            raise PrefetchError("downloaded size does not match the server's")
+        os.replace(part, self.cache_dir / (entry.key + entry.suffix))
+        entry.complete = True
+        entry.last_used = time.time()
+        self._entries.move_to_end(entry.key)
+        logger.info("prefetched %s (%d bytes)", entry.url, entry.size)
+        return True
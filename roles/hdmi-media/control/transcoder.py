@@ -0,0 +1,343 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional
+
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+
+logger = logging.getLogger("hdmi-media.transcode")
+
+TRANSCODE_ENABLED = os.environ.get("MEDIA_TRANSCODE_ENABLED", "0") == "1"
+# Device profile: anything outside it is re-encoded. The defaults are what
+# the Pi's H.264 hardware decoder handles (8-bit 4:2:0, up to 1080p).
+TRANSCODE_CODEC = os.environ.get("MEDIA_TRANSCODE_CODEC", "h264")
+TRANSCODE_ENCODER = os.environ.get("MEDIA_TRANSCODE_ENCODER", "libx264")
+TRANSCODE_MAX_WIDTH = int(os.environ.get("MEDIA_TRANSCODE_MAX_WIDTH", "1920"))
+TRANSCODE_MAX_HEIGHT = int(os.environ.get("MEDIA_TRANSCODE_MAX_HEIGHT", "1080"))
+TRANSCODE_MAX_FPS = float(os.environ.get("MEDIA_TRANSCODE_MAX_FPS", "60"))
+TRANSCODE_MAX_KBPS = int(os.environ.get("MEDIA_TRANSCODE_MAX_KBPS", "10000"))
+TRANSCODE_PRESET = os.environ.get("MEDIA_TRANSCODE_PRESET", "veryfast")
+TRANSCODE_THREADS = int(os.environ.get("MEDIA_TRANSCODE_THREADS", "2"))
+TRANSCODE_NICE = int(os.environ.get("MEDIA_TRANSCODE_NICE", "19"))
+TRANSCODE_JOB_HISTORY = 50
+PIXEL_FORMATS = ("yuv420p", "yuvj420p")
+AUDIO_COPY_CODECS = ("aac", "mp3")
+WORK_DIR_NAME = ".transcode"
+
+
+def _rate(value: object) -> float:
+    try:
+        num, _, den = str(value).partition("/")
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def _fingerprint(path: Path) -> Optional[tuple]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def reasons_for(probe: dict) -> List[str]:
+    """Why a file falls outside the device profile (empty when it fits)."""
+    streams = probe.get("streams") or []
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    if video is None:
+        return []
+    reasons = []
+    if video.get("codec_name") != TRANSCODE_CODEC:
+        reasons.append(f"codec {video.get('codec_name')}")
+    width, height = int(video.get("width") or 0), int(video.get("height") or 0)
+    if width > TRANSCODE_MAX_WIDTH or height > TRANSCODE_MAX_HEIGHT:
+        reasons.append(f"resolution {width}x{height}")
+    if video.get("pix_fmt") not in PIXEL_FORMATS:
+        reasons.append(f"pixel format {video.get('pix_fmt')}")
+    fps = _rate(video.get("avg_frame_rate"))
+    if TRANSCODE_MAX_FPS > 0 and fps > TRANSCODE_MAX_FPS + 0.5:
+        reasons.append(f"frame rate {fps:.0f}")
+    bitrate = int(video.get("bit_rate") or (probe.get("format") or {}).get("bit_rate") or 0)
+    if TRANSCODE_MAX_KBPS > 0 and bitrate > TRANSCODE_MAX_KBPS * 1000:
+        reasons.append(f"bitrate {bitrate // 1000} kbps")
+    return reasons
+
+
+def transcode_args(source: Path, target: Path, probe: dict) -> List[str]:
+    streams = probe.get("streams") or []
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    filters = [
+        f"scale='min({TRANSCODE_MAX_WIDTH},iw)':'min({TRANSCODE_MAX_HEIGHT},ih)'"
+        ":force_original_aspect_ratio=decrease:force_divisible_by=2",
+        "format=yuv420p",
+    ]
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    if TRANSCODE_MAX_FPS > 0 and _rate(video.get("avg_frame_rate")) > TRANSCODE_MAX_FPS + 0.5:
+        filters.append(f"fps={TRANSCODE_MAX_FPS:g}")
+    args = [
+        "ffmpeg", "-hide_banner", "-nostats", "-loglevel", "error", "-y",
+        "-threads", str(TRANSCODE_THREADS),
+        "-i", str(source),
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", ",".join(filters),
+        "-c:v", TRANSCODE_ENCODER,
+    ]
+    if TRANSCODE_ENCODER == "libx264":
+        args += ["-preset", TRANSCODE_PRESET, "-crf", "21", "-profile:v", "high", "-level", "4.1"]
+    if TRANSCODE_MAX_KBPS > 0:
+        # x264 keeps CRF quality under a VBV cap; other encoders get a target.
+        rate_flag = "-maxrate" if TRANSCODE_ENCODER == "libx264" else "-b:v"
+        args += [rate_flag, f"{TRANSCODE_MAX_KBPS}k", "-bufsize", f"{TRANSCODE_MAX_KBPS * 2}k"]
+    if audio is not None and audio.get("codec_name") in AUDIO_COPY_CODECS:
+        args += ["-c:a", "copy"]
+    else:
+        args += ["-c:a", "aac", "-b:a", "192k"]
+    args += ["-movflags", "+faststart", "-progress", "pipe:1", str(target)]
+    return args
+
+
+class TranscodeJob:
+    def __init__(self, job_id: int, path: Path):
+        self.id = job_id
+        self.path = path
+        self.fingerprint = _fingerprint(path)
+        self.state = "queued"
+        self.reasons: List[str] = []
+        self.progress = 0.0
+        self.output: Optional[str] = None
+        self.error: Optional[str] = None
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "filename": self.path.name,
+            "state": self.state,
+            "reasons": self.reasons,
+            "progress": round(self.progress, 3),
+            "output": self.output,
+            "error": self.error,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class Transcoder:
+    """Background queue converting library uploads to the device profile.
+
+    One job runs at a time under ``nice``. Each upload is probed with
+    ffprobe and only re-encoded when it falls outside the profile. The result
+    is written to a hidden work directory on the same filesystem and moved
+    over the original with ``os.replace``, so mpv and ``/library`` only ever
+    see a complete file. Uploads that change while their job runs are left
+    alone.
+    """
+
+    def __init__(
+        self,
+        library_dir: Path,
+        registry: CollectorRegistry,
+        on_replaced: Optional[Callable[[Path, Path], Awaitable[None]]] = None,
+    ):
+        self.library_dir = library_dir
+        self.work_dir = library_dir / WORK_DIR_NAME
+        self.on_replaced = on_replaced
+        self._queue: "asyncio.Queue[TranscodeJob]" = asyncio.Queue()
+        self._jobs: "OrderedDict[int, TranscodeJob]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._task: Optional[asyncio.Task] = None
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._current: Optional[TranscodeJob] = None
+
+        self.g_queue = Gauge(
+            "media_transcode_queue_depth", "Library files waiting to be probed/transcoded", registry=registry
+        )
+        self.g_queue.set_function(self._queue.qsize)
+        self.g_progress = Gauge(
+            "media_transcode_progress", "Progress of the running transcode (0-1)", registry=registry
+        )
+        self.c_jobs = Counter(
+            "media_transcode_jobs",
+            "Finished library jobs by result (transcoded, skipped, failed, superseded, cancelled)",
+            ["result"],
+            registry=registry,
+        )
+        self.c_seconds = Counter(
+            "media_transcode_seconds",
+            "Wall-clock seconds spent transcoding",
+            registry=registry,
+        )
+
+    async def start(self) -> None:
+        if TRANSCODE_ENABLED:
+            self.work_dir.mkdir(parents=True, exist_ok=True)
+            for stale in self.work_dir.glob("*"):
+                stale.unlink(missing_ok=True)
+            self._task = asyncio.create_task(self._worker())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await self._kill()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def submit(self, path: Path) -> Optional[TranscodeJob]:
+        if not TRANSCODE_ENABLED:
+            return None
+        job = TranscodeJob(next(self._ids), path)
+        self._jobs[job.id] = job
+        while len(self._jobs) > TRANSCODE_JOB_HISTORY:
+            oldest = next(iter(self._jobs.values()))
+            if oldest.state in ("queued", "probing", "transcoding"):
+                break
+            self._jobs.popitem(last=False)
+        self._queue.put_nowait(job)
+        return job
+
+    def cancel(self, path: Path) -> None:
+        """Drop queued or running work for ``path`` (deleted from the library)."""
+        for job in self._jobs.values():
+            if job.path == path and job.state == "queued":
+                job.state = "cancelled"
+        current = self._current
+        if current is not None and current.path == path:
+            current.state = "cancelled"
+            if self._proc is not None and self._proc.returncode is None:
+                self._proc.terminate()
+
+    def jobs(self) -> List[dict]:
+        # Snapshot first: the sync routes call this from a threadpool thread.
+        return [job.as_dict() for job in reversed(list(self._jobs.values()))]
+
+    def job(self, job_id: int) -> Optional[dict]:
+        job = self._jobs.get(job_id)
+        return job.as_dict() if job else None
+
+    def latest_for(self, name: str) -> Optional[dict]:
+        for job in reversed(list(self._jobs.values())):
+            if name in (job.path.name, job.output):
+                return job.as_dict()
+        return None
+
+    async def _kill(self) -> None:
+        proc = self._proc
+        if proc is not None and proc.returncode is None:
+            proc.terminate()
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                proc.kill()
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            if job.state == "cancelled":
+                continue
+            self._current = job
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                # cancel() terminates the running ffprobe/ffmpeg; that exit
+                # is not a failure.
+                if job.state != "cancelled":
+                    job.state, job.error = "failed", str(exc)
+                    logger.exception("transcode of %s failed", job.path.name)
+            finally:
+                self._current = None
+                self._proc = None
+                self.g_progress.set(0)
+                if job.finished is None:
+                    job.finished = time.time()
+                self.c_jobs.labels(result=job.state).inc()
+
+    async def _spawn(self, *args: str, **kwargs) -> asyncio.subprocess.Process:
+        cmd = list(args)
+        if TRANSCODE_NICE:
+            cmd = ["nice", "-n", str(TRANSCODE_NICE), *cmd]
+        self._proc = await asyncio.create_subprocess_exec(*cmd, **kwargs)
+        return self._proc
+
+    async def _probe(self, path: Path) -> dict:
+        proc = await self._spawn(
+            "ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", str(path),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        out, _ = await proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError("ffprobe failed")
+        return json.loads(out or b"{}")
+
+    async def _run(self, job: TranscodeJob) -> None:
+        job.started = time.time()
+        job.state = "probing"
+        probe = await self._probe(job.path)
+        if job.state == "cancelled":
+            return
+        job.reasons = reasons_for(probe)
+        if not job.reasons:
+            job.state, job.progress = "skipped", 1.0
+            return
+        target = job.path.with_suffix(".mp4")
+        if target != job.path and target.exists():
+            job.state, job.error = "failed", f"{target.name} already exists"
+            return
+
+        job.state = "transcoding"
+        duration = float((probe.get("format") or {}).get("duration") or 0)
+        tmp = self.work_dir / f"{job.id}-{target.name}"
+        logger.info("transcoding %s (%s)", job.path.name, ", ".join(job.reasons))
+        started = time.monotonic()
+        proc = await self._spawn(
+            *transcode_args(job.path, tmp, probe),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        assert proc.stdout is not None and proc.stderr is not None
+
+        async def progress() -> None:
+            async for line in proc.stdout:
+                key, _, value = line.decode(errors="replace").strip().partition("=")
+                if key == "out_time_us" and duration > 0 and value.isdigit():
+                    job.progress = min(int(value) / 1e6 / duration, 0.99)
+                    self.g_progress.set(job.progress)
+
+        # Drain both pipes together: a chatty stderr must not fill its pipe
+        # and stall ffmpeg while we wait for stdout EOF.
+        _, stderr = await asyncio.gather(progress(), proc.stderr.read())
+        await proc.wait()
+        self.c_seconds.inc(time.monotonic() - started)
+        if job.state == "cancelled":
+            tmp.unlink(missing_ok=True)
+            return
+        if proc.returncode != 0:
+            tmp.unlink(missing_ok=True)
+            job.state = "failed"
+            job.error = stderr.decode(errors="replace").strip()[-300:] or f"ffmpeg exit {proc.returncode}"
+            return
+        # Re-uploaded or deleted meanwhile: the new file wins.
+        if _fingerprint(job.path) != job.fingerprint or (target != job.path and target.exists()):
+            tmp.unlink(missing_ok=True)
+            job.state = "superseded"
+            return
+        os.replace(tmp, target)
+        if target != job.path:
+            job.path.unlink(missing_ok=True)
+        job.state, job.progress, job.output = "transcoded", 1.0, target.name
+        job.finished = time.time()
+        logger.info("transcoded %s -> %s", job.path.name, target.name)
+        if self.on_replaced is not None:
+            await self.on_replaced(job.path, target)
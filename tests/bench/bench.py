@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""Load-test the device control services against stand-in backends.
+
+Each service (audio ``control.py`` and ``control_snapcast.py``, hdmi-media
+``app.py``, camera ``app.py``) is started from the working tree with its
+hardware replaced by ``fakes.py``:
+
+- mpv is a JSON IPC server on a unix socket.
+- ffmpeg, ffprobe, amixer, aplay, cec-ctl and docker are fake executables
+  first on PATH.
+- The Docker API is a stub socket.
+- The camera's HLS/RTSP source is a local server streaming RTP.
+
+Every scenario runs for ``--duration`` seconds at ``--concurrency``
+keep-alive clients, using the ``fleet_health`` connection pool. It reports
+throughput, p50/p90/p99/max latency, service CPU per request and RSS.
+
+``--output`` writes the JSON report. ``--baseline`` compares against an
+earlier report and lists regressions beyond ``--tolerance``. Exit status:
+0 when the run succeeds without regressions, 2 on regressions or failed
+requests, 1 on usage or startup errors.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import platform
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+REPO = pathlib.Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO / "agent" / "lib"))
+
+from fleet_health import HttpError, HttpPool  # noqa: E402
+
+FAKES = pathlib.Path(__file__).resolve().parent / "fakes.py"
+FAKE_EXECUTABLES = ("amixer", "aplay", "cec-ctl", "docker", "ffmpeg", "ffprobe")
+TOKEN = "bench-token"
+REPORT_VERSION = 1
+EXIT_REGRESSION = 2
+
+# Differences below these floors are noise, whatever the relative change.
+NOISE_FLOOR = {"p50_ms": 1.0, "p99_ms": 2.0, "cpu_ms_per_request": 0.5, "rss_peak_kb": 2048}
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: str
+    body: Optional[Dict[str, Any]] = None
+    ok: Tuple[int, ...] = (200, 201)
+
+
+@dataclass
+class Service:
+    name: str
+    cwd: str
+    argv: List[str]
+    env: Dict[str, str]
+    scenarios: List[Scenario]
+    backends: Tuple[str, ...] = ()
+    health_path: str = "/healthz"
+
+
+def _uvicorn(port_placeholder: str = "{port}") -> List[str]:
+    return ["-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", port_placeholder,
+            "--log-level", "warning", "--no-access-log"]
+
+
+SERVICES: Dict[str, Service] = {
+    service.name: service
+    for service in (
+        Service(
+            name="audio-control",
+            cwd="roles/audio-player/docker/app",
+            argv=["control.py"],
+            env={"CONTROL_BIND": "127.0.0.1", "CONTROL_PORT": "{port}", "AUDIO_DATA_DIR": "{work}/audio",
+                 "AUTH_TOKEN": TOKEN, "MIXER_CARD": "0"},
+            scenarios=[
+                Scenario("status", "GET", "/status"),
+                Scenario("metrics", "GET", "/metrics"),
+                Scenario("volume", "POST", "/volume", {"volume": 0.8}),
+                Scenario("hwvolume_get", "GET", "/hwvolume"),
+                Scenario("hwvolume_set", "POST", "/hwvolume", {"volume_percent": 60}),
+            ],
+        ),
+        Service(
+            name="audio-control-snapcast",
+            cwd="roles/audio-player/docker/app",
+            argv=["control_snapcast.py"],
+            env={"CONTROL_BIND": "127.0.0.1", "CONTROL_PORT": "{port}", "AUDIO_DATA_DIR": "{work}/snapcast",
+                 "AUTH_TOKEN": TOKEN, "MIXER_CARD": "0", "DEVICE_ID": "bench",
+                 "DOCKER_HOST": "unix://{work}/docker.sock",
+                 # No Liquidsoap here: refused at once instead of a DNS lookup.
+                 "LIQUIDSOAP_TELNET_HOST": "127.0.0.1", "LIQUIDSOAP_TELNET_PORT": "1"},
+            backends=("docker",),
+            scenarios=[
+                Scenario("status", "GET", "/status"),
+                Scenario("metrics", "GET", "/metrics"),
+                Scenario("volume", "POST", "/volume", {"volume": 0.8}),
+                Scenario("hwvolume_get", "GET", "/hwvolume"),
+            ],
+        ),
+        Service(
+            name="hdmi-media",
+            cwd="roles/hdmi-media/control",
+            argv=_uvicorn(),
+            env={"MEDIA_CONTROL_TOKEN": TOKEN, "MPV_SOCKET": "{work}/mpv.sock", "VIDEO_DATA_DIR": "{work}/video",
+                 "CEC_DEVICE_DIR": "{work}/dev", "CEC_POWER_REFRESH_DELAY": "3600"},
+            backends=("mpv",),
+            scenarios=[
+                Scenario("status", "GET", "/status"),
+                Scenario("metrics", "GET", "/metrics"),
+                Scenario("volume", "POST", "/volume", {"volume": 70}),
+                Scenario("play", "POST", "/play", {"url": "/data/library/bench.mp4"}),
+                Scenario("tv_status", "GET", "/tv/status"),
+                Scenario("tv_power_on", "POST", "/tv/power_on?wait=true"),
+            ],
+        ),
+        Service(
+            name="camera",
+            cwd="roles/camera/control",
+            argv=_uvicorn(),
+            env={"CAMERA_CONTROL_TOKEN": TOKEN,
+                 "CAMERA_HLS_URL": "http://127.0.0.1:{http_port}/camera/index.m3u8",
+                 "CAMERA_RTSP_URL": "rtsp://127.0.0.1:{rtsp_port}/camera",
+                 "CAMERA_RTSP_SAMPLE_SECONDS": "0.5", "CAMERA_DVR_DIR": "{work}/dvr",
+                 "CAMERA_SNAPSHOT_FPS": "5"},
+            backends=("media",),
+            scenarios=[
+                Scenario("status", "GET", "/status"),
+                Scenario("metrics", "GET", "/metrics"),
+                Scenario("probe", "POST", "/probe"),
+                Scenario("snapshot", "GET", "/snapshot.jpg"),
+                Scenario("hls_playlist", "GET", "/hls/camera/index.m3u8"),
+                Scenario("hls_segment", "GET", "/hls/camera/segment1.ts"),
+            ],
+        ),
+    )
+}
+
+
+# ------------------------------------------------------------------ processes
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _proc_stats(pid: int) -> Dict[str, float]:
+    """Service CPU seconds plus current and peak RSS from /proc (zeros elsewhere)."""
+    stats = {"cpu_seconds": 0.0, "rss_kb": 0, "rss_peak_kb": 0}
+    try:
+        fields = pathlib.Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        stats["cpu_seconds"] = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+        for line in pathlib.Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                stats["rss_kb"] = int(line.split()[1])
+            elif line.startswith("VmHWM:"):
+                stats["rss_peak_kb"] = int(line.split()[1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return stats
+
+
+class Workspace:
+    """Temporary directory holding fake executables, sockets, data and logs."""
+
+    def __init__(self, latency_ms: float, fail_rate: float, keep: bool):
+        self.root = pathlib.Path(tempfile.mkdtemp(prefix="fleet-bench-"))
+        self.keep = keep
+        self.ports = {"http_port": _free_port(), "rtsp_port": _free_port()}
+        self.procs: List[subprocess.Popen] = []
+        self.env = dict(os.environ)
+        self.env.update({
+            "PATH": f"{self.root / 'bin'}{os.pathsep}{os.environ.get('PATH', '')}",
+            "BENCH_FAKE_LATENCY_MS": str(latency_ms),
+            "BENCH_FAKE_FAIL_RATE": str(fail_rate),
+            "PYTHONDONTWRITEBYTECODE": "1",
+            "PYTHONUNBUFFERED": "1",
+        })
+        bindir = self.root / "bin"
+        bindir.mkdir()
+        for name in FAKE_EXECUTABLES:
+            wrapper = bindir / name
+            wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKES}" bin {name} "$@"\n')
+            wrapper.chmod(0o755)
+        (self.root / "dev").mkdir()
+        (self.root / "dev" / "cec0").touch()
+
+    def fill(self, template: str, port: int = 0) -> str:
+        return template.format(work=self.root, port=port, **self.ports)
+
+    def spawn(self, argv: List[str], log_name: str, cwd: Optional[pathlib.Path] = None,
+              env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+        log = open(self.root / f"{log_name}.log", "ab")
+        proc = subprocess.Popen(argv, cwd=cwd, env=env or self.env, stdout=log, stderr=subprocess.STDOUT,
+                                start_new_session=True)
+        log.close()
+        self.procs.append(proc)
+        return proc
+
+    def start_backend(self, name: str) -> None:
+        if name == "mpv":
+            argv = ["mpv", "--socket", str(self.root / "mpv.sock")]
+        elif name == "docker":
+            argv = ["docker", "--socket", str(self.root / "docker.sock")]
+        else:
+            argv = ["media", "--http-port", str(self.ports["http_port"]), "--rtsp-port", str(self.ports["rtsp_port"])]
+        self.spawn([sys.executable, str(FAKES), *argv], f"fake-{name}")
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if name == "media":
+                try:
+                    socket.create_connection(("127.0.0.1", self.ports["rtsp_port"]), timeout=0.2).close()
+                    return
+                except OSError:
+                    pass
+            elif (self.root / f"{name}.sock").exists():
+                return
+            time.sleep(0.05)
+        raise RuntimeError(f"fake {name} backend did not start")
+
+    def stop(self, proc: subprocess.Popen) -> None:
+        if proc.poll() is None:
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.wait()
+            except ProcessLookupError:
+                pass
+
+    def close(self) -> None:
+        for proc in reversed(self.procs):
+            self.stop(proc)
+        if not self.keep:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def log_tail(self, name: str, lines: int = 20) -> str:
+        try:
+            return "\n".join((self.root / f"{name}.log").read_text(errors="replace").splitlines()[-lines:])
+        except OSError:
+            return ""
+
+
+# ----------------------------------------------------------------------- load
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+async def _call(pool: HttpPool, base: str, scenario: Scenario, timeout: float) -> Tuple[bool, float]:
+    headers = {"Authorization": f"Bearer {TOKEN}", "Accept": "application/json"}
+    body = None
+    if scenario.body is not None:
+        headers["Content-Type"] = "application/json"
+        body = json.dumps(scenario.body).encode()
+    started = time.perf_counter()
+    try:
+        response = await pool.request(scenario.method, base + scenario.path, headers, timeout=timeout, body=body)
+        ok = response.status in scenario.ok
+    except (asyncio.TimeoutError, HttpError, OSError):
+        ok = False
+    return ok, (time.perf_counter() - started) * 1000
+
+
+async def run_scenario(
+    base: str, scenario: Scenario, duration: float, concurrency: int, warmup: int, timeout: float
+) -> Dict[str, Any]:
+    pool = HttpPool(per_host=concurrency, concurrency=concurrency)
+    latencies: List[float] = []
+    errors = 0
+    try:
+        for _ in range(warmup):
+            await _call(pool, base, scenario, timeout)
+        deadline = time.perf_counter() + duration
+
+        async def worker() -> None:
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                ok, latency = await _call(pool, base, scenario, timeout)
+                latencies.append(latency)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await pool.close()
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p90_ms": round(percentile(latencies, 90), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+    }
+
+
+def _wait_ready(base: str, service: Service, proc: subprocess.Popen, timeout: float) -> float:
+    import urllib.error
+    import urllib.request
+
+    started = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{service.name} exited with status {proc.returncode}")
+        try:
+            with urllib.request.urlopen(base + service.health_path, timeout=1) as response:
+                if response.status == 200:
+                    return (time.perf_counter() - started) * 1000
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"{service.name} not healthy after {timeout:.0f}s")
+
+
+def bench_service(
+    workspace: Workspace, service: Service, scenarios: Optional[List[str]], args: argparse.Namespace
+) -> Dict[str, Any]:
+    for backend in service.backends:
+        workspace.start_backend(backend)
+    port = _free_port()
+    env = dict(workspace.env)
+    env.update({key: workspace.fill(value, port) for key, value in service.env.items()})
+    argv = [sys.executable, *(workspace.fill(arg, port) for arg in service.argv)]
+    proc = workspace.spawn(argv, service.name, cwd=REPO / service.cwd, env=env)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        startup_ms = _wait_ready(base, service, proc, args.startup_timeout)
+        idle = _proc_stats(proc.pid)
+        results: Dict[str, Any] = {}
+        for scenario in service.scenarios:
+            if scenarios and scenario.name not in scenarios:
+                continue
+            before = _proc_stats(proc.pid)
+            result = asyncio.run(
+                run_scenario(base, scenario, args.duration, args.concurrency, args.warmup, args.timeout)
+            )
+            after = _proc_stats(proc.pid)
+            cpu_ms = (after["cpu_seconds"] - before["cpu_seconds"]) * 1000
+            result["cpu_ms_per_request"] = round(cpu_ms / result["requests"], 3) if result["requests"] else 0.0
+            result["rss_kb"] = after["rss_kb"]
+            results[scenario.name] = result
+        final = _proc_stats(proc.pid)
+        return {
+            "startup_ms": round(startup_ms, 1),
+            "rss_idle_kb": idle["rss_kb"],
+            "rss_peak_kb": final["rss_peak_kb"],
+            "scenarios": results,
+        }
+    finally:
+        workspace.stop(proc)
+
+
+# -------------------------------------------------------------------- reports
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "-C", str(REPO), "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Human-readable regressions of ``report`` against ``baseline``."""
+    found: List[str] = []
+
+    def worse(label: str, metric: str, new: float, old: float, higher_is_worse: bool = True) -> None:
+        if not old:
+            return
+        delta = new - old if higher_is_worse else old - new
+        if delta > old * tolerance and delta > NOISE_FLOOR.get(metric, 0):
+            found.append(f"{label}: {metric} {old:g} -> {new:g} ({(new - old) / old:+.0%})")
+
+    for name, service in report.get("services", {}).items():
+        base_service = baseline.get("services", {}).get(name)
+        if not base_service:
+            continue
+        worse(name, "rss_peak_kb", service.get("rss_peak_kb", 0), base_service.get("rss_peak_kb", 0))
+        for scenario, result in service.get("scenarios", {}).items():
+            old = base_service.get("scenarios", {}).get(scenario)
+            if not old:
+                continue
+            label = f"{name}/{scenario}"
+            for metric in ("p50_ms", "p99_ms", "cpu_ms_per_request"):
+                worse(label, metric, result.get(metric, 0), old.get(metric, 0))
+            worse(label, "throughput_rps", result.get("throughput_rps", 0), old.get("throughput_rps", 0),
+                  higher_is_worse=False)
+            if result.get("errors") and not old.get("errors"):
+                found.append(f"{label}: {result['errors']} failed requests (baseline had none)")
+    return found
+
+
+def render_text(report: Dict[str, Any]) -> str:
+    header = f"{'service/scenario':34} {'req':>7} {'err':>5} {'rps':>9} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'cpu/req':>8} {'rss MB':>7}"
+    lines = [header, "-" * len(header)]
+    for name, service in report["services"].items():
+        if "error" in service:
+            lines.append(f"{name:34} FAILED: {service['error']}")
+            continue
+        lines.append(
+            f"{name:34} startup {service['startup_ms']:.0f} ms, idle {service['rss_idle_kb'] / 1024:.1f} MB, "
+            f"peak {service['rss_peak_kb'] / 1024:.1f} MB"
+        )
+        for scenario, r in service["scenarios"].items():
+            lines.append(
+                f"  {scenario:32} {r['requests']:7d} {r['errors']:5d} {r['throughput_rps']:9.1f} "
+                f"{r['p50_ms']:8.2f} {r['p90_ms']:8.2f} {r['p99_ms']:8.2f} {r['max_ms']:8.1f} "
+                f"{r['cpu_ms_per_request']:8.3f} {r['rss_kb'] / 1024:7.1f}"
+            )
+    lines.append("(latencies and cpu/req in ms)")
+    for regression in report.get("regressions", []):
+        lines.append(f"REGRESSION {regression}")
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--service", action="append", choices=sorted(SERVICES), help="service to run (repeatable)")
+    parser.add_argument("--scenario", action="append", help="only run scenarios with this name (repeatable)")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent keep-alive clients")
+    parser.add_argument("--warmup", type=int, default=20, help="sequential requests before measuring")
+    parser.add_argument("--timeout", type=float, default=10.0, help="per-request timeout (s)")
+    parser.add_argument("--startup-timeout", type=float, default=20.0)
+    parser.add_argument("--backend-latency-ms", type=float, default=0.0, help="delay injected into every fake")
+    parser.add_argument("--backend-fail-rate", type=float, default=0.0, help="failure probability for every fake")
+    parser.add_argument("--output", type=pathlib.Path, help="write the JSON report here")
+    parser.add_argument("--baseline", type=pathlib.Path, help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown (0.25 = 25%%)")
+    parser.add_argument("--format", choices=("text", "json"), default="text")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (logs, data) afterwards")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        try:
+            baseline = json.loads(args.baseline.read_text())
+        except (OSError, ValueError) as exc:
+            print(f"cannot read baseline {args.baseline}: {exc}", file=sys.stderr)
+            return 1
+
+    report: Dict[str, Any] = {
+        "version": REPORT_VERSION,
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "settings": {
+                "duration": args.duration,
+                "concurrency": args.concurrency,
+                "warmup": args.warmup,
+                "backend_latency_ms": args.backend_latency_ms,
+                "backend_fail_rate": args.backend_fail_rate,
+            },
+        },
+        "services": {},
+    }
+    failed = False
+    for name in args.service or list(SERVICES):
+        workspace = Workspace(args.backend_latency_ms, args.backend_fail_rate, args.keep)
+        try:
+            report["services"][name] = bench_service(workspace, SERVICES[name], args.scenario, args)
+        except RuntimeError as exc:
+            failed = True
+            report["services"][name] = {"error": str(exc)}
+            print(f"{name}: {exc}\n{workspace.log_tail(name)}", file=sys.stderr)
+        finally:
+            workspace.close()
+            if args.keep:
+                print(f"{name}: work directory kept at {workspace.root}", file=sys.stderr)
+
+    if baseline is not None:
+        report["baseline"] = {"git": baseline.get("meta", {}).get("git"), "tolerance": args.tolerance}
+        report["regressions"] = compare(report, baseline, args.tolerance)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+    print(json.dumps(report, indent=2, sort_keys=True) if args.format == "json" else render_text(report))
+
+    if failed:
+        return 1
+    request_errors = any(
+        r.get("errors") for s in report["services"].values() for r in s.get("scenarios", {}).values()
+    )
+    if report.get("regressions") or (request_errors and not args.backend_fail_rate):
+        return EXIT_REGRESSION
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,753 @@
+#!/usr/bin/env python3
+"""Replay scripted faults through the audio failover loops on a virtual clock.
+
+Two loops are driven, unmodified, from the working tree:
+
+- ``player.player_loop`` decides between the stream and the fallback file.
+- ``control_snapcast.monitor_connection`` switches between Snapcast and the
+  Liquidsoap fallback container.
+
+Each module's ``clock`` is replaced by ``VirtualClock``. Time only moves when
+a loop sleeps, so a two-minute scenario replays in well under a second, and
+the same inputs always give the same report. Only the edges to the outside
+world are swapped out, for a ``World`` that follows a fault timeline:
+
+- For the player: ffprobe, the stream and fallback ffmpeg processes, and the
+  read-ahead buffer.
+- For Snapcast: the Docker SDK, the ``docker`` CLI and the socket to
+  Liquidsoap's telnet server.
+
+A scenario models what a listener hears on every 10 ms tick, and reports:
+
+- time to fallback;
+- time to recovery;
+- source switches and flaps;
+- total and longest silence;
+- overlap, when two sources play at once.
+
+The tunables are the service environment variables, set here through flags
+before the modules are imported. Run it before and after changing a
+threshold, and compare.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+REPO = pathlib.Path(__file__).resolve().parents[2]
+AUDIO_APP = REPO / "roles" / "audio-player" / "docker" / "app"
+
+TICK_MS = 10
+FLAP_WINDOW_SECONDS = 10.0
+
+# Behaviour of the things being replaced. These are assumptions, not
+# measurements; they are printed with every report.
+PROBE_OK_SECONDS = 0.3  # ffprobe against a reachable stream
+STREAM_CONNECT_SECONDS = 0.5  # ffmpeg/fetcher connect and first audio
+DIRECT_BUFFER_SECONDS = 0.5  # audio inside a direct ffmpeg when data stops
+DIRECT_GIVE_UP_SECONDS = 3.0  # -reconnect_delay_max 2: retries at +0, +1, +2
+SERVER_BURST_SECONDS = 4.0  # Icecast burst-on-connect
+FALLBACK_START_SECONDS = 0.2  # ffmpeg on a local file
+SNAPCLIENT_CONNECT_SECONDS = 1.0
+CONTAINER_START_SECONDS = 0.5
+CONTAINER_STOP_SECONDS = 0.3
+LIQUIDSOAP_START_SECONDS = 1.0  # container start to telnet answering, buffer primed
+LIQUIDSOAP_FADE_SECONDS = 0.5  # fallback.liq FALLBACK_FADE_SECONDS
+DOCKER_API_SECONDS = 0.05
+TELNET_SECONDS = 0.002  # one command over the compose network
+
+
+class SimulationDone(Exception):
+    pass
+
+
+@dataclass
+class Fault:
+    kind: str  # network | silence | decoder-crash | container | docker-api
+    start: float
+    end: float
+
+
+@dataclass
+class Scenario:
+    name: str
+    target: str  # player | snapcast
+    faults: List[Fault]
+    description: str
+    buffered: bool = True
+    fallback_file: bool = True
+    duration: float = 120.0
+
+
+def _flapping(kind: str, start: float, down: float, up: float, count: int) -> List[Fault]:
+    return [Fault(kind, start + i * (down + up), start + i * (down + up) + down) for i in range(count)]
+
+
+SCENARIOS: Tuple[Scenario, ...] = (
+    Scenario("outage-buffered", "player", [Fault("network", 20, 50)], "30 s stream outage, read-ahead buffer on"),
+    Scenario("outage-direct", "player", [Fault("network", 20, 50)], "30 s stream outage, direct ffmpeg",
+             buffered=False),
+    Scenario("blip", "player", [Fault("network", 20, 23)], "3 s network blip, read-ahead buffer on"),
+    Scenario("flapping", "player", _flapping("network", 20, 4, 4, 5), "network down 4 s / up 4 s, five times"),
+    Scenario("dead-air", "player", [Fault("silence", 20, 100)], "stream connects but carries silence for 80 s"),
+    Scenario("decoder-crash", "player", [Fault("decoder-crash", 30, 30)], "stream ffmpeg dies, network fine"),
+    Scenario("no-fallback-file", "player", [Fault("network", 20, 50)], "30 s outage with no fallback file",
+             fallback_file=False),
+    Scenario("snap-container-crash", "snapcast", [Fault("container", 20, 50)],
+             "snapcast-client container down for 30 s"),
+    Scenario("snap-network-outage", "snapcast", [Fault("network", 20, 50)],
+             "snapserver unreachable for 30 s, snapclient process still running"),
+    Scenario("snap-container-flap", "snapcast", _flapping("container", 20, 3, 5, 5),
+             "container down 3 s / up 5 s, five times"),
+    Scenario("snap-docker-api-down", "snapcast", [Fault("docker-api", 20, 50)],
+             "Docker API unavailable for 30 s, audio path fine"),
+)
+
+
+class World:
+    """Fault timeline plus whatever is currently producing sound."""
+
+    def __init__(self, scenario: Scenario):
+        self.scenario = scenario
+        self.now = 0.0
+        self.processes: List["FakeProcess"] = []
+        self.audible: Tuple[str, ...] = ()
+        self.changes: List[Tuple[float, Tuple[str, ...]]] = []
+        self.switches: List[Tuple[float, str]] = []
+        self.first_audio: Optional[float] = None
+        self.silence = 0.0
+        self.silent_since: Optional[float] = None
+        self.longest_silence = 0.0
+        self.overlap = 0.0
+        # What the controller believes, sampled every tick when it is visible
+        # (control_snapcast's current_mode); differs from ``audible`` when a
+        # switch fails half-way.
+        self.mode: Optional[Callable[[], str]] = None
+        self.modes: List[Tuple[float, str]] = []
+        # Snapcast side: the snapcast-client container, the fallback
+        # container and Liquidsoap's "enabled" switch.
+        self.snap_buffer = 1.0  # SNAPCAST_BUFFER_MS, set by run_snapcast
+        self.snap_container_up = True
+        self.snap_playing_since: Optional[float] = 0.0
+        self.snap_lost_at: Optional[float] = None
+        self.fallback_container_since: Optional[float] = None
+        self.liquidsoap_enabled = False
+        self.liquidsoap_disabled_at: Optional[float] = None
+
+    def down(self, kind: str, at: Optional[float] = None) -> bool:
+        at = self.now if at is None else at
+        return any(f.kind == kind and f.start <= at < f.end for f in self.scenario.faults)
+
+    def fault_edge(self, kind: str, dt: float) -> bool:
+        return any(f.kind == kind and self.now <= f.start < self.now + dt for f in self.scenario.faults)
+
+    def switch(self, source: str) -> None:
+        self.switches.append((self.now, source))
+
+    def advance(self, dt: float) -> None:
+        for proc in list(self.processes):
+            proc.advance(dt)
+        self._advance_snapcast(dt)
+        self.now += dt
+        if self.mode is not None:
+            mode = self.mode()
+            if not self.modes or self.modes[-1][1] != mode:
+                self.modes.append((self.now, mode))
+        sources = tuple(sorted(proc.source for proc in self.processes if proc.audible()))
+        if self._snap_audible():
+            sources = tuple(sorted(sources + ("snapcast",)))
+        if self._liquidsoap_audible():
+            sources = tuple(sorted(sources + ("fallback",)))
+        if sources != self.audible:
+            self.audible = sources
+            self.changes.append((self.now, sources))
+        if sources and self.first_audio is None:
+            self.first_audio = self.now
+        if self.first_audio is None:
+            return
+        if not sources:
+            self.silence += dt
+            if self.silent_since is None:
+                self.silent_since = self.now - dt
+            self.longest_silence = max(self.longest_silence, self.now - self.silent_since)
+        else:
+            self.silent_since = None
+        if len(sources) > 1:
+            self.overlap += dt
+
+    def _advance_snapcast(self, dt: float) -> None:
+        if self.scenario.target != "snapcast":
+            return
+        was_up = self.snap_container_up
+        self.snap_container_up = not self.down("container", self.now + dt)
+        if was_up and not self.snap_container_up:
+            self.snap_playing_since = None
+            self.snap_lost_at = None
+        connected = self.snap_container_up and not self.down("network", self.now + dt)
+        if connected and self.snap_playing_since is None:
+            self.snap_playing_since = self.now + SNAPCLIENT_CONNECT_SECONDS + self.snap_buffer
+        elif not connected and self.snap_container_up and self.snap_lost_at is None:
+            self.snap_lost_at = self.now
+        if connected:
+            self.snap_lost_at = None
+        elif self.snap_lost_at is not None and self.now - self.snap_lost_at >= self.snap_buffer:
+            self.snap_playing_since = None
+
+    def _snap_audible(self) -> bool:
+        return (
+            self.scenario.target == "snapcast"
+            and self.snap_container_up
+            and self.snap_playing_since is not None
+            and self.now >= self.snap_playing_since
+        )
+
+    def liquidsoap_ready(self) -> bool:
+        since = self.fallback_container_since
+        return since is not None and self.now >= since + LIQUIDSOAP_START_SECONDS
+
+    def _liquidsoap_audible(self) -> bool:
+        fading = self.liquidsoap_disabled_at is not None and self.now < self.liquidsoap_disabled_at + LIQUIDSOAP_FADE_SECONDS
+        return self.liquidsoap_ready() and (self.liquidsoap_enabled or fading)
+
+
+class VirtualClock:
+    """Drop-in for ``common.SystemClock`` that advances the ``World`` instead of waiting."""
+
+    def __init__(self, world: World, end: float):
+        self.world = world
+        self.end_ms = int(end * 1000)
+        self.ms = 0
+
+    def time(self) -> float:
+        return self.ms / 1000.0
+
+    def sleep(self, seconds: float) -> None:
+        target = self.ms + max(int(round(seconds * 1000)), 0)
+        while self.ms < target:
+            step = min(TICK_MS, target - self.ms)
+            self.world.advance(step / 1000.0)
+            self.ms += step
+            if self.ms >= self.end_ms:
+                raise SimulationDone()
+
+
+class FakeProcess:
+    """The slice of ``subprocess.Popen`` the player loop touches."""
+
+    source = ""
+
+    def __init__(self, world: World):
+        self.world = world
+        self.started = world.now
+        self.returncode: Optional[int] = None
+        world.processes.append(self)
+
+    def advance(self, dt: float) -> None:
+        pass
+
+    def audible(self) -> bool:
+        return False
+
+    def exit(self, code: int) -> None:
+        if self.returncode is None:
+            self.returncode = code
+            self.world.processes.remove(self)
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def terminate(self) -> None:
+        self.exit(-15)
+
+    def kill(self) -> None:
+        self.exit(-9)
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        return self.returncode
+
+
+class FakeStream(FakeProcess):
+    """Stream decoder, either direct ffmpeg or ``BufferedStream``.
+
+    Direct: audible while data flows, plus ``DIRECT_BUFFER_SECONDS``. Exits
+    ``DIRECT_GIVE_UP_SECONDS`` after the network goes away.
+
+    Buffered: a fetcher that gets a server burst on connect, then data at
+    real time. It notices a dead connection after ``READ_TIMEOUT`` and
+    reconnects with ``StreamFetcher``'s backoff. The decoder plays while the
+    buffer holds audio and never exits on its own.
+    """
+
+    source = "stream"
+
+    def __init__(
+        self,
+        world: World,
+        buffered: bool,
+        buffer_seconds: float,
+        prefill: float,
+        read_timeout: float,
+        silence_limit: float,
+    ):
+        super().__init__(world)
+        self.levels = FakeLevels(self, silence_limit)
+        self.silent_for = 0.0
+        self.buffered_mode = buffered
+        self.cap = buffer_seconds
+        self.prefill = min(prefill, buffer_seconds) if buffered else 0.0
+        self.read_timeout = read_timeout
+        self.depth = 0.0
+        self.playing = False
+        self.connected_at: Optional[float] = None if world.down("network") else world.now + STREAM_CONNECT_SECONDS
+        self.stalled_for = 0.0
+        self.retry_at: Optional[float] = None
+        self.backoff = 0.5
+        self.burst_pending = True
+
+    def advance(self, dt: float) -> None:
+        world = self.world
+        if world.fault_edge("decoder-crash", dt):
+            self.exit(-11)
+            return
+        if self.depth > 0 and world.down("silence"):
+            self.silent_for += dt
+        else:
+            self.silent_for = 0.0
+        net = not world.down("network")
+        if self.buffered_mode:
+            self._advance_buffered(dt, net)
+        else:
+            self._advance_direct(dt, net)
+
+    def _advance_direct(self, dt: float, net: bool) -> None:
+        if net:
+            self.stalled_for = 0.0
+            if self.connected_at is None:
+                self.connected_at = self.world.now + STREAM_CONNECT_SECONDS
+            self.depth = DIRECT_BUFFER_SECONDS
+            return
+        self.stalled_for += dt
+        self.depth = max(self.depth - dt, 0.0)
+        if self.stalled_for >= DIRECT_GIVE_UP_SECONDS:
+            self.exit(1)
+
+    def _advance_buffered(self, dt: float, net: bool) -> None:
+        now = self.world.now
+        connected = self.connected_at is not None and now >= self.connected_at
+        if connected and net:
+            self.stalled_for = 0.0
+            if self.burst_pending:
+                self.depth += SERVER_BURST_SECONDS
+                self.burst_pending = False
+            self.depth = min(self.depth + dt, self.cap)
+        elif connected:
+            self.stalled_for += dt
+            if self.stalled_for >= self.read_timeout:
+                # Read timeout: drop the connection and start the backoff loop.
+                self.connected_at = None
+                self.retry_at = now + self.backoff
+        elif self.connected_at is None:
+            if self.retry_at is None:
+                self.retry_at = now + self.backoff
+            if now >= self.retry_at:
+                if net:
+                    self.connected_at = now + STREAM_CONNECT_SECONDS
+                    self.burst_pending = True
+                    self.backoff = 0.5
+                    self.retry_at = None
+                else:
+                    self.backoff = min(self.backoff * 2, 5.0)
+                    self.retry_at = now + self.backoff
+        if not self.playing and self.depth >= self.prefill and self.depth > 0:
+            self.playing = True
+        if self.playing:
+            self.depth = max(self.depth - dt, 0.0)
+
+    def audible(self) -> bool:
+        if self.world.down("silence"):
+            return False
+        if self.connected_at is None and not self.buffered_mode:
+            return False
+        if self.connected_at is not None and self.world.now < self.connected_at and self.depth <= 0:
+            return False
+        return self.depth > 0 and (self.playing or not self.buffered_mode)
+
+    def buffered(self) -> bool:
+        return self.buffered_mode and self.depth > 0
+
+
+class FakeLevels:
+    """``levels.LevelMeter`` as seen by the loop: dead air while the stream is silent."""
+
+    def __init__(self, stream: FakeStream, silence_limit: float):
+        self.stream = stream
+        self.silence_limit = silence_limit
+
+    def fault(self) -> Optional[str]:
+        if self.silence_limit > 0 and self.stream.silent_for >= self.silence_limit:
+            return f"dead air for {self.stream.silent_for:.0f}s"
+        return None
+
+    def report(self) -> dict:
+        return {"silence_seconds": round(self.stream.silent_for, 1)}
+
+
+class FakeFallback(FakeProcess):
+    source = "fallback"
+
+    def audible(self) -> bool:
+        return self.world.now >= self.started + FALLBACK_START_SECONDS
+
+
+# -- Snapcast side: Docker SDK, docker CLI and Liquidsoap ---------------------
+
+
+class _DockerError(Exception):
+    pass
+
+
+class _Completed:
+    def __init__(self, returncode: int, stdout: str = ""):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = ""
+
+
+class _FakeTelnet:
+    """One connection to Liquidsoap's telnet server: a command in, a reply out."""
+
+    def __init__(self, docker: "FakeDocker"):
+        self.docker = docker
+        self.reply = b""
+
+    def __enter__(self) -> "_FakeTelnet":
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        pass
+
+    def sendall(self, data: bytes) -> None:
+        self.reply = self.docker.liquidsoap(data.decode().strip()).replace("\n", "\r\n").encode() + b"\r\n"
+
+    def recv(self, _size: int) -> bytes:
+        reply, self.reply = self.reply, b""
+        return reply
+
+
+class FakeContainer:
+    def __init__(self, world: World, clock: VirtualClock, name: str):
+        self.world = world
+        self.clock = clock
+        self.name = name
+
+    def exec_run(self, cmd: str):
+        self.clock.sleep(DOCKER_API_SECONDS)
+        if self.name != "snapcast-client" or not self.world.snap_container_up:
+            raise _DockerError(f"409 Conflict: container {self.name} is not running")
+        # "pgrep snapclient" only sees the process, not the server connection.
+        return 0, b"1\n"
+
+    def start(self) -> None:
+        self.clock.sleep(CONTAINER_START_SECONDS)
+        if self.name == "audio-fallback" and self.world.fallback_container_since is None:
+            self.world.fallback_container_since = self.world.now
+
+    def stop(self, timeout: int = 10) -> None:
+        self.clock.sleep(CONTAINER_STOP_SECONDS)
+        if self.name == "audio-fallback" and self.world.fallback_container_since is not None:
+            self.world.fallback_container_since = None
+            self.world.liquidsoap_enabled = False
+            self.world.liquidsoap_disabled_at = None
+
+
+class FakeDocker:
+    """Stands in for the ``docker`` SDK module, ``subprocess`` and ``socket`` in control_snapcast."""
+
+    def __init__(self, world: World, clock: VirtualClock):
+        self.world = world
+        self.clock = clock
+        self.containers = self
+
+    def from_env(self) -> "FakeDocker":
+        if self.world.down("docker-api"):
+            raise _DockerError("Error while fetching server API version: connection refused")
+        return self
+
+    def get(self, name: str) -> FakeContainer:
+        self.clock.sleep(DOCKER_API_SECONDS)
+        if self.world.down("docker-api"):
+            raise _DockerError("connection refused")
+        return FakeContainer(self.world, self.clock, name)
+
+    def run(self, argv: List[str], **_kwargs) -> _Completed:
+        self.clock.sleep(DOCKER_API_SECONDS)
+        if self.world.down("docker-api"):
+            return _Completed(1)
+        if argv[:2] == ["docker", "ps"]:
+            running = []
+            if self.world.snap_container_up:
+                running.append("snapcast-client")
+            if self.world.fallback_container_since is not None:
+                running.append("audio-fallback")
+            return _Completed(0, "\n".join(running))
+        return _Completed(127)
+
+    def create_connection(self, _address: Tuple[str, int], timeout: float = 0.0) -> _FakeTelnet:
+        self.clock.sleep(TELNET_SECONDS)
+        if self.world.fallback_container_since is None or not self.world.liquidsoap_ready():
+            raise ConnectionRefusedError(111, "Connection refused")
+        return _FakeTelnet(self)
+
+    def liquidsoap(self, command: str) -> str:
+        world = self.world
+        if command == "var.set enabled = true":
+            if not world.liquidsoap_enabled:
+                world.switch("fallback")
+            world.liquidsoap_enabled = True
+            world.liquidsoap_disabled_at = None
+        elif command == "var.set enabled = false":
+            if world.liquidsoap_enabled:
+                world.switch("snapcast")
+                world.liquidsoap_disabled_at = world.now
+            world.liquidsoap_enabled = False
+        elif command == "alsa_output.status":
+            return ("on" if world._liquidsoap_audible() else "off") + "\nEND"
+        return "Variable enabled set.\nEND"
+
+
+# -- Running and reporting -----------------------------------------------------
+
+
+def _prepare_data_dir(data_dir: pathlib.Path, scenario: Scenario, fallback: pathlib.Path) -> None:
+    for name in ("config.json", "state.json"):
+        (data_dir / name).unlink(missing_ok=True)
+    (data_dir / "config.json").write_text(
+        json.dumps({"stream_url": "http://stream.invalid/live", "mode": "auto", "source": "stream", "volume": 1.0})
+    )
+    if scenario.fallback_file:
+        fallback.write_bytes(b"ID3")
+    else:
+        fallback.unlink(missing_ok=True)
+
+
+def run_player(scenario: Scenario, player: Any, readahead: Any, levels: Any) -> World:
+    world = World(scenario)
+    clock = VirtualClock(world, scenario.duration)
+    buffered = scenario.buffered and player.BUFFER_SECONDS > 0
+
+    def ffprobe_ok(_url: str) -> bool:
+        if world.down("network"):
+            clock.sleep(player.PROBE_TIMEOUT_SECONDS)
+            return False
+        clock.sleep(PROBE_OK_SECONDS)
+        return not world.down("network")
+
+    def start_stream(_url: str, _volume: float) -> FakeStream:
+        world.switch("stream")
+        return FakeStream(
+            world,
+            buffered,
+            player.BUFFER_SECONDS,
+            readahead.PREFILL_SECONDS,
+            readahead.READ_TIMEOUT,
+            levels.SILENCE_SECONDS,
+        )
+
+    def play_fallback(_path: str, _volume: float) -> FakeFallback:
+        world.switch("fallback")
+        return FakeFallback(world)
+
+    player.clock = clock
+    player.ffprobe_ok = ffprobe_ok
+    player.start_stream = start_stream
+    player.play_fallback = play_fallback
+    try:
+        player.player_loop()
+    except SimulationDone:
+        pass
+    return world
+
+
+def run_snapcast(scenario: Scenario, snap: Any) -> World:
+    world = World(scenario)
+    world.snap_buffer = snap.SNAPCAST_BUFFER_MS / 1000.0
+    world.snap_playing_since = 0.0
+    clock = VirtualClock(world, scenario.duration)
+    fake = FakeDocker(world, clock)
+    snap.clock = clock
+    snap.docker = fake
+    snap.subprocess = fake
+    snap.socket = fake
+    snap.current_mode = snap.PlaybackMode.SNAPCAST
+    snap.snapcast_connected = True
+    world.mode = lambda: snap.current_mode
+    snap.last_standby_check = None
+    if snap.FALLBACK_WARM_STANDBY:
+        # Steady state: the standby container has long been up.
+        world.fallback_container_since = -LIQUIDSOAP_START_SECONDS
+    try:
+        snap.monitor_connection()
+    except SimulationDone:
+        pass
+    return world
+
+
+def summarize(world: World, primary: str) -> Dict[str, Any]:
+    scenario = world.scenario
+    first = min((f.start for f in scenario.faults), default=None)
+    last = max((f.end for f in scenario.faults), default=None)
+
+    def first_change(after: float, test: Callable[[Tuple[str, ...]], bool]) -> Optional[float]:
+        if test(_audible_at(world, after)):
+            return 0.0
+        for at, sources in world.changes:
+            if at >= after and test(sources):
+                return round(at - after, 2)
+        return None
+
+    flaps = 0
+    for i in range(2, len(world.switches)):
+        back_to = world.switches[i][1] == world.switches[i - 2][1]
+        if back_to and world.switches[i][0] - world.switches[i - 1][0] < FLAP_WINDOW_SECONDS:
+            flaps += 1
+    return {
+        "description": scenario.description,
+        "faults": [f"{f.kind} {f.start:g}-{f.end:g}s" if f.end > f.start else f"{f.kind} at {f.start:g}s"
+                   for f in scenario.faults],
+        "time_to_fallback_s": None if first is None else first_change(first, lambda s: "fallback" in s),
+        "time_to_recovery_s": None if last is None else first_change(last, lambda s: s == (primary,)),
+        "switches": max(len(world.switches) - 1, 0),
+        "flaps": flaps,
+        "silence_s": round(world.silence, 2),
+        "longest_silence_s": round(world.longest_silence, 2),
+        "overlap_s": round(world.overlap, 2),
+        "mode_changes": max(len(world.modes) - 1, 0) if world.mode is not None else None,
+        "events": [{"t": round(at, 2), "start": source} for at, source in world.switches]
+        + [{"t": round(at, 2), "mode": mode} for at, mode in world.modes[1:]],
+    }
+
+
+def _audible_at(world: World, at: float) -> Tuple[str, ...]:
+    current: Tuple[str, ...] = ()
+    for when, sources in world.changes:
+        if when > at:
+            break
+        current = sources
+    return current
+
+
+def render_text(report: Dict[str, Any]) -> str:
+    def fmt(value: Optional[float]) -> str:
+        return "never" if value is None else f"{value:.2f}"
+
+    header = f"{'scenario':24} {'fallback':>9} {'recovery':>9} {'switch':>6} {'flaps':>5} {'silence':>8} {'longest':>8} {'overlap':>8} {'modes':>5}"
+    lines = [header, "-" * len(header)]
+    for name, r in report["scenarios"].items():
+        lines.append(
+            f"{name:24} {fmt(r['time_to_fallback_s']):>9} {fmt(r['time_to_recovery_s']):>9} {r['switches']:6d} "
+            f"{r['flaps']:5d} {r['silence_s']:8.2f} {r['longest_silence_s']:8.2f} {r['overlap_s']:8.2f} "
+            f"{'-' if r['mode_changes'] is None else r['mode_changes']:>5}"
+        )
+        lines.append(f"  {r['description']}; {', '.join(r['faults'])}")
+    lines.append("(times in seconds after the first fault starts / the last fault ends)")
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=[s.name for s in SCENARIOS],
+                        help="only run this scenario (repeatable)")
+    parser.add_argument("--heartbeat", type=float, help="PLAYER_HEARTBEAT_SECONDS")
+    parser.add_argument("--probe-timeout", type=float, help="PLAYER_PROBE_TIMEOUT_SECONDS")
+    parser.add_argument("--buffer-seconds", type=float, help="PLAYER_BUFFER_SECONDS (0 disables the read-ahead)")
+    parser.add_argument("--silence-seconds", type=float, help="PLAYER_SILENCE_SECONDS (0 never falls back on dead air)")
+    parser.add_argument("--level-retry", type=float, help="PLAYER_LEVEL_RETRY_SECONDS")
+    parser.add_argument("--check-interval", type=float, help="SNAPCAST_CHECK_SECONDS")
+    parser.add_argument("--failure-threshold", type=int, help="SNAPCAST_FAILURE_THRESHOLD")
+    parser.add_argument("--failback-stable", type=float, help="SNAPCAST_FAILBACK_STABLE_SECONDS")
+    parser.add_argument("--cold-fallback", action="store_true", help="FALLBACK_WARM_STANDBY=0")
+    parser.add_argument("--output", type=pathlib.Path, help="write the JSON report here")
+    parser.add_argument("--format", choices=("text", "json"), default="text")
+    args = parser.parse_args()
+
+    overrides = {
+        "PLAYER_HEARTBEAT_SECONDS": args.heartbeat,
+        "PLAYER_PROBE_TIMEOUT_SECONDS": args.probe_timeout,
+        "PLAYER_BUFFER_SECONDS": args.buffer_seconds,
+        "PLAYER_SILENCE_SECONDS": args.silence_seconds,
+        "PLAYER_LEVEL_RETRY_SECONDS": args.level_retry,
+        "SNAPCAST_CHECK_SECONDS": args.check_interval,
+        "SNAPCAST_FAILURE_THRESHOLD": args.failure_threshold,
+        "SNAPCAST_FAILBACK_STABLE_SECONDS": args.failback_stable,
+    }
+    if args.cold_fallback:
+        overrides["FALLBACK_WARM_STANDBY"] = "0"
+    for key, value in overrides.items():
+        if value is not None:
+            os.environ[key] = str(value)
+
+    data_dir = pathlib.Path(tempfile.mkdtemp(prefix="fleet-failover-"))
+    fallback = data_dir / "fallback.mp3"
+    os.environ["AUDIO_DATA_DIR"] = str(data_dir)
+    os.environ["FALLBACK_FILE"] = str(fallback)
+    sys.path.insert(0, str(AUDIO_APP))
+    try:
+        import control_snapcast
+        import levels
+        import player
+        import readahead
+
+        control_snapcast.app.logger.setLevel(logging.CRITICAL)
+        selected = [s for s in SCENARIOS if not args.scenario or s.name in args.scenario]
+        report: Dict[str, Any] = {
+            "settings": {
+                "player_heartbeat_s": player.HEARTBEAT_INTERVAL,
+                "player_probe_timeout_s": player.PROBE_TIMEOUT_SECONDS,
+                "player_buffer_s": player.BUFFER_SECONDS,
+                "player_prefill_s": readahead.PREFILL_SECONDS,
+                "player_silence_s": levels.SILENCE_SECONDS,
+                "player_level_retry_s": levels.RETRY_SECONDS,
+                "snapcast_check_s": control_snapcast.SNAPCAST_CHECK_SECONDS,
+                "snapcast_failure_threshold": control_snapcast.SNAPCAST_FAILURE_THRESHOLD,
+                "snapcast_failback_stable_s": control_snapcast.SNAPCAST_FAILBACK_STABLE_SECONDS,
+                "snapcast_buffer_ms": control_snapcast.SNAPCAST_BUFFER_MS,
+                "fallback_warm_standby": control_snapcast.FALLBACK_WARM_STANDBY,
+            },
+            "assumptions": {
+                "probe_ok_s": PROBE_OK_SECONDS,
+                "stream_connect_s": STREAM_CONNECT_SECONDS,
+                "direct_give_up_s": DIRECT_GIVE_UP_SECONDS,
+                "server_burst_s": SERVER_BURST_SECONDS,
+                "snapclient_connect_s": SNAPCLIENT_CONNECT_SECONDS,
+                "liquidsoap_start_s": LIQUIDSOAP_START_SECONDS,
+                "liquidsoap_fade_s": LIQUIDSOAP_FADE_SECONDS,
+            },
+            "scenarios": {},
+        }
+        for scenario in selected:
+            _prepare_data_dir(data_dir, scenario, fallback)
+            if scenario.target == "player":
+                world = run_player(scenario, player, readahead, levels)
+                report["scenarios"][scenario.name] = summarize(world, "stream")
+            else:
+                world = run_snapcast(scenario, control_snapcast)
+                report["scenarios"][scenario.name] = summarize(world, "snapcast")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+    print(json.dumps(report, indent=2, sort_keys=True) if args.format == "json" else render_text(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""Stand-in backends for benchmarking the control services without hardware.
+
+Servers (run until killed)::
+
+    fakes.py mpv --socket PATH          mpv JSON IPC on a unix socket
+    fakes.py docker --socket PATH       Docker Engine API subset on a unix socket
+    fakes.py media --http-port N --rtsp-port M
+                                        HLS playlist over HTTP plus an RTSP
+                                        server that streams interleaved RTP
+
+Executables (``bench.py`` installs shell wrappers under these names)::
+
+    fakes.py bin ffmpeg|ffprobe|amixer|aplay|cec-ctl|docker ARGS...
+
+Every backend waits ``BENCH_FAKE_LATENCY_MS`` before answering and fails with
+probability ``BENCH_FAKE_FAIL_RATE``; ``BENCH_FAKE_<NAME>_LATENCY_MS`` and
+``BENCH_FAKE_<NAME>_FAIL_RATE`` override both per backend (NAME upper-cased,
+dashes as underscores: ``CEC_CTL``, ``MPV``, ``DOCKER``, ``MEDIA``...).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+def _setting(name: str, key: str, default: str) -> float:
+    specific = os.environ.get(f"BENCH_FAKE_{name.upper().replace('-', '_')}_{key}")
+    return float(specific if specific not in (None, "") else os.environ.get(f"BENCH_FAKE_{key}", default))
+
+
+class Behaviour:
+    """Latency and failure injection for one backend."""
+
+    def __init__(self, name: str):
+        self.latency = _setting(name, "LATENCY_MS", "0") / 1000.0
+        self.fail_rate = _setting(name, "FAIL_RATE", "0")
+
+    def fails(self) -> bool:
+        return self.fail_rate > 0 and random.random() < self.fail_rate
+
+    def sleep(self) -> None:
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    async def wait(self) -> None:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+
+# --------------------------------------------------------------------------- mpv
+
+
+class FakeMpv:
+    def __init__(self) -> None:
+        self.behaviour = Behaviour("mpv")
+        self.props: Dict[str, object] = {
+            "pause": True,
+            "time-pos": None,
+            "duration": None,
+            "volume": 100.0,
+            "path": None,
+            "idle-active": True,
+            "frame-drop-count": 0,
+            "decoder-frame-drop-count": 0,
+            "estimated-vf-fps": 25.0,
+            "container-fps": 25.0,
+            "demuxer-cache-duration": 8.0,
+            "cache-speed": 0,
+            "hwdec-current": "v4l2m2m-copy",
+            "video-params": {"w": 1920, "h": 1080, "pixelformat": "yuv420p"},
+        }
+        self._started = time.monotonic()
+
+    def _position(self) -> Optional[float]:
+        if self.props["path"] is None:
+            return None
+        return round(time.monotonic() - self._started, 3)
+
+    def handle(self, msg: dict) -> Tuple[List[dict], dict]:
+        """Return (events to emit first, reply)."""
+        command = msg.get("command") or []
+        reply: dict = {"error": "success", "data": None}
+        events: List[dict] = []
+        name = command[0] if command else ""
+        if self.behaviour.fails():
+            reply["error"] = "command failed"
+        elif name == "get_property" and len(command) > 1:
+            prop = command[1]
+            if prop == "time-pos":
+                reply["data"] = self._position()
+            elif prop in self.props:
+                reply["data"] = self.props[prop]
+            else:
+                reply["error"] = "property not found"
+        elif name == "set_property" and len(command) > 2:
+            self.props[command[1]] = command[2]
+            events.append({"event": "property-change", "name": command[1], "data": command[2]})
+        elif name == "loadfile" and len(command) > 1:
+            self.props.update({"path": command[1], "duration": 120.0, "idle-active": False})
+            self._started = time.monotonic()
+            events += [{"event": "start-file"}, {"event": "file-loaded"}]
+        elif name == "seek":
+            events.append({"event": "seek"})
+        elif name == "stop":
+            self.props.update({"path": None, "duration": None, "idle-active": True})
+            events.append({"event": "end-file", "reason": "stop"})
+        else:
+            reply["error"] = "invalid parameter"
+        if "request_id" in msg:
+            reply["request_id"] = msg["request_id"]
+        return events, reply
+
+    async def serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue
+                await self.behaviour.wait()
+                events, reply = self.handle(msg)
+                out = b"".join(json.dumps(item).encode() + b"\n" for item in events + [reply])
+                writer.write(out)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def run_mpv(socket_path: str) -> None:
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(FakeMpv().serve_client, path=socket_path)
+    async with server:
+        await server.serve_forever()
+
+
+# ------------------------------------------------------------------------ http
+
+
+async def read_http_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    method, target, _ = line.decode("latin-1").split(" ", 2)
+    headers: Dict[str, str] = {}
+    while True:
+        raw = await reader.readline()
+        if raw in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = raw.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    body = b""
+    length = int(headers.get("content-length", "0") or 0)
+    if length:
+        body = await reader.readexactly(length)
+    return method, target, headers, body
+
+
+def http_response(status: int, body: bytes, content_type: str = "application/json", extra: str = "") -> bytes:
+    reason = {200: "OK", 201: "Created", 404: "Not Found", 500: "Internal Server Error"}.get(status, "OK")
+    head = (
+        f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n{extra}\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+# ---------------------------------------------------------------------- docker
+
+
+class FakeDocker:
+    """Just enough of the Engine API for ``containers.get`` and ``exec_run``."""
+
+    API_VERSION = "1.43"
+
+    def __init__(self) -> None:
+        self.behaviour = Behaviour("docker")
+        self.running = set(os.environ.get("BENCH_FAKE_DOCKER_CONTAINERS", "snapcast-client").split(","))
+        self._ids = itertools.count(1)
+        self._exit_codes: Dict[str, int] = {}
+
+    def route(self, method: str, path: str) -> Tuple[int, object]:
+        path = re.sub(r"^/v[0-9.]+", "", path.split("?", 1)[0])
+        if path in ("/_ping",):
+            return 200, "OK"
+        if path == "/version":
+            return 200, {"ApiVersion": self.API_VERSION, "MinAPIVersion": "1.24", "Version": "24.0.0-fake"}
+        match = re.fullmatch(r"/containers/([^/]+)/json", path)
+        if match and method == "GET":
+            name = match.group(1)
+            if name not in self.running:
+                return 404, {"message": f"No such container: {name}"}
+            return 200, {"Id": name, "Name": f"/{name}", "State": {"Running": True, "Status": "running"}, "Config": {}}
+        match = re.fullmatch(r"/containers/([^/]+)/exec", path)
+        if match and method == "POST":
+            exec_id = f"exec{next(self._ids)}"
+            self._exit_codes[exec_id] = 1 if self.behaviour.fails() else 0
+            return 201, {"Id": exec_id}
+        match = re.fullmatch(r"/exec/([^/]+)/json", path)
+        if match:
+            return 200, {"ExitCode": self._exit_codes.pop(match.group(1), 0), "Running": False}
+        return 404, {"message": f"page not found: {method} {path}"}
+
+    async def serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await read_http_request(reader)
+                if request is None:
+                    break
+                method, target, _headers, _body = request
+                if method == "POST" and re.search(r"/exec/[^/]+/start$", target.split("?", 1)[0]):
+                    # Hijacked raw stream: one stdout frame, then close.
+                    await self.behaviour.wait()
+                    payload = b"1\n"
+                    writer.write(
+                        b"HTTP/1.1 101 UPGRADED\r\nContent-Type: application/vnd.docker.raw-stream\r\n"
+                        b"Connection: Upgrade\r\nUpgrade: tcp\r\n\r\n"
+                        + struct.pack(">BxxxL", 1, len(payload)) + payload
+                    )
+                    await writer.drain()
+                    break
+                status, data = self.route(method, target)
+                if isinstance(data, str):
+                    body, ctype = data.encode(), "text/plain"
+                else:
+                    body, ctype = json.dumps(data).encode(), "application/json"
+                extra = f"Api-Version: {self.API_VERSION}\r\n"
+                writer.write(http_response(status, body, ctype, extra))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def run_docker(socket_path: str) -> None:
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(FakeDocker().serve_client, path=socket_path)
+    async with server:
+        await server.serve_forever()
+
+
+# ----------------------------------------------------------------------- media
+
+PLAYLIST = (
+    "#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:2\n#EXT-X-MEDIA-SEQUENCE:{seq}\n"
+    "#EXTINF:2.000,\nsegment{seq}.ts\n#EXTINF:2.000,\nsegment{next}.ts\n"
+)
+SDP = (
+    "v=0\r\no=- 0 0 IN IP4 127.0.0.1\r\ns=bench\r\nt=0 0\r\n"
+    "m=video 0 RTP/AVP 96\r\na=rtpmap:96 H264/90000\r\na=control:trackID=0\r\n"
+)
+
+
+class FakeMedia:
+    """HLS playlist and 2 s segments plus an RTSP server sending ``fps`` frames of ``bitrate`` bps."""
+
+    def __init__(self, fps: float, bitrate: float):
+        self.behaviour = Behaviour("media")
+        self.fps = fps
+        self.bitrate = bitrate
+        self._sessions = itertools.count(1)
+
+    async def serve_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await read_http_request(reader)
+                if request is None:
+                    break
+                _method, target, _headers, _body = request
+                await self.behaviour.wait()
+                if self.behaviour.fails():
+                    writer.write(http_response(500, b"fake failure", "text/plain"))
+                elif target.split("?", 1)[0].endswith(".m3u8"):
+                    seq = int(time.time() // 2)
+                    body = PLAYLIST.format(seq=seq, next=seq + 1).encode()
+                    writer.write(http_response(200, body, "application/vnd.apple.mpegurl"))
+                elif target.split("?", 1)[0].endswith(".ts"):
+                    body = b"\x47" * max(int(self.bitrate / 8 * 2), 188)
+                    writer.write(http_response(200, body, "video/mp2t"))
+                else:
+                    writer.write(http_response(404, b"not found", "text/plain"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_rtp(self, writer: asyncio.StreamWriter) -> None:
+        frame_bytes = max(int(self.bitrate / 8 / max(self.fps, 1)), 100)
+        packets_per_frame = max(1, frame_bytes // 1400)
+        payload = b"\x00" * min(frame_bytes // packets_per_frame, 1400)
+        seq = 0
+        timestamp = random.randrange(1 << 32)
+        interval = 1.0 / max(self.fps, 1)
+        next_at = time.monotonic()
+        while True:
+            for i in range(packets_per_frame):
+                marker = 0x80 if i == packets_per_frame - 1 else 0
+                header = struct.pack("!BBHII", 0x80, marker | 96, seq & 0xFFFF, timestamp & 0xFFFFFFFF, 0x42)
+                packet = header + payload
+                writer.write(b"$" + struct.pack("!BH", 0, len(packet)) + packet)
+                seq += 1
+            await writer.drain()
+            timestamp += int(90000 * interval)
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+
+    async def serve_rtsp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        sender: Optional[asyncio.Task] = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method = line.decode("latin-1").split(" ", 1)[0]
+                headers: Dict[str, str] = {}
+                while True:
+                    raw = await reader.readline()
+                    if raw in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = raw.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                await self.behaviour.wait()
+                cseq = headers.get("cseq", "0")
+                lines = ["RTSP/1.0 200 OK", f"CSeq: {cseq}"]
+                body = b""
+                if self.behaviour.fails() and method == "DESCRIBE":
+                    lines[0] = "RTSP/1.0 404 Not Found"
+                elif method == "OPTIONS":
+                    lines.append("Public: OPTIONS, DESCRIBE, SETUP, PLAY, TEARDOWN")
+                elif method == "DESCRIBE":
+                    body = SDP.encode()
+                    lines += ["Content-Type: application/sdp", f"Content-Length: {len(body)}"]
+                elif method == "SETUP":
+                    lines += [f"Session: {next(self._sessions):08d};timeout=60", "Transport: RTP/AVP/TCP;unicast;interleaved=0-1"]
+                elif method == "PLAY":
+                    lines.append("Range: npt=0.000-")
+                elif method == "TEARDOWN":
+                    if sender is not None:
+                        sender.cancel()
+                        sender = None
+                writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+                await writer.drain()
+                if method == "PLAY" and sender is None:
+                    sender = asyncio.create_task(self._send_rtp(writer))
+                if method == "TEARDOWN":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if sender is not None:
+                sender.cancel()
+            writer.close()
+
+
+async def run_media(http_port: int, rtsp_port: int, fps: float, bitrate: float) -> None:
+    media = FakeMedia(fps, bitrate)
+    http = await asyncio.start_server(media.serve_http, "127.0.0.1", http_port)
+    rtsp = await asyncio.start_server(media.serve_rtsp, "127.0.0.1", rtsp_port)
+    async with http, rtsp:
+        await asyncio.gather(http.serve_forever(), rtsp.serve_forever())
+
+
+# ------------------------------------------------------------------ executables
+
+# Smallest well-formed JPEG framing: SOI, filler, EOI.
+_JPEG = b"\xff\xd8" + b"\x00" * 16 * 1024 + b"\xff\xd9"
+
+
+def _fail(name: str) -> int:
+    sys.stderr.write(f"{name}: injected failure\n")
+    return 1
+
+
+def fake_amixer(args: List[str], behaviour: Behaviour) -> int:
+    if "-s" in args or "--stdin" in args:
+        # Coprocess mode: one command per line until stdin closes.
+        for _line in sys.stdin:
+            behaviour.sleep()
+        return 0
+    behaviour.sleep()
+    if behaviour.fails():
+        return _fail("amixer")
+    control = next((a for a in args if a not in ("-c", "-q", "get", "sset", "set") and not a.isdigit()), "Master")
+    print(f"Simple mixer control '{control}',0\n  Front Left: Playback 40 [63%] [-17.00dB] [on]")
+    return 0
+
+
+def fake_cec_ctl(args: List[str], behaviour: Behaviour) -> int:
+    if "--monitor" in args:
+        # Report power status every few seconds like a TV answering polls.
+        while True:
+            print("Received from TV to Playback Device 1 (0 to 4): REPORT_POWER_STATUS (0x90):", flush=True)
+            print("\tpwr-state: on (0x00)", flush=True)
+            time.sleep(5)
+    behaviour.sleep()
+    return _fail("cec-ctl") if behaviour.fails() else 0
+
+
+def fake_ffmpeg(args: List[str], behaviour: Behaviour) -> int:
+    behaviour.sleep()
+    if behaviour.fails():
+        return _fail("ffmpeg")
+    if "image2pipe" in args:
+        vf = args[args.index("-vf") + 1] if "-vf" in args else ""
+        match = re.search(r"fps=([0-9.]+)", vf)
+        interval = 1.0 / float(match.group(1)) if match and float(match.group(1)) > 0 else 1.0
+        try:
+            while True:
+                sys.stdout.buffer.write(_JPEG)
+                sys.stdout.buffer.flush()
+                time.sleep(interval)
+        except (BrokenPipeError, KeyboardInterrupt):
+            return 0
+    return 0
+
+
+def fake_ffprobe(args: List[str], behaviour: Behaviour) -> int:
+    behaviour.sleep()
+    if behaviour.fails():
+        return _fail("ffprobe")
+    print(json.dumps({"format": {"duration": "120.000000", "bit_rate": "128000"}}))
+    return 0
+
+
+def fake_aplay(args: List[str], behaviour: Behaviour) -> int:
+    while sys.stdin.buffer.read(65536):
+        pass
+    return 0
+
+
+def fake_docker_cli(args: List[str], behaviour: Behaviour) -> int:
+    behaviour.sleep()
+    if behaviour.fails():
+        return _fail("docker")
+    running = os.environ.get("BENCH_FAKE_DOCKER_CONTAINERS", "snapcast-client").split(",")
+    if args[:1] == ["ps"]:
+        print("\n".join(running))
+    elif args[:1] in (["start"], ["stop"]):
+        print(args[-1])
+    return 0
+
+
+EXECUTABLES = {
+    "amixer": fake_amixer,
+    "aplay": fake_aplay,
+    "cec-ctl": fake_cec_ctl,
+    "docker": fake_docker_cli,
+    "ffmpeg": fake_ffmpeg,
+    "ffprobe": fake_ffprobe,
+}
+
+
+def main() -> int:
+    if len(sys.argv) > 2 and sys.argv[1] == "bin":
+        name = sys.argv[2]
+        if name not in EXECUTABLES:
+            sys.stderr.write(f"unknown fake executable {name}\n")
+            return 127
+        return EXECUTABLES[name](sys.argv[3:], Behaviour(name))
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="server", required=True)
+    mpv = sub.add_parser("mpv", help="mpv JSON IPC server")
+    mpv.add_argument("--socket", required=True)
+    docker = sub.add_parser("docker", help="Docker Engine API stub")
+    docker.add_argument("--socket", required=True)
+    media = sub.add_parser("media", help="HLS + RTSP stand-in")
+    media.add_argument("--http-port", type=int, required=True)
+    media.add_argument("--rtsp-port", type=int, required=True)
+    media.add_argument("--fps", type=float, default=20.0)
+    media.add_argument("--bitrate", type=float, default=2_000_000.0)
+    args = parser.parse_args()
+
+    try:
+        if args.server == "mpv":
+            asyncio.run(run_mpv(args.socket))
+        elif args.server == "docker":
+            asyncio.run(run_docker(args.socket))
+        else:
+            asyncio.run(run_media(args.http_port, args.rtsp_port, args.fps, args.bitrate))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())